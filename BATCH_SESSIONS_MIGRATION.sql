@@ -0,0 +1,31 @@
+-- ================================
+-- BATCH SESSIONS FOR WORKSPACE PRE-WARMING
+-- Execute this in Supabase SQL Editor
+-- ================================
+
+-- 1. Scheduled class sessions per batch (read by the prewarm Lambda)
+CREATE TABLE IF NOT EXISTS batch_sessions (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    batch_id UUID NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    starts_at TIMESTAMPTZ NOT NULL,
+    ends_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 2. The prewarm Lambda looks up sessions starting in the next few minutes
+CREATE INDEX IF NOT EXISTS idx_batch_sessions_starts_at ON batch_sessions(starts_at);
+
+-- 3. RLS - staff manage, authenticated users view
+ALTER TABLE batch_sessions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Staff can manage batch sessions" ON batch_sessions;
+DROP POLICY IF EXISTS "Authenticated users can view batch sessions" ON batch_sessions;
+
+CREATE POLICY "Staff can manage batch sessions" ON batch_sessions FOR ALL USING (
+    EXISTS (SELECT 1 FROM profiles WHERE id = auth.uid() AND role IN ('admin', 'superadmin', 'trainer'))
+);
+
+CREATE POLICY "Authenticated users can view batch sessions" ON batch_sessions FOR SELECT USING (
+    auth.role() = 'authenticated'
+);
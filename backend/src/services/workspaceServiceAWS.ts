@@ -13,6 +13,13 @@ export type ProgressCallback = (message: string, progress: number) => void;
 export class WorkspaceServiceAWS {
     private readonly PROVISIONER_FUNCTION = 'apranova-lms-production-workspace-provisioner';
     private readonly TERMINATOR_FUNCTION = 'apranova-lms-production-workspace-terminator';
+    private readonly HEARTBEAT_FUNCTION = 'apranova-lms-production-workspace-heartbeat';
+
+    // Heartbeats are buffered per student and sent to the Lambda in batches
+    private readonly HEARTBEAT_FLUSH_MS = 5000;
+    private readonly HEARTBEAT_BATCH_SIZE = 500;
+    private pendingHeartbeats = new Map<string, number>();
+    private heartbeatTimer: ReturnType<typeof setTimeout> | null = null;
 
     // ==================== WORKSPACE PROVISIONING ====================
 
@@ -261,6 +268,9 @@ export class WorkspaceServiceAWS {
 
     async updateActivity(studentId: string) {
         try {
+            // The heartbeat Lambda bumps last_activity, which the terminator's idle check reads
+            this.queueHeartbeat(studentId);
+
             await supabaseAdmin
                 .from('students')
                 .update({ workspace_last_activity: new Date().toISOString() })
@@ -269,6 +279,37 @@ export class WorkspaceServiceAWS {
             console.error(`Failed to update activity for student ${studentId}:`, error);
         }
     }
+
+    private queueHeartbeat(studentId: string) {
+        this.pendingHeartbeats.set(studentId, Math.floor(Date.now() / 1000));
+
+        if (this.pendingHeartbeats.size >= this.HEARTBEAT_BATCH_SIZE) {
+            void this.flushHeartbeats();
+        } else if (!this.heartbeatTimer) {
+            this.heartbeatTimer = setTimeout(() => void this.flushHeartbeats(), this.HEARTBEAT_FLUSH_MS);
+        }
+    }
+
+    private async flushHeartbeats() {
+        if (this.heartbeatTimer) {
+            clearTimeout(this.heartbeatTimer);
+            this.heartbeatTimer = null;
+        }
+        if (this.pendingHeartbeats.size === 0) return;
+
+        const heartbeats = Array.from(this.pendingHeartbeats, ([student_id, timestamp]) => ({ student_id, timestamp }));
+        this.pendingHeartbeats.clear();
+
+        try {
+            await lambda.invoke({
+                FunctionName: this.HEARTBEAT_FUNCTION,
+                InvocationType: 'Event' as const, // Async invocation
+                Payload: JSON.stringify({ body: JSON.stringify({ heartbeats }) }),
+            });
+        } catch (error) {
+            console.error(`Failed to send ${heartbeats.length} heartbeat(s):`, error);
+        }
+    }
 }
 
 export const workspaceServiceAWS = new WorkspaceServiceAWS();
@@ -0,0 +1,214 @@
+"""
+Workspace router.
+
+Sits behind the ALB's ws-* wildcard rule and proxies each connection to the
+workspace task named by the Host header (ws-<short_id>.<domain>). Routes come
+from the workspaces table's sparse route_host-index, which holds only rows with
+a task_ip, and are cached in memory: the index is re-read on an interval and
+an unknown host is looked up with a keyed query.
+
+Requests are proxied one per upstream connection: the router asks the
+workspace to close after responding, which the ALB honours, so a reused ALB
+connection can never carry a request to the wrong workspace. WebSocket
+upgrades are spliced through untouched.
+"""
+import asyncio
+import os
+import time
+import boto3
+
+# Port the ALB target group sends traffic to
+LISTEN_PORT = int(os.environ.get('LISTEN_PORT', 8080))
+# Route index refresh interval, and how long an unknown host is remembered as missing (seconds)
+ROUTE_REFRESH_SECONDS = int(os.environ.get('ROUTE_REFRESH_SECONDS', 10))
+MISS_REFRESH_SECONDS = int(os.environ.get('MISS_REFRESH_SECONDS', 2))
+# Sparse GSI: route_host (ws-<short_id>) -> task_ip, task_port
+ROUTE_INDEX = 'route_host-index'
+# Workspace port when a row doesn't record one (Code-Server)
+DEFAULT_TASK_PORT = 8080
+CONNECT_TIMEOUT = 5
+MAX_HEADER_BYTES = 65536
+
+dynamodb = boto3.client('dynamodb')
+
+
+class RouteTable:
+    """ws-<short_id> -> (task_ip, task_port), loaded from the workspaces table's route index"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.routes = {}
+        # name -> when a keyed lookup last found nothing, and lookups in flight
+        self.misses = {}
+        self.pending = {}
+
+    @staticmethod
+    def parse(item):
+        task_ip = item.get('task_ip', {}).get('S')
+        if not task_ip:
+            return None
+        return task_ip, int(item.get('task_port', {}).get('N', DEFAULT_TASK_PORT))
+
+    def scan(self):
+        """Every routable workspace; the sparse index holds nothing else"""
+        routes = {}
+        kwargs = {'TableName': self.table_name, 'IndexName': ROUTE_INDEX}
+        while True:
+            page = dynamodb.scan(**kwargs)
+            for item in page.get('Items', []):
+                route = self.parse(item)
+                if route:
+                    routes[item['route_host']['S']] = route
+            if 'LastEvaluatedKey' not in page:
+                return routes
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    def query(self, name):
+        """The route for one host, read by key (students sharing a short id share it)"""
+        response = dynamodb.query(
+            TableName=self.table_name,
+            IndexName=ROUTE_INDEX,
+            KeyConditionExpression='route_host = :name',
+            ExpressionAttributeValues={':name': {'S': name}}
+        )
+        routes = [self.parse(item) for item in response.get('Items', [])]
+        return next((route for route in reversed(routes) if route), None)
+
+    async def refresh(self):
+        try:
+            self.routes = await asyncio.to_thread(self.scan)
+            self.misses.clear()
+        except Exception as e:
+            print(f"Error refreshing routes: {str(e)}")
+
+    async def fetch(self, name):
+        try:
+            route = await asyncio.to_thread(self.query, name)
+        except Exception as e:
+            print(f"Error looking up route for {name}: {str(e)}")
+            route = None
+        if route:
+            self.routes[name] = route
+            self.misses.pop(name, None)
+        else:
+            self.misses[name] = time.monotonic()
+        return route
+
+    async def lookup(self, name):
+        route = self.routes.get(name)
+        if route is not None:
+            return route
+        # Unknown hosts are asked about at most every MISS_REFRESH_SECONDS each
+        if time.monotonic() - self.misses.get(name, float('-inf')) < MISS_REFRESH_SECONDS:
+            return None
+        # Concurrent misses for one host share one query
+        if name not in self.pending:
+            self.pending[name] = asyncio.ensure_future(self.fetch(name))
+            self.pending[name].add_done_callback(lambda _: self.pending.pop(name, None))
+        return await asyncio.shield(self.pending[name])
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(ROUTE_REFRESH_SECONDS)
+            await self.refresh()
+
+
+def parse_head(head):
+    """Split a request head into (request line, [(name, value)])"""
+    lines = head.decode('latin-1').split('\r\n')
+    headers = []
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def build_head(request_line, headers):
+    lines = [request_line] + [f"{name}: {value}" for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def respond(writer, status, body):
+    payload = body.encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\n"
+        f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def handle(client_reader, client_writer, routes):
+    try:
+        try:
+            head = await client_reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return
+
+        request_line, headers = parse_head(head)
+        values = {name.lower(): value for name, value in headers}
+        name = values.get('host', '').split('.', 1)[0].split(':', 1)[0].lower()
+
+        if not name.startswith('ws-'):
+            # ALB health checks and anything else not aimed at a workspace
+            await respond(client_writer, '200 OK', 'ok')
+            return
+
+        route = await routes.lookup(name)
+        if not route:
+            await respond(client_writer, '503 Service Unavailable', 'Workspace is not running')
+            return
+
+        try:
+            upstream_reader, upstream_writer = await asyncio.wait_for(
+                asyncio.open_connection(*route), CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            await respond(client_writer, '502 Bad Gateway', 'Workspace is starting')
+            return
+
+        if values.get('upgrade', '').lower() != 'websocket':
+            headers = [(k, v) for k, v in headers if k.lower() not in ('connection', 'keep-alive')]
+            headers.append(('Connection', 'close'))
+
+        upstream_writer.write(build_head(request_line, headers))
+        await upstream_writer.drain()
+        await asyncio.gather(
+            pipe(client_reader, upstream_writer),
+            pipe(upstream_reader, client_writer)
+        )
+    except Exception as e:
+        print(f"Error proxying request: {str(e)}")
+    finally:
+        client_writer.close()
+
+
+async def main():
+    routes = RouteTable(os.environ['DYNAMODB_TABLE'])
+    await routes.refresh()
+    asyncio.create_task(routes.refresh_forever())
+
+    server = await asyncio.start_server(
+        lambda r, w: handle(r, w, routes), '0.0.0.0', LISTEN_PORT, limit=MAX_HEADER_BYTES
+    )
+    print(f"Workspace router listening on {LISTEN_PORT} with {len(routes.routes)} route(s)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Local AWS stand-ins for the benchmark: a moto-backed account holding the
+resources the lambda_code handlers expect (cluster, task definition, VPC,
+ALB listener and the DynamoDB tables as modules/lambda/main.tf defines
+them), plus the environment variables that point the handlers at them.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+import boto3
+from moto import mock_aws
+
+LAMBDA_CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_code')
+if LAMBDA_CODE not in sys.path:
+    sys.path.insert(0, LAMBDA_CODE)
+
+REGION = 'us-east-1'
+DOMAIN = 'bench.local'
+
+def create_tables(dynamodb):
+    """Workspaces, rule priorities, warm pool and Supabase retry tables with their GSIs"""
+    dynamodb.create_table(
+        TableName='workspaces',
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'student_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'student_id', 'AttributeType': 'S'},
+            {'AttributeName': 'task_arn', 'AttributeType': 'S'},
+            {'AttributeName': 'service_name', 'AttributeType': 'S'},
+            {'AttributeName': 'expires_bucket', 'AttributeType': 'N'},
+            {'AttributeName': 'expires_at', 'AttributeType': 'N'},
+            {'AttributeName': 'route_host', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'task_arn-index',
+                'KeySchema': [{'AttributeName': 'task_arn', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'service_name-index',
+                'KeySchema': [{'AttributeName': 'service_name', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'expiry-index',
+                'KeySchema': [
+                    {'AttributeName': 'expires_bucket', 'KeyType': 'HASH'},
+                    {'AttributeName': 'expires_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'route_host-index',
+                'KeySchema': [{'AttributeName': 'route_host', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['task_ip', 'task_port']}
+            }
+        ]
+    )
+    dynamodb.create_table(
+        TableName='rule-priorities',
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[
+            {'AttributeName': 'listener_arn', 'KeyType': 'HASH'},
+            {'AttributeName': 'priority', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'listener_arn', 'AttributeType': 'S'},
+            {'AttributeName': 'priority', 'AttributeType': 'N'}
+        ]
+    )
+    dynamodb.create_table(
+        TableName='warm-pool',
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'task_arn', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'task_arn', 'AttributeType': 'S'},
+            {'AttributeName': 'pool_status', 'AttributeType': 'S'},
+            {'AttributeName': 'started_at', 'AttributeType': 'N'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'pool_status-index',
+            'KeySchema': [
+                {'AttributeName': 'pool_status', 'KeyType': 'HASH'},
+                {'AttributeName': 'started_at', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }]
+    )
+    dynamodb.create_table(
+        TableName='supabase-retry',
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'student_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'student_id', 'AttributeType': 'S'}]
+    )
+
+def create_infrastructure():
+    """Create the account resources; returns the handler environment"""
+    ec2 = boto3.client('ec2', region_name=REGION)
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    # As modules/vpc sets it; task ENIs get private DNS names from it
+    ec2.modify_vpc_attribute(VpcId=vpc_id, EnableDnsHostnames={'Value': True})
+    subnets = [
+        ec2.create_subnet(VpcId=vpc_id, CidrBlock=f'10.0.{i}.0/24', AvailabilityZone=f'{REGION}{zone}')['Subnet']['SubnetId']
+        for i, zone in enumerate('ab')
+    ]
+    security_group = ec2.create_security_group(
+        GroupName='workspaces', Description='Benchmark workspaces', VpcId=vpc_id
+    )['GroupId']
+    
+    elbv2 = boto3.client('elbv2', region_name=REGION)
+    alb_arn = elbv2.create_load_balancer(
+        Name='bench', Subnets=subnets, SecurityGroups=[security_group], Type='application'
+    )['LoadBalancers'][0]['LoadBalancerArn']
+    default_tg = elbv2.create_target_group(
+        Name='default', Protocol='HTTP', Port=80, VpcId=vpc_id, TargetType='ip'
+    )['TargetGroups'][0]['TargetGroupArn']
+    listener_arn = elbv2.create_listener(
+        LoadBalancerArn=alb_arn, Protocol='HTTP', Port=80,
+        DefaultActions=[{'Type': 'forward', 'TargetGroupArn': default_tg}]
+    )['Listeners'][0]['ListenerArn']
+    
+    ecs = boto3.client('ecs', region_name=REGION)
+    ecs.create_cluster(clusterName='bench', capacityProviders=['FARGATE', 'FARGATE_SPOT'])
+    task_definition = ecs.register_task_definition(
+        family='bench-codeserver',
+        requiresCompatibilities=['FARGATE'],
+        networkMode='awsvpc',
+        cpu='1024',
+        memory='2048',
+        containerDefinitions=[
+            {'name': 'codeserver', 'image': 'codeserver:latest', 'memory': 1024, 'portMappings': [{'containerPort': 8080}]},
+            {'name': 'openvscode', 'image': 'openvscode:latest', 'memory': 1024, 'portMappings': [{'containerPort': 3000}]}
+        ]
+    )['taskDefinition']['taskDefinitionArn']
+    
+    create_tables(boto3.client('dynamodb', region_name=REGION))
+    
+    return {
+        'ECS_CLUSTER': 'bench',
+        'TASK_DEFINITION': task_definition,
+        'SUBNETS': ','.join(subnets),
+        'SECURITY_GROUP': security_group,
+        'VPC_ID': vpc_id,
+        'ALB_ARN': alb_arn,
+        'ALB_LISTENER_ARN': listener_arn,
+        'DOMAIN': DOMAIN,
+        'DYNAMODB_TABLE': 'workspaces',
+        'PRIORITY_TABLE': 'rule-priorities',
+        'WARM_POOL_TABLE': 'warm-pool',
+        'SUPABASE_RETRY_TABLE': 'supabase-retry'
+    }
+
+@contextmanager
+def aws_environment(extra_env=None, session_hooks=None):
+    """
+    Run the block against a fresh mocked account. Handler modules read
+    their environment at import, so import them inside the block.
+    mock_aws drops boto3's default session, so the one the handlers' clients
+    come from is made here; session_hooks(session) runs on it before any of
+    those clients exist.
+    """
+    os.environ.update({
+        'AWS_DEFAULT_REGION': REGION,
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'TRACE_LOG': 'false'
+    })
+    with mock_aws():
+        boto3.setup_default_session(region_name=REGION)
+        if session_hooks:
+            session_hooks(boto3.DEFAULT_SESSION)
+        env = {**create_infrastructure(), **(extra_env or {})}
+        os.environ.update(env)
+        reset_process_state()
+        yield env
+        reset_process_state()
+
+def reset_process_state():
+    """Forget clients and caches a previous run left in warm module state"""
+    warm_state = (
+        ('aws_clients', 'instances'),
+        ('rule_priorities', 'rule_indexes'),
+        ('routing', 'shard_map'),
+        ('ecs_waiter', 'watched'),
+        ('ecs_waiter', 'latest')
+    )
+    for name, attribute in warm_state:
+        module = sys.modules.get(name)
+        if module is not None:
+            getattr(module, attribute).clear()
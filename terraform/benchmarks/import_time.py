@@ -0,0 +1,87 @@
+"""
+Cold-start import budget for the lambda_code handlers.
+
+Imports each handler module in a fresh interpreter, as the Lambda init
+phase does, and reports the median time over several runs. Fails (exit 1)
+when a handler exceeds the budget or creates an AWS client at import time -
+clients come from aws_clients and should only be built on first use.
+
+    python terraform/benchmarks/import_time.py --runs 5 --budget-ms 350
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_code')
+
+HANDLERS = [
+    'index',
+    'provisioner',
+    'provisioner_v2',
+    'workspace_cleanup',
+    'workspace_status',
+    'terminator',
+    'warm_pool',
+    'heartbeat',
+    'prewarm',
+    'reconciler',
+    'supabase_sync'
+]
+
+# Runs in the child interpreter: time the import, then count clients it built
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+aws_clients = sys.modules.get('aws_clients')
+print(json.dumps({{'ms': elapsed, 'clients': len(aws_clients.instances) if aws_clients else 0}}))
+"""
+
+def measure(module):
+    env = {
+        **os.environ,
+        'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'),
+        'TRACE_LOG': 'false'
+    }
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=LAMBDA_CODE, env=env, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 350)))
+    parser.add_argument('handlers', nargs='*', default=HANDLERS)
+    args = parser.parse_args()
+    
+    failed = False
+    print(f"{'handler':<20} {'median ms':>10} {'max ms':>10} {'clients':>8}")
+    for module in args.handlers:
+        try:
+            samples = [measure(module) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<20} {str(e)}")
+            failed = True
+            continue
+        times = [sample['ms'] for sample in samples]
+        clients = max(sample['clients'] for sample in samples)
+        median = statistics.median(times)
+        over = median > args.budget_ms or clients > 0
+        failed = failed or over
+        flag = '  OVER BUDGET' if median > args.budget_ms else ''
+        flag += '  EAGER CLIENTS' if clients else ''
+        print(f"{module:<20} {median:>10.1f} {max(times):>10.1f} {clients:>8}{flag}")
+    
+    print(f"budget: {args.budget_ms:.0f} ms median per handler import")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Offline load test for the provisioning Lambdas.
+
+Runs the lambda_code handlers in-process against a moto-backed account
+(fixtures.py) and a stub Supabase REST server (supabase_stub.py), with N
+simulated students hitting them concurrently, and reports per handler:
+latency percentiles, AWS API calls per operation and the DynamoDB read/write
+capacity the calls consumed (as moto reports it).
+
+    python terraform/benchmarks/load_test.py --students 50 --concurrency 10
+    python terraform/benchmarks/load_test.py --json after.json --baseline before.json
+
+Save a run with --json before a change and pass it as --baseline after it
+to print the difference.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from fixtures import aws_environment
+from supabase_stub import SupabaseStub
+
+# DynamoDB operations that accept ReturnConsumedCapacity, and which of them read
+CAPACITY_OPERATIONS = {
+    'GetItem', 'BatchGetItem', 'Query', 'Scan',
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'
+}
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan'}
+
+SCENARIOS = ['index', 'provisioner', 'provisioner_v2']
+
+class ApiStats:
+    """Counts every AWS call and the DynamoDB capacity it consumed, per phase"""
+    def __init__(self, aws_latency_ms=0):
+        self.aws_latency_ms = aws_latency_ms
+        self.phase = None
+        self.calls = {}
+        self.capacity = {}
+        self.lock = threading.Lock()
+    
+    def install(self, session):
+        # Clients copy the session's handlers when created, so install before any exist
+        # (aws_environment calls this on each mocked account's default session)
+        session.events.register('provide-client-params.dynamodb', self.request_capacity)
+        session.events.register('before-call', self.before_call)
+        session.events.register('after-call', self.after_call)
+    
+    def request_capacity(self, params, model, **kwargs):
+        if model.name in CAPACITY_OPERATIONS:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    
+    def before_call(self, **kwargs):
+        if self.aws_latency_ms and self.phase:
+            time.sleep(self.aws_latency_ms / 1000)
+    
+    def after_call(self, parsed, model, **kwargs):
+        if not self.phase:
+            return  # Fixture setup
+        operation = f"{model.service_model.service_name}.{model.name}"
+        consumed = parsed.get('ConsumedCapacity') if isinstance(parsed, dict) else None
+        units = sum(c.get('CapacityUnits', 0) for c in (consumed if isinstance(consumed, list) else [consumed or {}]))
+        with self.lock:
+            calls = self.calls.setdefault(self.phase, {})
+            calls[operation] = calls.get(operation, 0) + 1
+            capacity = self.capacity.setdefault(self.phase, {'rcu': 0.0, 'wcu': 0.0})
+            capacity['rcu' if model.name in READ_OPERATIONS else 'wcu'] += units
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + timeout_seconds
+    
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+class Runner:
+    def __init__(self, stats, concurrency, timeout_seconds, verbose=False):
+        self.stats = stats
+        self.concurrency = concurrency
+        self.timeout_seconds = timeout_seconds
+        self.verbose = verbose
+        self.latencies = {}
+        self.errors = {}
+    
+    def wave(self, phase, handler, events):
+        """Invoke handler once per event, concurrently; returns the responses in order"""
+        self.stats.phase = phase
+        
+        def invoke(event):
+            start = time.perf_counter()
+            try:
+                result = handler(event, FakeContext(self.timeout_seconds))
+                failed = not isinstance(result, dict) or result.get('statusCode', 200) >= 500 or bool(result.get('batchItemFailures'))
+            except Exception as e:
+                result, failed = {'error': str(e)}, True
+            return (time.perf_counter() - start) * 1000, failed, result
+        
+        with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stdout if self.verbose else devnull):
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                outcomes = list(pool.map(invoke, events))
+        self.stats.phase = None
+        
+        self.latencies.setdefault(phase, []).extend(outcome[0] for outcome in outcomes)
+        self.errors[phase] = self.errors.get(phase, 0) + sum(1 for outcome in outcomes if outcome[1])
+        return [outcome[2] for outcome in outcomes]
+
+def body(result):
+    raw = (result or {}).get('body')
+    try:
+        return json.loads(raw) if isinstance(raw, str) else (raw or {})
+    except ValueError:
+        return {}
+
+def task_event(task_arn, student_id, workspace_id, last_status, ip=None):
+    """ECS Task State Change event detail as EventBridge delivers it"""
+    detail = {
+        'taskArn': task_arn,
+        'lastStatus': last_status,
+        'taskDefinitionArn': os.environ['TASK_DEFINITION'],
+        'createdAt': '2024-01-01T00:00:00Z',
+        'startedAt': '2024-01-01T00:00:30Z',
+        'overrides': {'containerOverrides': [{
+            'name': 'codeserver',
+            'environment': [
+                {'name': 'STUDENT_ID', 'value': student_id},
+                {'name': 'WORKSPACE_ID', 'value': workspace_id}
+            ]
+        }]}
+    }
+    if ip:
+        detail['attachments'] = [{'details': [{'name': 'privateIPv4Address', 'value': ip}]}]
+    if last_status == 'STOPPED':
+        detail['stopCode'] = 'UserInitiated'
+    return {'detail-type': 'ECS Task State Change', 'detail': detail}
+
+def sqs_batches(events, size):
+    """Events as the SQS event source delivers them, size messages per invocation"""
+    records = [{'messageId': str(uuid.uuid4()), 'body': json.dumps(event)} for event in events]
+    return [{'Records': records[start:start + size]} for start in range(0, len(records), size)]
+
+def request_event(student_id):
+    return {'body': json.dumps({'student_id': student_id})}
+
+def run_index(runner, students, args):
+    import index
+    events = [request_event(student_id) for _ in range(args.requests_per_student) for student_id in students]
+    runner.wave('index', index.lambda_handler, events)
+
+def run_provisioner_v2(runner, students, args):
+    import provisioner_v2
+    events = [request_event(student_id) for _ in range(args.requests_per_student) for student_id in students]
+    runner.wave('provisioner_v2', provisioner_v2.lambda_handler, events)
+
+def run_provisioner(runner, students, args):
+    """Submit, finalize on RUNNING, sweep with the terminator, then clean up the STOPPED events in SQS batches"""
+    import provisioner
+    import terminator
+    import workspace_cleanup
+    import workspace_state
+    
+    results = runner.wave('provisioner', provisioner.lambda_handler, [request_event(s) for s in students])
+    tasks = []
+    for i, (student_id, result) in enumerate(zip(students, results)):
+        task_arn = body(result).get('task_arn')
+        if task_arn:
+            row = workspace_state.get_workspace(student_id) or {}
+            tasks.append((task_arn, student_id, row.get('workspace_id', ''), f"10.0.{i // 250}.{i % 250 + 2}"))
+    
+    runner.wave('provisioner.finalize', provisioner.finalize_handler, [
+        task_event(arn, student_id, workspace_id, 'RUNNING', ip) for arn, student_id, workspace_id, ip in tasks
+    ])
+    
+    # INACTIVITY_TIMEOUT is 1 s in the benchmark, so every workspace is idle by now
+    time.sleep(1.5)
+    runner.wave('terminator', terminator.lambda_handler, [{}])
+    
+    stopped = [task_event(arn, student_id, workspace_id, 'STOPPED', ip) for arn, student_id, workspace_id, ip in tasks]
+    runner.wave('workspace_cleanup', workspace_cleanup.lambda_handler, sqs_batches(stopped, args.cleanup_batch_size))
+
+RUNNERS = {
+    'index': run_index,
+    'provisioner': run_provisioner,
+    'provisioner_v2': run_provisioner_v2
+}
+
+def summarize(runner, stats, supabase):
+    from tracing import percentile
+    handlers = {}
+    for phase, latencies in runner.latencies.items():
+        ordered = sorted(latencies)
+        if not ordered:
+            continue
+        handlers[phase] = {
+            'count': len(ordered),
+            'errors': runner.errors.get(phase, 0),
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+            'api_calls': dict(sorted(stats.calls.get(phase, {}).items())),
+            'rcu': round(stats.capacity.get(phase, {}).get('rcu', 0), 2),
+            'wcu': round(stats.capacity.get(phase, {}).get('wcu', 0), 2)
+        }
+    return {'handlers': handlers, 'supabase': supabase.stats()}
+
+def report(results, baseline=None):
+    print(f"{'handler':<22} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls':>6} {'RCU':>7} {'WCU':>7}")
+    for phase, result in results['handlers'].items():
+        calls = sum(result['api_calls'].values())
+        line = (
+            f"{phase:<22} {result['count']:>5} {result['errors']:>4} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+            f"{result['p99']:>9.1f} {calls:>6} {result['rcu']:>7.1f} {result['wcu']:>7.1f}"
+        )
+        before = (baseline or {}).get('handlers', {}).get(phase)
+        if before:
+            line += f"   p95 {result['p95'] - before['p95']:+.1f} ms, calls {calls - sum(before['api_calls'].values()):+d}"
+        print(line)
+    
+    print("\nAWS API calls per operation")
+    for phase, result in results['handlers'].items():
+        print(f"  {phase}")
+        for operation, count in result['api_calls'].items():
+            print(f"    {operation:<42} {count:>6}")
+    print(f"\nSupabase: {json.dumps(results['supabase'])}")
+
+def problems(results):
+    """Reasons the run can't be trusted: failed invocations, or handlers whose AWS calls went unrecorded"""
+    found = []
+    for phase, result in results['handlers'].items():
+        if result['errors']:
+            found.append(f"{phase}: {result['errors']} of {result['count']} invocations failed")
+        if not result['api_calls']:
+            found.append(f"{phase}: no AWS calls recorded")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests-per-student', type=int, default=2,
+                        help='Repeat requests per student (the first provisions, the rest exercise the cached path)')
+    parser.add_argument('--scenarios', nargs='*', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--cleanup-batch-size', type=int, default=10, help='Stopped-task events per SQS batch')
+    parser.add_argument('--aws-latency-ms', type=float, default=0, help='Added to every AWS call')
+    parser.add_argument('--supabase-latency-ms', type=float, default=0)
+    parser.add_argument('--supabase-throttle-rate', type=float, default=0.0, help='Share of Supabase requests answered 429')
+    parser.add_argument('--timeout', type=float, default=180, help='Simulated Lambda timeout (seconds)')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare against')
+    parser.add_argument('--verbose', action='store_true', help="Show the handlers' own output")
+    args = parser.parse_args()
+    
+    stats = ApiStats(args.aws_latency_ms)
+    
+    with SupabaseStub(args.supabase_latency_ms, args.supabase_throttle_rate, seed=1) as supabase:
+        # Handler modules read these at import
+        os.environ.update({
+            'SUPABASE_URL': supabase.url,
+            'SUPABASE_SERVICE_KEY': 'benchmark',
+            'INACTIVITY_TIMEOUT': '1',
+            'STATUS_FRESHNESS': '300'
+        })
+        # Distinct 8-character prefixes: services and hosts are named after them
+        seeded = random.Random(7)
+        students = [str(uuid.UUID(int=seeded.getrandbits(128), version=4)) for _ in range(args.students)]
+        supabase.seed_rows('students', [{'id': student_id} for student_id in students])
+        
+        runner = Runner(stats, args.concurrency, args.timeout, args.verbose)
+        for scenario in args.scenarios:
+            # Each scenario gets a fresh account so earlier rows don't short-circuit it
+            with aws_environment(session_hooks=stats.install):
+                RUNNERS[scenario](runner, students, args)
+        
+        results = summarize(runner, stats, supabase)
+    
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    failures = problems(results)
+    if failures:
+        sys.exit("\nBenchmark run failed:\n  " + "\n  ".join(failures))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Stand-in for the Supabase REST API (PostgREST) with injectable latency and
+throttling. Stores rows in memory per table, answers GET/POST/PATCH on
+/rest/v1/<table> and understands the eq./in. filters the handlers send.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+class SupabaseStub:
+    def __init__(self, latency_ms=0, throttle_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.tables = {}
+        self.requests = {}
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def seed_rows(self, table, rows):
+        with self.lock:
+            self.tables.setdefault(table, {}).update({row['id']: dict(row) for row in rows})
+    
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'throttled': self.throttled}
+    
+    def matches(self, row, filters):
+        for column, condition in filters.items():
+            operator, _, value = condition.partition('.')
+            if operator == 'eq' and str(row.get(column)) != value:
+                return False
+            if operator == 'in' and str(row.get(column)) not in value.strip('()').split(','):
+                return False
+        return True
+    
+    def handler_class(self):
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def respond(self, status, body=None):
+                payload = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def handle_request(self, method):
+                parsed = urlparse(self.path)
+                table = parsed.path.rsplit('/', 1)[-1]
+                with stub.lock:
+                    stub.requests[method] = stub.requests.get(method, 0) + 1
+                    throttled = stub.random.random() < stub.throttle_rate
+                    if throttled:
+                        stub.throttled += 1
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000)
+                if throttled:
+                    return self.respond(429, {'message': 'Too many requests'})
+                
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'null')
+                params = dict(parse_qsl(parsed.query))
+                select = params.pop('select', None)
+                for control in ('order', 'limit', 'offset', 'on_conflict'):
+                    params.pop(control, None)
+                
+                with stub.lock:
+                    rows = stub.tables.setdefault(table, {})
+                    if method == 'GET':
+                        found = [row for row in rows.values() if stub.matches(row, params)]
+                        if select and select != '*':
+                            columns = select.split(',')
+                            found = [{column: row.get(column) for column in columns} for row in found]
+                        return self.respond(200, found)
+                    if method == 'PATCH':
+                        for row in rows.values():
+                            if stub.matches(row, params):
+                                row.update(body or {})
+                        return self.respond(204)
+                    # POST: insert, or upsert on id
+                    for row in body if isinstance(body, list) else [body]:
+                        rows.setdefault(row.get('id'), {}).update(row)
+                    return self.respond(201)
+            
+            def do_GET(self):
+                self.handle_request('GET')
+            
+            def do_PATCH(self):
+                self.handle_request('PATCH')
+            
+            def do_POST(self):
+                self.handle_request('POST')
+        
+        return Handler
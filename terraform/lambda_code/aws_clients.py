@@ -0,0 +1,59 @@
+import boto3
+import os
+import threading
+from botocore.config import Config
+from metrics import count_api_calls
+from tracing import trace_client
+
+# Seconds to open a connection / to wait for a response before retrying
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', 2))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', 10))
+# Attempts per call, including the first; adaptive mode also rate-limits the client when throttled
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', 4))
+# Kept-alive connections per client; worker pools share one client per service
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 16))
+
+CONFIG = Config(
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    retries={'mode': 'adaptive', 'max_attempts': AWS_MAX_ATTEMPTS},
+    tcp_keepalive=True,
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS
+)
+
+# ('client' | 'resource', service) -> instrumented boto3 object, shared by every module
+instances = {}
+instances_lock = threading.Lock()
+
+def get(kind, service):
+    """The process's client (or resource) for service, created with CONFIG on first use"""
+    key = (kind, service)
+    if key not in instances:
+        with instances_lock:
+            if key not in instances:
+                if kind == 'resource':
+                    created = boto3.resource(service, config=CONFIG)
+                    count_api_calls(created.meta.client)
+                else:
+                    created = count_api_calls(boto3.client(service, config=CONFIG))
+                instances[key] = trace_client(created)
+    return instances[key]
+
+class LazyClient:
+    """
+    Stands in for a boto3 client or resource at module level and creates it
+    on first use, so importing a handler builds no clients it won't call.
+    """
+    def __init__(self, kind, service):
+        self.kind = kind
+        self.service = service
+    
+    def __getattr__(self, name):
+        return getattr(get(self.kind, self.service), name)
+
+def client(service):
+    return LazyClient('client', service)
+
+def resource(service):
+    """Prefer client() on hot paths - the resource layer is slower to load and call"""
+    return LazyClient('resource', service)
@@ -0,0 +1,111 @@
+import os
+from aws_clients import client
+from metrics import put_metric
+from tracing import traced
+
+ecs = client('ecs')
+
+SPOT = 'FARGATE_SPOT'
+ON_DEMAND = 'FARGATE'
+# ECS stopCode of a task Fargate reclaimed for Spot capacity
+SPOT_INTERRUPTION = 'SpotInterruption'
+
+# Capacity providers per placement policy, preferred first; the last one is
+# the fallback for tasks the others could not place or lost to a reclaim
+POLICIES = {
+    'spot-first': [SPOT, ON_DEMAND],
+    'spot': [SPOT],
+    'on-demand': [ON_DEMAND]
+}
+# Policy for workspace tasks and services; batch requests may override it
+CAPACITY_POLICY = os.environ.get('CAPACITY_POLICY', 'spot-first')
+
+def providers(policy=None):
+    """Capacity providers of a policy (default CAPACITY_POLICY), preferred first"""
+    policy = policy or CAPACITY_POLICY
+    if policy not in POLICIES:
+        print(f"Unknown capacity policy {policy}, using spot-first")
+        policy = 'spot-first'
+    return POLICIES[policy]
+
+def strategy(provider, standby=()):
+    """capacityProviderStrategy placing everything on one provider, with standby providers at weight 0"""
+    return [{'capacityProvider': provider, 'weight': 1, 'base': 0}] + [
+        {'capacityProvider': other, 'weight': 0, 'base': 0} for other in standby
+    ]
+
+def preferred_strategy(policy=None):
+    """
+    Strategy for new workspace services: the preferred provider takes the
+    task and the rest of the policy is listed at weight 0. ECS doesn't place
+    on a weight 0 provider by itself, so workspace_status moves a service to
+    the fallback when its task is reclaimed or can't be placed. A desiredCount
+    1 service lands on its base provider, so there is no base here.
+    """
+    preferred, *standby = providers(policy)
+    return strategy(preferred, standby)
+
+def on_preferred(service, policy=None):
+    """Whether a described service still places its task on the policy's preferred provider"""
+    weighted = [item['capacityProvider'] for item in service.get('capacityProviderStrategy', []) if item.get('weight')]
+    return providers(policy)[0] in weighted
+
+def fallback_strategy(policy=None):
+    """Strategy for replacing a Spot-reclaimed workspace"""
+    return strategy(providers(policy)[-1])
+
+@traced()
+def run_task_placed(policy=None, fallback=False, **request):
+    """
+    ecs.run_task on the policy's providers in turn: tasks the preferred
+    provider could not place (no Spot capacity) are launched on the next.
+    fallback=True goes straight to the last one. Returns (tasks, failures
+    of the last attempt).
+    """
+    count = request.pop('count', 1)
+    tasks, failures = [], []
+    for provider in providers(policy)[-1:] if fallback else providers(policy):
+        response = ecs.run_task(count=count - len(tasks), capacityProviderStrategy=strategy(provider), **request)
+        placed = response.get('tasks', [])
+        failures = response.get('failures', [])
+        tasks.extend(placed)
+        put_metric('TaskPlacements', len(placed), CapacityProvider=provider)
+        if len(tasks) >= count:
+            break
+        print(f"{provider} placed {len(placed)} of {count} task(s): {failures}")
+    return tasks, failures
+
+@traced()
+def launch_workspace_task(student_id, workspace_id, policy=None, fallback=False):
+    """Start a student's codeserver task; returns the task, or None if none was placed"""
+    tasks, failures = run_task_placed(
+        policy, fallback,
+        cluster=os.environ['ECS_CLUSTER'],
+        taskDefinition=os.environ['TASK_DEFINITION'],
+        count=1,
+        networkConfiguration={
+            'awsvpcConfiguration': {
+                'subnets': os.environ['SUBNETS'].split(','),
+                'securityGroups': [os.environ['SECURITY_GROUP']],
+                'assignPublicIp': 'DISABLED'
+            }
+        },
+        overrides={
+            'containerOverrides': [{
+                'name': 'codeserver',
+                'environment': [
+                    {'name': 'STUDENT_ID', 'value': student_id},
+                    {'name': 'WORKSPACE_ID', 'value': workspace_id},
+                    {'name': 'PASSWORD', 'value': 'apranova123'}
+                ]
+            }]
+        },
+        tags=[
+            {'key': 'StudentId', 'value': student_id},
+            {'key': 'WorkspaceId', 'value': workspace_id}
+        ]
+    )
+    if not tasks:
+        print(f"run_task failed: {failures}")
+        return None
+    return tasks[0]
@@ -0,0 +1,64 @@
+import time
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from aws_clients import client
+from tracing import traced
+
+dynamodb = client('dynamodb')
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+# BatchWriteItem takes at most 25 requests, BatchGetItem at most 100 keys
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+# Rounds of UnprocessedItems/UnprocessedKeys resubmission before a batch call gives up
+BATCH_WRITE_RETRIES = 5
+
+def serialize_item(item):
+    """Low-level client item (or ExpressionAttributeValues) from a plain dict; None values are dropped"""
+    return {k: serializer.serialize(v) for k, v in item.items() if v is not None}
+
+def deserialize_item(item):
+    """Plain dict from a low-level client item"""
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+@traced()
+def batch_write(table_name, requests):
+    """
+    Send PutRequest/DeleteRequest entries with BatchWriteItem, 25 per call,
+    resubmitting unprocessed ones with backoff as the resource batch_writer does.
+    """
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        pending = {table_name: requests[start:start + BATCH_WRITE_SIZE]}
+        attempt = 0
+        while pending:
+            response = dynamodb.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
+            if pending:
+                attempt += 1
+                if attempt > BATCH_WRITE_RETRIES:
+                    raise RuntimeError(f"BatchWriteItem left {len(pending[table_name])} items unprocessed")
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+
+@traced()
+def batch_get(table_name, keys, **options):
+    """
+    Read items by key with BatchGetItem, 100 keys per call, resubmitting
+    unprocessed keys with backoff. options (ConsistentRead,
+    ProjectionExpression, ...) apply to every call. Returns the items
+    deserialized, in no particular order.
+    """
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table_name: {'Keys': keys[start:start + BATCH_GET_SIZE], **options}}
+        attempt = 0
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(deserialize_item(item) for item in response.get('Responses', {}).get(table_name, []))
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                if attempt > BATCH_WRITE_RETRIES:
+                    raise RuntimeError(f"BatchGetItem left {len(request[table_name]['Keys'])} keys unprocessed")
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+    return items
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+def get_task_ip(task):
+    """Extract the private IP from an ECS task (describe_tasks or event detail)"""
+    for attachment in task.get('attachments', []):
+        for detail in attachment.get('details', []):
+            if detail['name'] == 'privateIPv4Address':
+                return detail['value']
+    return None
+
+def get_task_environment(task):
+    """Collect container override environment variables of an ECS task"""
+    env = {}
+    for override in task.get('overrides', {}).get('containerOverrides', []):
+        for var in override.get('environment', []):
+            env[var['name']] = var['value']
+    return env
+
+def get_task_wait(task):
+    """Seconds an ECS task took from creation to started, or None if it hasn't started"""
+    created, started = task.get('createdAt'), task.get('startedAt')
+    if not created or not started:
+        return None
+    return (parse_task_time(started) - parse_task_time(created)).total_seconds()
+
+def parse_task_time(value):
+    """describe_tasks returns datetimes, EventBridge details ISO 8601 strings"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
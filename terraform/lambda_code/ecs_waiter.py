@@ -0,0 +1,136 @@
+import os
+import random
+import threading
+import time
+from aws_clients import client
+from ecs_tasks import get_task_ip
+from metrics import put_metric
+from tracing import traced
+
+ecs = client('ecs')
+
+# First poll interval after the immediate check; doubles (jittered) up to the max (seconds)
+WAIT_INITIAL_INTERVAL = float(os.environ.get('WAIT_INITIAL_INTERVAL', 0.5))
+WAIT_MAX_INTERVAL = float(os.environ.get('WAIT_MAX_INTERVAL', 5))
+# Longest a caller waits when it doesn't pass a timeout (seconds)
+WAIT_TIMEOUT = float(os.environ.get('WAIT_TIMEOUT', 120))
+# Invocation time left over for the caller when a wait is cut short (seconds)
+WAIT_SAFETY_MARGIN = float(os.environ.get('WAIT_SAFETY_MARGIN', 10))
+# describe_tasks accepts at most 100 tasks per call
+DESCRIBE_BATCH = 100
+
+# Statuses a task never comes back from
+STOPPING_STATUSES = {'DEACTIVATING', 'STOPPING', 'DEPROVISIONING', 'STOPPED', 'DELETED', 'MISSING'}
+
+# Shared by every waiter in the process, so concurrent waits share describe_tasks calls
+# (cluster, task ARN) -> number of waiters watching it
+watched = {}
+# (cluster, task ARN) -> latest description
+latest = {}
+watch_lock = threading.Lock()
+poll_lock = threading.Lock()
+# Monotonic time the last completed poll took its snapshot of watched tasks
+last_poll = [0.0]
+
+def is_running(task):
+    return task.get('lastStatus') == 'RUNNING'
+
+def has_ip(task):
+    """Running and attached to the network (the IP can lag the RUNNING status)"""
+    return is_running(task) and get_task_ip(task) is not None
+
+def describe_tasks(task_arns, cluster=None):
+    """
+    Describe any number of tasks, 100 per call. Returns {task_arn: task};
+    tasks ECS doesn't know read as lastStatus MISSING.
+    """
+    cluster = cluster or os.environ['ECS_CLUSTER']
+    arns = list(dict.fromkeys(task_arns))
+    found = {}
+    for i in range(0, len(arns), DESCRIBE_BATCH):
+        response = ecs.describe_tasks(cluster=cluster, tasks=arns[i:i + DESCRIBE_BATCH])
+        for task in response.get('tasks', []):
+            found[task['taskArn']] = task
+        for failure in response.get('failures', []):
+            found[failure['arn']] = {'taskArn': failure['arn'], 'lastStatus': 'MISSING', 'reason': failure.get('reason')}
+    return found
+
+def poll(since):
+    """
+    Describe every task any waiter in the process is watching, unless another
+    waiter's poll started after `since` - its results are recent enough.
+    """
+    with poll_lock:
+        if last_poll[0] >= since:
+            return
+        started = time.monotonic()
+        with watch_lock:
+            by_cluster = {}
+            for cluster, arn in watched:
+                by_cluster.setdefault(cluster, []).append(arn)
+        for cluster, arns in by_cluster.items():
+            described = describe_tasks(arns, cluster)
+            with watch_lock:
+                latest.update({(cluster, arn): task for arn, task in described.items()})
+        last_poll[0] = started
+
+def wait_deadline(context=None, timeout=None):
+    """Monotonic time a wait must end by: the timeout, cut short by the invocation's remaining time"""
+    budget = WAIT_TIMEOUT if timeout is None else timeout
+    if context is not None:
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000 - WAIT_SAFETY_MARGIN)
+    return time.monotonic() + budget
+
+@traced()
+def wait_for_tasks(task_arns, ready=is_running, context=None, timeout=None, cluster=None):
+    """
+    Wait until every task is ready (or stopping), the timeout passes or the
+    invocation is about to run out of time. Checks straight away, then polls
+    at a short interval that doubles with jitter; the interval resets when a
+    task advances (PROVISIONING -> PENDING -> RUNNING), as the next step tends
+    to follow soon. Returns {task_arn: last description, None if never seen}.
+    """
+    cluster = cluster or os.environ['ECS_CLUSTER']
+    keys = [(cluster, arn) for arn in dict.fromkeys(task_arns)]
+    deadline = wait_deadline(context, timeout)
+    with watch_lock:
+        for key in keys:
+            watched[key] = watched.get(key, 0) + 1
+    start = time.monotonic()
+    
+    interval = WAIT_INITIAL_INTERVAL
+    statuses = {}
+    try:
+        while True:
+            # A poll another waiter made since registering, within half an interval, will do
+            poll(max(start, time.monotonic() - interval / 2))
+            with watch_lock:
+                tasks = {arn: latest.get((cluster, arn)) for _, arn in keys}
+            pending = [
+                arn for arn, task in tasks.items()
+                if not task or not (ready(task) or task.get('lastStatus') in STOPPING_STATUSES)
+            ]
+            if not pending:
+                break
+            
+            progress = {arn: tasks[arn].get('lastStatus') for arn in pending if tasks[arn]}
+            if statuses and any(statuses.get(arn) != status for arn, status in progress.items()):
+                interval = WAIT_INITIAL_INTERVAL
+            statuses = progress
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"Gave up waiting for {len(pending)} task(s): {pending[:5]}")
+                break
+            time.sleep(min(random.uniform(interval / 2, interval), remaining))
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
+    finally:
+        with watch_lock:
+            for key in keys:
+                watched[key] -= 1
+                if not watched[key]:
+                    del watched[key]
+                    latest.pop(key, None)
+    
+    put_metric('EcsReadinessWait', (time.monotonic() - start) * 1000, 'Milliseconds')
+    return tasks
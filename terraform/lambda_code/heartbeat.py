@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import client
+from workspace_expiry import expiry_fields
+
+dynamodb = client('dynamodb')
+
+# Skip the write if the stored last_activity is newer than this (seconds)
+HEARTBEAT_GRANULARITY = int(os.environ.get('HEARTBEAT_GRANULARITY', 60))
+HEARTBEAT_CONCURRENCY = int(os.environ.get('HEARTBEAT_CONCURRENCY', 10))
+# Students tracked in last_written before it is reset
+HEARTBEAT_CACHE_SIZE = int(os.environ.get('HEARTBEAT_CACHE_SIZE', 10000))
+
+# student_id -> last timestamp this container wrote or found already current.
+# A failed conditional write is still billed, so heartbeats inside the
+# granularity window are skipped here without calling DynamoDB.
+last_written = {}
+
+def lambda_handler(event, context):
+    """
+    Records IDE activity for one or many students.
+    Accepts {"heartbeats": [{"student_id": ..., "timestamp": ...}, ...]}
+    or a single {"student_id": ...}. Heartbeats are coalesced per student
+    and only written when the stored value is older than the granularity.
+    """
+    try:
+        body = json.loads(event.get('body', '{}')) if isinstance(event.get('body'), str) else event.get('body', event)
+        heartbeats = body.get('heartbeats')
+        if heartbeats is None:
+            heartbeats = [body] if body.get('student_id') else []
+        if not isinstance(heartbeats, list):
+            return response(400, {'error': 'heartbeats must be a list'})
+        
+        latest, invalid = coalesce_heartbeats(heartbeats, int(time.time()))
+        if not latest:
+            return response(400, {'error': 'student_id required', 'invalid': invalid})
+        
+        with ThreadPoolExecutor(max_workers=HEARTBEAT_CONCURRENCY) as pool:
+            results = list(pool.map(lambda item: record_activity(*item), latest.items()))
+        
+        return response(200, {
+            'received': len(heartbeats),
+            'students': len(latest),
+            'written': results.count(True),
+            'skipped': results.count(False),
+            'failed': results.count(None),
+            'invalid': invalid
+        })
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return response(500, {'error': str(e)})
+
+def coalesce_heartbeats(heartbeats, now):
+    """
+    Keep the newest timestamp per student, never later than now. Entries
+    without a student_id or with an unreadable timestamp are dropped on
+    their own rather than failing the batch. Returns (latest, invalid count).
+    """
+    latest = {}
+    invalid = 0
+    for heartbeat in heartbeats:
+        student_id = heartbeat.get('student_id') if isinstance(heartbeat, dict) else None
+        if not student_id or not isinstance(student_id, str):
+            invalid += 1
+            continue
+        try:
+            timestamp = min(int(heartbeat.get('timestamp') or now), now)
+        except (TypeError, ValueError, OverflowError):
+            invalid += 1
+            continue
+        if timestamp > latest.get(student_id, 0):
+            latest[student_id] = timestamp
+    return latest, invalid
+
+def record_activity(student_id, timestamp):
+    """
+    Bump last_activity (and the expiry index keys) for a running workspace.
+    Returns False when the write was skipped because the stored value is
+    recent enough or the workspace is not running, None if it failed.
+    """
+    if timestamp - last_written.get(student_id, 0) < HEARTBEAT_GRANULARITY:
+        return False
+    expiry = expiry_fields(timestamp)
+    try:
+        dynamodb.update_item(
+            TableName=os.environ['DYNAMODB_TABLE'],
+            Key={'student_id': {'S': student_id}},
+            UpdateExpression='SET last_activity = :ts, expires_at = :expires_at, expires_bucket = :expires_bucket',
+            ConditionExpression=(
+                'attribute_exists(student_id) AND #status = :running AND '
+                '(attribute_not_exists(last_activity) OR last_activity < :stale)'
+            ),
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':ts': {'N': str(timestamp)},
+                ':expires_at': {'N': str(expiry['expires_at'])},
+                ':expires_bucket': {'N': str(expiry['expires_bucket'])},
+                ':running': {'S': 'running'},
+                ':stale': {'N': str(timestamp - HEARTBEAT_GRANULARITY)}
+            }
+        )
+        remember_write(student_id, timestamp)
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        remember_write(student_id, timestamp)
+        return False
+    except Exception as e:
+        print(f"Error recording activity for {student_id}: {str(e)}")
+        return None
+
+def remember_write(student_id, timestamp):
+    if len(last_written) >= HEARTBEAT_CACHE_SIZE and student_id not in last_written:
+        last_written.clear()
+    last_written[student_id] = max(timestamp, last_written.get(student_id, 0))
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
@@ -1,200 +1,547 @@
 ﻿import json
-import boto3
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import client
+from capacity import preferred_strategy
+from ecs_waiter import describe_tasks, is_running
+from metrics import flush_metrics, timer
+from provisioner import finalize_workspace
+from routing import all_shards, router_mode, shard_for, workspace_host, workspace_shard
+from rule_priorities import create_listener_rule, find_rule, rule_index
+from supabase_sync import sync_statuses
+from tracing import annotate, carry_context, trace_handler, traced
+from warm_pool import claim_warm_task, release_claimed_task, request_replenish
+from workspace_expiry import expiry_fields
+from workspace_state import (
+    RUNNING, SUSPENDED, TERMINATED, acquire_lease, create_workspace, get_workspace, record_fields, release_lease,
+    transition
+)
+from workspace_status import cached_status, status_fields, touch_status
 
-ecs = boto3.client('ecs')
-elbv2 = boto3.client('elbv2')
-dynamodb = boto3.resource('dynamodb')
+ecs = client('ecs')
+elbv2 = client('elbv2')
 
-def ensure_alb_rule(service_name, domain, short_id):
-    """Ensure ALB rule exists for the workspace"""
-    listener_arn = os.environ['ALB_LISTENER_ARN']
+# Concurrent per-student provisioning chains for batch requests
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 8))
+
+@traced()
+def ensure_alb_rule(service_name, shard, short_id):
+    """
+    Ensure ALB rule exists for the workspace on its shard's listener, returning the new rule if one was created.
+    Existing rules are found in the cached host index, so the common case makes no ELB calls.
+    """
+    listener_arn = shard['listener_arn']
+    domain = shard['domain']
     tg_name = f"ws-{short_id}"[:32]
     
+    # Check if rule already exists
+    if find_rule(listener_arn, f"{service_name}.{domain}"):
+        return None  # Rule exists
+    
     try:
         tg_response = elbv2.describe_target_groups(Names=[tg_name])
         tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
     except:
-        return  # No target group means fresh provision needed
-    
-    # Check if rule already exists
-    rules = elbv2.describe_rules(ListenerArn=listener_arn)
-    for rule in rules['Rules']:
-        if rule.get('Conditions'):
-            for cond in rule['Conditions']:
-                if cond.get('HostHeaderConfig', {}).get('Values', []):
-                    if f"{service_name}.{domain}" in cond['HostHeaderConfig']['Values']:
-                        return  # Rule exists
+        return None  # No target group means fresh provision needed
     
     # Create rule if missing
-    priorities = [int(r['Priority']) for r in rules['Rules'] if r['Priority'] != 'default']
-    priority = max(priorities) + 1 if priorities else 100
-    
     try:
-        elbv2.create_rule(
-            ListenerArn=listener_arn,
-            Conditions=[{'Field': 'host-header', 'Values': [f"{service_name}.{domain}"]}],
-            Actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}],
-            Priority=priority
+        rule_arn, priority = create_listener_rule(
+            listener_arn,
+            conditions=[{'Field': 'host-header', 'Values': [f"{service_name}.{domain}"]}],
+            actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}]
         )
         print(f"Created ALB rule for {service_name}.{domain}")
+        return {'rule_arn': rule_arn, 'rule_priority': priority, 'listener_arn': listener_arn}
     except Exception as e:
         print(f"Failed to create ALB rule: {e}")
+        return None
+
+def record_alb_rule(student_id, created_rule):
+    """Record a rule on the workspace row so cleanup can return its priority"""
+    try:
+        record_fields(student_id, {
+            'rule_arn': created_rule['rule_arn'],
+            'rule_priority': created_rule['rule_priority'],
+            'listener_arn': created_rule['listener_arn']
+        })
+    except Exception as e:
+        print(f"Could not record ALB rule for {student_id}: {e}")
+
+def scale_up(service_name, capacity=None):
+    """
+    Start a stopped or suspended service's task again, back on the policy's
+    preferred provider: a service moved to the fallback after a Spot reclaim
+    (workspace_status) returns to Spot here. The service has no running task,
+    so forcing the deployment that the strategy change needs costs nothing.
+    """
+    ecs.update_service(
+        cluster=os.environ['ECS_CLUSTER'],
+        service=service_name,
+        desiredCount=1,
+        capacityProviderStrategy=preferred_strategy(capacity),
+        forceNewDeployment=True
+    )
+
+def mark_resumed(student_id):
+    """Move a suspended row back to running and onto the expiry index"""
+    now = int(time.time())
+    # A concurrent request may already have resumed it; the transition then doesn't apply
+    transition(
+        student_id, RUNNING,
+        fields={
+            'resumed_at': now,
+            'last_activity': now,
+            **status_fields('PENDING', now),
+            **expiry_fields(now)
+        },
+        condition='#status = :suspended',
+        values={':suspended': SUSPENDED}
+    )
 
+@traced()
+def resume_workspace(workspace):
+    """
+    Scale a suspended workspace's service back to one task.
+    Its target group and ALB rule were kept, so no ELB calls are needed.
+    Returns False if the service is gone and the workspace must be recreated.
+    """
+    try:
+        scale_up(workspace['service_name'])
+    except (ecs.exceptions.ServiceNotFoundException, ecs.exceptions.ServiceNotActiveException):
+        return False
+    mark_resumed(workspace['student_id'])
+    print(f"Resumed suspended workspace {workspace['service_name']}")
+    return True
+
+@flush_metrics
+@trace_handler
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}')) if isinstance(event.get('body'), str) else event.get('body', {})
+        
+        if body.get('student_ids'):
+            # Whole-batch request from a trainer starting a lab; "capacity" overrides CAPACITY_POLICY
+            return response(200, {'results': provision_batch(body['student_ids'], body.get('capacity'))})
+        
         student_id = body.get('student_id')
         
         if not student_id:
             return response(400, {'error': 'student_id required'})
+        annotate(student_id=student_id)
         
-        table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-        short_id = student_id[:8]
-        service_name = f"ws-{short_id}"
-        domain = os.environ['DOMAIN']
-        workspace_url = f"https://{service_name}.{domain}"
+        # Answer from the row while it is fresh; ECS is only asked once it goes stale
+        workspace = get_workspace(student_id)
+        workspace_url = f"https://{workspace_host(student_id[:8], workspace_shard(workspace, student_id[:8]))}"
+        status = cached_status(workspace)
+        if status in ('running', 'starting', 'provisioning'):
+            return response(200, {'workspace_url': workspace.get('workspace_url', workspace_url), 'status': status})
         
-        # Check if service already exists
+        # One request per student gets past here at a time; the rest get its in-flight status
+        lease_owner, workspace = acquire_lease(student_id, context)
+        if not lease_owner:
+            return response(200, {'workspace_url': workspace_url, 'status': 'provisioning'})
         try:
-            existing = ecs.describe_services(
-                cluster=os.environ['ECS_CLUSTER'],
-                services=[service_name]
-            )
-            if existing['services'] and existing['services'][0]['status'] == 'ACTIVE':
-                # Service exists - ensure ALB rule also exists
-                ensure_alb_rule(service_name, domain, short_id)
-                
-                running_count = existing['services'][0]['runningCount']
-                if running_count > 0:
-                    return response(200, {'workspace_url': workspace_url, 'status': 'running'})
-                ecs.update_service(
-                    cluster=os.environ['ECS_CLUSTER'],
-                    service=service_name,
-                    desiredCount=1
-                )
-                return response(200, {'workspace_url': workspace_url, 'status': 'starting'})
-        except:
-            pass
+            with timer('ProvisionRequestDuration', Handler='service'):
+                result = provision_workspace(student_id, workspace)
+        finally:
+            release_lease(student_id, lease_owner)
+        sync_statuses({student_id: json.loads(result['body']).get('status')})
+        return result
         
-        # Create target group with stickiness
-        tg_name = f"ws-{short_id}"[:32]
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return response(500, {'error': str(e)})
+
+@traced()
+def provision_workspace(student_id, workspace):
+    """
+    Resume, restart or create the student's workspace. Runs under the
+    student's lease; workspace is their row as of taking it.
+    """
+    short_id = student_id[:8]
+    service_name = f"ws-{short_id}"
+    shard = workspace_shard(workspace, short_id)
+    workspace_url = f"https://{workspace_host(short_id, shard)}"
+    
+    # A request that held the lease before us may have just provisioned it
+    status = cached_status(workspace)
+    if status in ('running', 'starting', 'provisioning'):
+        return response(200, {'workspace_url': workspace.get('workspace_url', workspace_url), 'status': status})
+    
+    # Suspended workspaces only need their service scaled back up
+    if workspace.get('status') == SUSPENDED and workspace.get('service_name'):
+        if resume_workspace(workspace):
+            return response(200, {'workspace_url': workspace.get('workspace_url', workspace_url), 'status': 'starting'})
+    
+    # A warm pool task handed over earlier runs without a service
+    if workspace.get('status') == RUNNING and workspace.get('task_arn'):
+        task = describe_tasks([workspace['task_arn']]).get(workspace['task_arn'])
+        if task and is_running(task):
+            touch_status(student_id, 'RUNNING')
+            return response(200, {'workspace_url': workspace['workspace_url'], 'status': 'running'})
+    
+    # Check if service already exists
+    try:
+        existing = ecs.describe_services(
+            cluster=os.environ['ECS_CLUSTER'],
+            services=[service_name]
+        )
+        if existing['services'] and existing['services'][0]['status'] == 'ACTIVE':
+            # Service exists - ensure ALB rule also exists
+            created_rule = None if router_mode() else ensure_alb_rule(service_name, shard, short_id)
+            if created_rule:
+                record_alb_rule(student_id, created_rule)
+            
+            running_count = existing['services'][0]['runningCount']
+            if running_count > 0:
+                if workspace.get('status'):
+                    touch_status(student_id, 'RUNNING')
+                return response(200, {'workspace_url': workspace_url, 'status': 'running'})
+            scale_up(service_name)
+            return response(200, {'workspace_url': workspace_url, 'status': 'starting'})
+    except:
+        pass
+    
+    # Claim the row before creating anything; a racing request that loses
+    # the claim reports the workspace as provisioning instead of duplicating it
+    version = create_workspace(
+        workspace_item(student_id, service_name, workspace_url),
+        replace_version=workspace.get('version', 0) if workspace.get('status') else None
+    )
+    if not version:
+        return response(200, {'workspace_url': workspace_url, 'status': 'provisioning'})
+    
+    # Hand over a pre-started pool task when one is ready; otherwise create the service
+    warm_task = claim_warm_task(student_id)
+    if warm_task:
+        result = attach_warm_task(student_id, warm_task)
+        if result:
+            return response(200, {'workspace_url': result['workspace_url'], 'status': 'running'})
+    
+    try:
+        route = create_workspace_resources(service_name, student_id, shard=shard)
+    except Exception:
+        # Release the claim so the next request can retry
+        transition(student_id, TERMINATED, version=version)
+        raise
+    record_fields(student_id, route)
+    
+    return response(200, {'workspace_url': workspace_url, 'status': 'provisioning'})
+
+@traced()
+def attach_warm_task(student_id, warm_task):
+    """
+    Bind a claimed warm pool task to a student and route it in place of a
+    service. Returns the finalize result, or None if the task could not be
+    attached (the caller falls back to creating the service).
+    The caller has already claimed the student's provisioning row.
+    """
+    task_arn = warm_task['task_arn']
+    annotate(workspace_id=warm_task['workspace_id'], task_arn=task_arn)
+    # Only onto the caller's claim; a failed attach removes these again
+    bound = record_fields(student_id, {
+        'workspace_id': warm_task['workspace_id'],
+        'task_arn': task_arn,
+        'finalize_started_at': int(time.time())
+    }, condition='attribute_not_exists(task_arn)')
+    
+    if bound:
+        result = finalize_workspace(
+            student_id, warm_task['workspace_id'], task_arn, warm_task.get('task_ip'),
+            tg_arn=warm_task.get('target_group_arn'), port=3000, warm=True
+        )
+    else:
+        result = {'error': 'Workspace is no longer provisioning'}
+    request_replenish()
+    
+    if 'error' in result:
+        print(f"Could not attach warm task for {student_id}: {result['error']}")
         try:
-            tg_response = elbv2.create_target_group(
-                Name=tg_name,
-                Protocol='HTTP',
-                Port=3000,
-                VpcId=os.environ['VPC_ID'],
-                TargetType='ip',
-                HealthCheckPath='/',
-                HealthCheckIntervalSeconds=30,
-                HealthCheckTimeoutSeconds=10,
-                HealthyThresholdCount=2,
-                UnhealthyThresholdCount=3,
-                Matcher={'HttpCode': '200-399'}
+            ecs.stop_task(
+                cluster=os.environ['ECS_CLUSTER'],
+                task=task_arn,
+                reason='Warm task attach failed'
             )
-            tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
-            # Enable stickiness
-            elbv2.modify_target_group_attributes(
-                TargetGroupArn=tg_arn,
-                Attributes=[
-                    {'Key': 'stickiness.enabled', 'Value': 'true'},
-                    {'Key': 'stickiness.type', 'Value': 'lb_cookie'},
-                    {'Key': 'stickiness.lb_cookie.duration_seconds', 'Value': '86400'},
-                    {'Key': 'deregistration_delay.timeout_seconds', 'Value': '30'}
-                ]
+        except Exception as e:
+            print(f"Error stopping task: {str(e)}")
+        release_claimed_task(task_arn)
+        # Hand the still-provisioning row back to the cold start as it was claimed
+        if bound:
+            record_fields(
+                student_id, {}, remove=('workspace_id', 'task_arn', 'finalize_started_at'),
+                condition='task_arn = :arn', values={':arn': task_arn}
             )
-        except elbv2.exceptions.DuplicateTargetGroupNameException:
-            tg_response = elbv2.describe_target_groups(Names=[tg_name])
-            tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
-        
-        # Create ALB rule
-        listener_arn = os.environ['ALB_LISTENER_ARN']
-        rules = elbv2.describe_rules(ListenerArn=listener_arn)
-        priorities = [int(r['Priority']) for r in rules['Rules'] if r['Priority'] != 'default']
-        priority = max(priorities) + 1 if priorities else 100
-        
+        return None
+    
+    # The task runs without a service; the terminator stops it rather than suspending
+    record_fields(student_id, {}, remove=('service_name',), condition='task_arn = :arn', values={':arn': task_arn})
+    
+    # Pool target groups are created before the student is known
+    if warm_task.get('target_group_arn'):
         try:
-            elbv2.create_rule(
-                ListenerArn=listener_arn,
-                Conditions=[{'Field': 'host-header', 'Values': [f"{service_name}.{domain}"]}],
-                Actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}],
-                Priority=priority
+            elbv2.add_tags(
+                ResourceArns=[warm_task['target_group_arn']],
+                Tags=[{'Key': 'StudentId', 'Value': student_id}]
             )
-            print(f"Created ALB rule for {service_name}.{domain} with priority {priority}")
         except Exception as e:
-            print(f"ALB rule creation result: {e}")
-            # Try to verify rule exists
-            try:
-                for rule in rules['Rules']:
-                    if rule.get('Conditions'):
-                        for cond in rule['Conditions']:
-                            vals = cond.get('HostHeaderConfig', {}).get('Values', [])
-                            if f"{service_name}.{domain}" in vals:
-                                print(f"ALB rule already exists for {service_name}.{domain}")
-                                break
-            except:
-                pass
-        
-        # Create ECS Service with OpenVSCode Server
-        ecs.create_service(
-            cluster=os.environ['ECS_CLUSTER'],
-            serviceName=service_name,
-            taskDefinition=os.environ['TASK_DEFINITION'],
-            desiredCount=1,
-            # Fargate Spot for 70% cost savings, with Fargate fallback
-            capacityProviderStrategy=[
-                {'capacityProvider': 'FARGATE_SPOT', 'weight': 1, 'base': 0},
-                {'capacityProvider': 'FARGATE', 'weight': 0, 'base': 1}  # Fallback if Spot unavailable
-            ],
-            platformVersion='LATEST',
-            networkConfiguration={
-                'awsvpcConfiguration': {
-                    'subnets': os.environ['SUBNETS'].split(','),
-                    'securityGroups': [os.environ['SECURITY_GROUP']],
-                    'assignPublicIp': 'DISABLED'
-                }
-            },
-            loadBalancers=[{
+            print(f"Error tagging target group: {str(e)}")
+    
+    return result
+
+@traced()
+def create_workspace_target_group(short_id):
+    """Create the workspace target group with stickiness, reusing an existing one"""
+    tg_name = f"ws-{short_id}"[:32]
+    try:
+        tg_response = elbv2.create_target_group(
+            Name=tg_name,
+            Protocol='HTTP',
+            Port=3000,
+            VpcId=os.environ['VPC_ID'],
+            TargetType='ip',
+            HealthCheckPath='/',
+            HealthCheckIntervalSeconds=30,
+            HealthCheckTimeoutSeconds=10,
+            HealthyThresholdCount=2,
+            UnhealthyThresholdCount=3,
+            Matcher={'HttpCode': '200-399'}
+        )
+        tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
+        # Enable stickiness
+        elbv2.modify_target_group_attributes(
+            TargetGroupArn=tg_arn,
+            Attributes=[
+                {'Key': 'stickiness.enabled', 'Value': 'true'},
+                {'Key': 'stickiness.type', 'Value': 'lb_cookie'},
+                {'Key': 'stickiness.lb_cookie.duration_seconds', 'Value': '86400'},
+                {'Key': 'deregistration_delay.timeout_seconds', 'Value': '30'}
+            ]
+        )
+    except elbv2.exceptions.DuplicateTargetGroupNameException:
+        tg_response = elbv2.describe_target_groups(Names=[tg_name])
+        tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
+    return tg_arn
+
+@traced()
+def create_workspace_rule(listener_arn, service_name, domain, tg_arn):
+    """Create the host-header rule for a workspace; returns (rule_arn, priority)"""
+    try:
+        rule_arn, rule_priority = create_listener_rule(
+            listener_arn,
+            conditions=[{'Field': 'host-header', 'Values': [f"{service_name}.{domain}"]}],
+            actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}]
+        )
+        print(f"Created ALB rule for {service_name}.{domain} with priority {rule_priority}")
+        return rule_arn, rule_priority
+    except Exception as e:
+        print(f"ALB rule creation result: {e}")
+        return None, None
+
+@traced()
+def create_workspace_service(service_name, student_id, tg_arn, capacity=None):
+    """
+    Create the workspace service, attached to its target group unless routed by the router.
+    capacity names the placement policy (default CAPACITY_POLICY).
+    """
+    load_balancing = {}
+    if tg_arn:
+        load_balancing = {
+            'loadBalancers': [{
                 'targetGroupArn': tg_arn,
                 'containerName': 'openvscode',
                 'containerPort': 3000
             }],
-            healthCheckGracePeriodSeconds=120,
-            deploymentConfiguration={
-                'maximumPercent': 200,
-                'minimumHealthyPercent': 100
-            },
-            enableExecuteCommand=True,
-            tags=[
-                {'key': 'StudentId', 'value': student_id},
-                {'key': 'Environment', 'value': 'production'},
-                {'key': 'Service', 'value': 'workspace'}
-            ],
-            propagateTags='SERVICE'
-        )
-        
-        # Update task with STUDENT_ID environment variable via task override
-        # This is done automatically by the task definition template
+            'healthCheckGracePeriodSeconds': 120
+        }
+    ecs.create_service(
+        cluster=os.environ['ECS_CLUSTER'],
+        serviceName=service_name,
+        taskDefinition=os.environ['TASK_DEFINITION'],
+        desiredCount=1,
+        # Fargate Spot for 70% cost savings; a reclaimed task moves the service
+        # to the fallback provider (workspace_status)
+        capacityProviderStrategy=preferred_strategy(capacity),
+        platformVersion='LATEST',
+        networkConfiguration={
+            'awsvpcConfiguration': {
+                'subnets': os.environ['SUBNETS'].split(','),
+                'securityGroups': [os.environ['SECURITY_GROUP']],
+                'assignPublicIp': 'DISABLED'
+            }
+        },
+        deploymentConfiguration={
+            'maximumPercent': 200,
+            'minimumHealthyPercent': 100
+        },
+        enableExecuteCommand=True,
+        tags=[
+            {'key': 'StudentId', 'value': student_id},
+            {'key': 'Environment', 'value': 'production'},
+            {'key': 'Service', 'value': 'workspace'}
+        ],
+        propagateTags='SERVICE',
+        **load_balancing
+    )
+
+@traced()
+def create_workspace_resources(service_name, student_id, routed=False, capacity=None, shard=None):
+    """
+    Create the target group, ALB rule (unless the host is already routed) and
+    ECS service for a claimed workspace, on its shard (default: the hashed
+    one). Returns the route attributes for its row.
+    """
+    shard = shard or shard_for(student_id[:8])
+    domain = shard['domain']
+    listener_arn = shard['listener_arn']
+    tg_arn, rule_arn, rule_priority = None, None, None
+    # Create target group with stickiness and ALB rule (the workspace router needs neither)
+    if not router_mode():
+        tg_arn = create_workspace_target_group(student_id[:8])
+        if not routed:
+            rule_arn, rule_priority = create_workspace_rule(listener_arn, service_name, domain, tg_arn)
+    
+    # Create ECS Service with OpenVSCode Server
+    create_workspace_service(service_name, student_id, tg_arn, capacity)
+    
+    return {
+        'target_group_arn': tg_arn,
+        'rule_arn': rule_arn,
+        'rule_priority': rule_priority,
+        'listener_arn': listener_arn
+    }
+
+def workspace_item(student_id, service_name, workspace_url):
+    return {
+        'student_id': student_id,
+        'service_name': service_name,
+        'workspace_url': workspace_url,
+        'task_port': 3000,
+        'last_activity': int(time.time()),
+        **status_fields('PROVISIONING')
+    }
+
+@traced()
+def provision_batch(student_ids, capacity=None):
+    """
+    Provision workspaces for a whole batch in one invocation.
+    Existing services are found with one describe_services call per 10
+    names and routed hosts come from the cached rule index; new workspaces
+    are claimed and created on a bounded worker pool, each under its student's
+    lease. Suspended workspaces are scaled back up without touching the ALB.
+    New services are placed per capacity (default CAPACITY_POLICY).
+    Returns {student_id: result}.
+    """
+    cluster = os.environ['ECS_CLUSTER']
+    
+    # service_name -> student_id (students sharing a short id share a service)
+    students = {}
+    for student_id in student_ids:
+        if student_id:
+            students.setdefault(f"ws-{student_id[:8]}", student_id)
+    
+    # describe_services accepts at most 10 names per call
+    names = list(students)
+    existing = {}
+    for i in range(0, len(names), 10):
+        described = ecs.describe_services(cluster=cluster, services=names[i:i + 10])
+        for service in described['services']:
+            if service['status'] == 'ACTIVE':
+                existing[service['serviceName']] = service
+    
+    # Hosts that already have a rule, from the cached index of each shard's listener
+    routed_hosts = set()
+    if not router_mode():
+        for shard in all_shards():
+            routed_hosts.update(rule_index(shard['listener_arn']))
+    
+    @traced()
+    def provision_one(service_name, student_id):
+        """Returns (result, created rule or None)"""
+        annotate(student_id=student_id)
+        # Taking the lease also reads the student's current row
+        lease_owner, row = acquire_lease(student_id)
+        if not lease_owner:
+            return {'workspace_url': f"https://{workspace_host(student_id[:8], shard_for(student_id[:8]))}", 'status': 'provisioning'}, None
+        try:
+            return provision_leased(service_name, student_id, row)
+        finally:
+            release_lease(student_id, lease_owner)
+    
+    def provision_leased(service_name, student_id, row):
+        shard = workspace_shard(row, student_id[:8])
+        host = workspace_host(student_id[:8], shard)
+        workspace_url = f"https://{host}"
+        service = existing.get(service_name)
         
-        table.put_item(Item={
-            'student_id': student_id,
-            'service_name': service_name,
-            'target_group_arn': tg_arn,
-            'workspace_url': workspace_url,
-            'status': 'provisioning',
-            'created_at': int(time.time()),
-            'last_activity': int(time.time())
-        })
+        if service and row.get('status') == SUSPENDED:
+            scale_up(service_name, capacity)
+            mark_resumed(student_id)
+            return {'workspace_url': workspace_url, 'status': 'starting'}, None
         
-        return response(200, {'workspace_url': workspace_url, 'status': 'provisioning'})
+        if service:
+            created_rule = None
+            if host not in routed_hosts and not router_mode():
+                created_rule = ensure_alb_rule(service_name, shard, student_id[:8])
+            if service['runningCount'] > 0:
+                return {'workspace_url': workspace_url, 'status': 'running'}, created_rule
+            scale_up(service_name, capacity)
+            return {'workspace_url': workspace_url, 'status': 'starting'}, created_rule
         
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return response(500, {'error': str(e)})
+        # A fresh provisioning row belongs to a request still creating the service
+        provisioning = {'workspace_url': workspace_url, 'status': 'provisioning'}
+        if cached_status(row) == 'provisioning':
+            return provisioning, None
+        version = create_workspace(
+            workspace_item(student_id, service_name, workspace_url),
+            replace_version=row.get('version', 0) if row.get('status') else None
+        )
+        if not version:
+            return provisioning, None
+        try:
+            route = create_workspace_resources(
+                service_name, student_id, routed=host in routed_hosts, capacity=capacity, shard=shard
+            )
+        except Exception:
+            transition(student_id, TERMINATED, version=version)
+            raise
+        record_fields(student_id, route)
+        return provisioning, None
+    
+    results = {}
+    provision_traced = carry_context(provision_one)
+    with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as pool:
+        futures = {
+            student_id: pool.submit(provision_traced, service_name, student_id)
+            for service_name, student_id in students.items()
+        }
+        outcomes = {}
+        for student_id, future in futures.items():
+            try:
+                outcomes[student_id] = future.result()
+            except Exception as e:
+                print(f"Error provisioning {student_id}: {str(e)}")
+                results[student_id] = {'error': str(e)}
+    
+    # Rules are recorded from this thread, after the pool has finished
+    for student_id, (result, created_rule) in outcomes.items():
+        results[student_id] = result
+        if created_rule:
+            record_alb_rule(student_id, created_rule)
+    
+    # Students whose short id collided with an earlier one share its result
+    for student_id in student_ids:
+        if student_id and student_id not in results:
+            results[student_id] = results[students[f"ws-{student_id[:8]}"]]
+    
+    # One PATCH per status for the whole batch
+    sync_statuses({student_id: result.get('status') for student_id, result in results.items()})
+    
+    print(f"Batch provisioned {len(students)} workspace(s)")
+    return results
 
 def response(status_code, body):
     return {
@@ -0,0 +1,87 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace the workspace metrics are published under
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Apranova/Workspaces')
+# Embedded Metric Format limits per log line
+MAX_METRICS = 100
+MAX_VALUES = 100
+
+# (sorted dimension items) -> metric name -> (unit, [values]), flushed per invocation
+buffer = {}
+buffer_lock = threading.Lock()
+
+def put_metric(name, value, unit='Count', **dimensions):
+    """Buffer one datapoint; flush() publishes everything buffered so far. None is dropped."""
+    if value is None:
+        return
+    key = tuple(sorted(dimensions.items()))
+    with buffer_lock:
+        metrics = buffer.setdefault(key, {})
+        metrics.setdefault(name, (unit, []))[1].append(value)
+
+@contextmanager
+def timer(name, **dimensions):
+    """Record how long the block took, in milliseconds"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        put_metric(name, (time.monotonic() - start) * 1000, 'Milliseconds', **dimensions)
+
+def count_api_calls(client, metric='ApiCalls'):
+    """Count every call a boto3 client makes, by operation"""
+    service = client.meta.service_model.service_name
+    
+    def count(model, **kwargs):
+        put_metric(metric, 1, Service=service, Operation=model.name)
+    
+    client.meta.events.register('after-call', count)
+    return client
+
+def flush():
+    """
+    Publish buffered datapoints as CloudWatch Embedded Metric Format log lines.
+    CloudWatch Logs extracts the metrics from the function's log stream, so
+    publishing makes no API calls. Datapoints sharing dimensions share a line.
+    """
+    with buffer_lock:
+        pending = dict(buffer)
+        buffer.clear()
+    
+    timestamp = int(time.time() * 1000)
+    for key, metrics in pending.items():
+        dimensions = dict(key)
+        names = list(metrics)
+        for i in range(0, len(names), MAX_METRICS):
+            chunk = names[i:i + MAX_METRICS]
+            longest = max(len(metrics[name][1]) for name in chunk)
+            for start in range(0, longest, MAX_VALUES):
+                present = [name for name in chunk if len(metrics[name][1]) > start]
+                record = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': NAMESPACE,
+                            'Dimensions': [list(dimensions)],
+                            'Metrics': [{'Name': name, 'Unit': metrics[name][0]} for name in present]
+                        }]
+                    },
+                    **dimensions,
+                    **{name: metrics[name][1][start:start + MAX_VALUES] for name in present}
+                }
+                print(json.dumps(record))
+
+def flush_metrics(handler):
+    """Decorator for Lambda handlers: flush buffered metrics however the handler exits"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            flush()
+    return wrapper
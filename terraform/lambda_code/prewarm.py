@@ -0,0 +1,79 @@
+import json
+import os
+import time
+from index import provision_batch
+from metrics import flush_metrics
+from supabase_rest import is_configured, select
+
+# Start workspaces this long before a session begins (seconds)
+PREWARM_LEAD_SECONDS = int(os.environ.get('PREWARM_LEAD_SECONDS', 600))
+# Students per provision_batch call
+PREWARM_BATCH_SIZE = int(os.environ.get('PREWARM_BATCH_SIZE', 100))
+
+@flush_metrics
+def lambda_handler(event, context):
+    """
+    Scheduled pre-warming ahead of class.
+    Finds batch sessions starting within PREWARM_LEAD_SECONDS and provisions
+    (or scales back to 1) the workspaces of every enrolled student, so the
+    rush at class start finds them already running.
+    """
+    try:
+        if not is_configured():
+            print("Supabase not configured, skipping prewarm")
+            return {'statusCode': 200, 'body': 'Skipped'}
+        
+        now = int(time.time())
+        batch_ids = upcoming_batch_ids(now, now + PREWARM_LEAD_SECONDS)
+        if not batch_ids:
+            return {'statusCode': 200, 'body': json.dumps({'batches': 0, 'students': 0})}
+        
+        student_ids = enrolled_student_ids(batch_ids)
+        print(f"Pre-warming {len(student_ids)} workspace(s) for {len(batch_ids)} batch(es)")
+        
+        results = {}
+        for i in range(0, len(student_ids), PREWARM_BATCH_SIZE):
+            results.update(provision_batch(student_ids[i:i + PREWARM_BATCH_SIZE]))
+        
+        failed = [sid for sid, result in results.items() if 'error' in result]
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'batches': len(batch_ids),
+                'students': len(student_ids),
+                'failed': failed
+            })
+        }
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def iso_utc(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+def upcoming_batch_ids(start, end):
+    """Active batches with a session starting between start and end (epoch seconds)"""
+    sessions = select('batch_sessions', {
+        'select': 'batch_id',
+        'and': f"(starts_at.gte.{iso_utc(start)},starts_at.lte.{iso_utc(end)})"
+    })
+    batch_ids = sorted({s['batch_id'] for s in sessions})
+    if not batch_ids:
+        return []
+    active = select('batches', {
+        'select': 'id',
+        'id': f"in.({','.join(batch_ids)})",
+        'is_active': 'eq.true'
+    })
+    return [b['id'] for b in active]
+
+def enrolled_student_ids(batch_ids):
+    students = select('students', {
+        'select': 'id',
+        'batch_id': f"in.({','.join(batch_ids)})"
+    })
+    return [s['id'] for s in students]
@@ -1,17 +1,35 @@
 import json
-import boto3
 import os
 import time
 import uuid
+from aws_clients import client
+from capacity import launch_workspace_task
+from ecs_tasks import get_task_environment, get_task_ip, get_task_wait
+from ecs_waiter import describe_tasks, has_ip, is_running, wait_for_tasks
+from metrics import flush_metrics, put_metric, timer
+from routing import route_name, router_mode, shard_for, workspace_host, workspace_shard
+from rule_priorities import create_listener_rule
+from tracing import annotate, trace_handler, traced
+from workspace_expiry import expiry_fields
+from workspace_state import (
+    PROVISIONING, RUNNING, TERMINATED, acquire_lease, create_workspace, get_workspace, record_fields, release_lease,
+    transition
+)
+from workspace_status import cached_status, touch_status
 
-ecs = boto3.client('ecs')
-elbv2 = boto3.client('elbv2')
-dynamodb = boto3.resource('dynamodb')
+ecs = client('ecs')
+elbv2 = client('elbv2')
 
+# A provisioning record older than this is assumed lost (missed event, failed finalize)
+PENDING_TIMEOUT = int(os.environ.get('PENDING_TIMEOUT', 300))
+
+@flush_metrics
+@trace_handler
 def lambda_handler(event, context):
     """
-    Provisions a new Code-Server workspace for a student.
-    Returns workspace URL after task is healthy and registered with ALB.
+    Submits a new Code-Server workspace for a student.
+    Claims a provisioning record, starts the ECS task and returns immediately;
+    finalize_handler routes it once the task reaches RUNNING.
     """
     try:
         body = json.loads(event.get('body', '{}'))
@@ -22,108 +40,303 @@ def lambda_handler(event, context):
                 'statusCode': 400,
                 'body': json.dumps({'error': 'student_id is required'})
             }
+        annotate(student_id=student_id)
         
         # Check if workspace already exists
-        table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-        existing = table.get_item(Key={'student_id': student_id})
+        item = get_workspace(student_id)
         
-        if 'Item' in existing and existing['Item'].get('status') == 'running':
-            # Verify task is actually running
-            task_arn = existing['Item'].get('task_arn')
-            try:
-                task_info = ecs.describe_tasks(
-                    cluster=os.environ['ECS_CLUSTER'],
-                    tasks=[task_arn]
-                )
-                if task_info['tasks'] and task_info['tasks'][0]['lastStatus'] == 'RUNNING':
-                    return {
-                        'statusCode': 200,
-                        'body': json.dumps({
-                            'workspace_url': existing['Item']['workspace_url'],
-                            'status': 'running'
-                        })
-                    }
-            except:
-                # Task doesn't exist, clean up and provision new one
-                table.delete_item(Key={'student_id': student_id})
+        if item and cached_status(item) == 'running':
+            # Row is fresh - workspace_cleanup terminates it as soon as the task stops
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'workspace_url': item['workspace_url'],
+                    'status': 'running'
+                })
+            }
         
-        # Generate workspace identifiers
-        workspace_id = str(uuid.uuid4())[:8]
         short_id = student_id[:8] if len(student_id) >= 8 else student_id
+        workspace_url = f"https://{workspace_host(short_id, workspace_shard(item, short_id))}"
         
-        # Run ECS task
-        response = ecs.run_task(
-            cluster=os.environ['ECS_CLUSTER'],
-            taskDefinition=os.environ['TASK_DEFINITION'],
-            count=1,
-            networkConfiguration={
-                'awsvpcConfiguration': {
-                    'subnets': os.environ['SUBNETS'].split(','),
-                    'securityGroups': [os.environ['SECURITY_GROUP']],
-                    'assignPublicIp': 'DISABLED'
+        # One request per student gets past here at a time; the rest get its in-flight status
+        lease_owner, leased_item = acquire_lease(student_id, context)
+        if not lease_owner:
+            return pending_response({'workspace_url': workspace_url, **(item or {})})
+        try:
+            with timer('ProvisionRequestDuration', Handler='task'):
+                return provision_workspace(student_id, leased_item, workspace_url)
+        finally:
+            release_lease(student_id, lease_owner)
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+@traced()
+def provision_workspace(student_id, item, workspace_url):
+    """
+    Start (or reuse) the student's workspace. Runs under the student's lease;
+    item is their row as of taking it.
+    """
+    # Version of a dead or stale row this request may replace (None: no usable row)
+    replace_version = None
+    
+    if item and item.get('status') == RUNNING:
+        # Verify task is actually running
+        task_arn = item.get('task_arn')
+        try:
+            task = describe_tasks([task_arn]).get(task_arn)
+            if task and is_running(task):
+                touch_status(student_id, 'RUNNING')
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({
+                        'workspace_url': item['workspace_url'],
+                        'status': 'running'
+                    })
                 }
-            },
-            overrides={
-                'containerOverrides': [{
-                    'name': 'codeserver',
-                    'environment': [
-                        {'name': 'STUDENT_ID', 'value': student_id},
-                        {'name': 'WORKSPACE_ID', 'value': workspace_id},
-                        {'name': 'PASSWORD', 'value': 'apranova123'}
-                    ]
-                }]
-            },
-            capacityProviderStrategy=[
-            {'capacityProvider': 'FARGATE', 'weight': 1, 'base': 1}
-        ],
-            tags=[
-                {'key': 'StudentId', 'value': student_id},
-                {'key': 'WorkspaceId', 'value': workspace_id}
-            ]
-        )
+        except Exception as e:
+            print(f"Error checking task {task_arn}: {str(e)}")
+        # Task doesn't exist, provision a new one in place of this row
+        replace_version = item.get('version', 0)
+    
+    # 'pending'/'finalizing' are rows written before the state machine
+    if item and item.get('status') in [PROVISIONING, 'pending', 'finalizing']:
+        # Task already submitted - don't start a second one
+        if int(time.time()) - int(item.get('created_at', 0)) < PENDING_TIMEOUT:
+            return pending_response(item)
+        print(f"Stale pending workspace for {student_id}, re-provisioning")
+        replace_version = item.get('version', 0)
+    
+    # Generate workspace identifiers
+    workspace_id = str(uuid.uuid4())[:8]
+    annotate(workspace_id=workspace_id)
+    
+    # Claim the student's row before starting anything: of two racing
+    # requests only one gets here, the other reports the claimed row
+    claimed = create_workspace({
+        'student_id': student_id,
+        'workspace_id': workspace_id,
+        'workspace_url': workspace_url,
+        'ttl': int(time.time()) + 86400  # 24 hour TTL
+    }, replace_version=replace_version)
+    if not claimed:
+        print(f"Workspace for {student_id} claimed by a concurrent request")
+        current = get_workspace(student_id, consistent=True)
+        return pending_response(current or {'workspace_url': workspace_url})
+    
+    # Run ECS task on the CAPACITY_POLICY providers (Spot first by default)
+    task = launch_workspace_task(student_id, workspace_id)
+    
+    if not task:
+        transition(student_id, TERMINATED, condition='workspace_id = :wid', values={':wid': workspace_id})
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': 'Task failed to start'})
+        }
+    
+    task_arn = task['taskArn']
+    print(f"Created task: {task_arn}")
+    
+    # Record the task - finalize_handler completes the row on RUNNING
+    recorded = record_fields(
+        student_id, {'task_arn': task_arn},
+        condition='workspace_id = :wid', values={':wid': workspace_id}
+    )
+    if not recorded:
+        # finalize_handler only routes tasks recorded on the row; don't leave this one running unrouted
+        print(f"Workspace {workspace_id} for {student_id} was replaced, stopping {task_arn}")
+        try:
+            ecs.stop_task(
+                cluster=os.environ['ECS_CLUSTER'],
+                task=task_arn,
+                reason='Workspace row replaced before the task was recorded'
+            )
+        except Exception as e:
+            print(f"Error stopping task: {str(e)}")
+        current = get_workspace(student_id, consistent=True)
+        return pending_response(current or {'workspace_url': workspace_url})
+    
+    return {
+        'statusCode': 202,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'workspace_url': workspace_url,
+            'status': 'pending',
+            'task_arn': task_arn,
+            'password': os.environ.get('CODE_SERVER_PASSWORD', 'apranova_secure_ide')
+        })
+    }
+
+def pending_response(item):
+    """202 for a workspace another request is already provisioning"""
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'workspace_url': item.get('workspace_url'),
+            'status': 'pending',
+            'task_arn': item.get('task_arn')
+        })
+    }
+
+@flush_metrics
+@trace_handler
+def finalize_handler(event, context):
+    """
+    Handles ECS task state change events (EventBridge, lastStatus RUNNING).
+    Routes a provisioning workspace (its own target group and ALB rule, or the
+    workspace router) and marks it running.
+    """
+    try:
+        detail = event.get('detail', {})
         
-        task_arn = response['tasks'][0]['taskArn']
-        print(f"Created task: {task_arn}")
+        if detail.get('lastStatus') != 'RUNNING':
+            print(f"Ignoring non-RUNNING event: {detail.get('lastStatus')}")
+            return {'statusCode': 200, 'body': 'Ignored'}
         
-        # Wait for task to be running and get IP
-        max_wait = 120
-        waited = 0
-        task_ip = None
+        task_arn = detail.get('taskArn', '')
+        env = get_task_environment(detail)
+        student_id = env.get('STUDENT_ID')
         
-        while waited < max_wait:
-            time.sleep(5)
-            waited += 5
-            
-            task_info = ecs.describe_tasks(
-                cluster=os.environ['ECS_CLUSTER'],
-                tasks=[task_arn]
-            )
-            
-            if task_info['tasks']:
-                task = task_info['tasks'][0]
-                if task['lastStatus'] == 'RUNNING':
-                    for attachment in task.get('attachments', []):
-                        for detail in attachment.get('details', []):
-                            if detail['name'] == 'privateIPv4Address':
-                                task_ip = detail['value']
-                                break
-                    if task_ip:
-                        break
-                elif task['lastStatus'] in ['STOPPED', 'DEPROVISIONING']:
-                    return {
-                        'statusCode': 500,
-                        'body': json.dumps({'error': 'Task failed to start'})
-                    }
+        if not student_id:
+            print(f"Ignoring task without STUDENT_ID: {task_arn}")
+            return {'statusCode': 200, 'body': 'Ignored'}
+        annotate(student_id=student_id, workspace_id=env.get('WORKSPACE_ID'), task_arn=task_arn)
         
+        # Claim the provisioning record so duplicate events finalize only once
+        claimed = record_fields(
+            student_id, {'finalize_started_at': int(time.time())},
+            condition='task_arn = :arn AND #status = :provisioning AND attribute_not_exists(finalize_started_at)',
+            values={':arn': task_arn, ':provisioning': PROVISIONING}
+        )
+        if not claimed:
+            print(f"No provisioning workspace for task {task_arn}, skipping")
+            return {'statusCode': 200, 'body': 'Not pending'}
+        
+        put_metric('EcsWaitTime', get_task_wait(detail), 'Seconds', Path='task')
+        task_ip = get_task_ip(detail)
         if not task_ip:
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': 'Task failed to start within timeout'})
-            }
+            # Event carried no IP yet - wait for the network attachment
+            task = wait_for_tasks([task_arn], ready=has_ip, context=context)[task_arn]
+            if task:
+                task_ip = get_task_ip(task)
         
-        print(f"Task running with IP: {task_ip}")
+        workspace_id = env.get('WORKSPACE_ID') or str(uuid.uuid4())[:8]
+        # A Spot relaunch keeps the workspace's target group and rule
+        route = None
+        if claimed.get('relaunched_at') and claimed.get('target_group_arn') and claimed.get('rule_arn'):
+            route = {key: claimed.get(key) for key in ('target_group_arn', 'rule_arn', 'rule_priority', 'listener_arn')}
+        result = finalize_workspace(student_id, workspace_id, task_arn, task_ip, route=route)
+        
+        if 'error' in result:
+            # Don't leave a billed task running without a route
+            print(f"Finalize failed for {student_id}: {result['error']}")
+            try:
+                ecs.stop_task(
+                    cluster=os.environ['ECS_CLUSTER'],
+                    task=task_arn,
+                    reason='Workspace finalize failed'
+                )
+            except Exception as e:
+                print(f"Error stopping task: {str(e)}")
+            transition(student_id, TERMINATED, condition='task_arn = :arn', values={':arn': task_arn})
+            return {'statusCode': 500, 'body': json.dumps(result)}
         
-        # Create target group for this workspace
+        return {'statusCode': 200, 'body': json.dumps(result)}
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+@traced()
+def finalize_workspace(student_id, workspace_id, task_arn, task_ip, tg_arn=None, route=None, port=8080, warm=False):
+    """
+    Route a running task and mark the workspace running.
+    Pass tg_arn when the task is already registered (warm pool tasks), or
+    route to register it in an existing target group and rule (Spot relaunch).
+    port is the task's workspace port (8080 Code-Server, 3000 OpenVSCode).
+    """
+    if not task_ip:
+        return {'error': 'Task has no private IP'}
+    
+    relaunch = route is not None
+    print(f"Task running with IP: {task_ip}")
+    short_id = student_id[:8] if len(student_id) >= 8 else student_id
+    # A relaunch stays on its listener's shard; new routes go to the hashed shard
+    shard = workspace_shard(route, short_id)
+    
+    workspace_url = f"https://{workspace_host(short_id, shard)}"
+    
+    if router_mode():
+        # The ws-* wildcard rule and workspace router reach the task by its IP
+        route = {'target_group_arn': None, 'rule_arn': None, 'rule_priority': None, 'listener_arn': None}
+    elif relaunch:
+        try:
+            elbv2.register_targets(
+                TargetGroupArn=route['target_group_arn'],
+                Targets=[{'Id': task_ip, 'Port': 8080}]
+            )
+            print(f"Registered relaunched target: {task_ip}:8080")
+        except Exception as e:
+            print(f"Error registering target: {str(e)}")
+            return {'error': f'Failed to register target: {str(e)}'}
+    else:
+        route = create_workspace_route(student_id, workspace_id, short_id, task_ip, tg_arn, shard)
+        if 'error' in route:
+            return route
+    
+    # Mark workspace running and start its inactivity clock
+    now = int(time.time())
+    updated = transition(
+        student_id, RUNNING,
+        fields={
+            'task_status': 'RUNNING',
+            'task_ip': task_ip,
+            'task_port': port,
+            'route_host': route_name(short_id),
+            **route,
+            'workspace_url': workspace_url,
+            'started_at': now,
+            'last_activity': now,
+            **expiry_fields(now)
+        },
+        condition='task_arn = :arn',
+        values={':arn': task_arn}
+    )
+    if not updated:
+        return {'error': 'Workspace is no longer provisioning this task'}
+    if updated.get('created_at'):
+        path = 'spot_relaunch' if relaunch else ('warm_pool' if warm else 'task')
+        put_metric('ProvisioningLatency', now - int(updated['created_at']), 'Seconds', Path=path)
+    
+    print(f"Workspace provisioned: {workspace_url}")
+    
+    return {
+        'workspace_url': workspace_url,
+        'status': 'running',
+        'student_id': student_id,
+        'task_arn': task_arn
+    }
+
+@traced()
+def create_workspace_route(student_id, workspace_id, short_id, task_ip, tg_arn=None, shard=None):
+    """
+    Give a task its own target group and host-header listener rule on its
+    shard's listener (default: the hashed shard).
+    Returns the route attributes for the workspace row, or {'error': ...}.
+    """
+    # Create target group for this workspace (warm pool tasks already have one)
+    if not tg_arn:
         tg_name = f'ws-{workspace_id}'
         try:
             tg_response = elbv2.create_target_group(
@@ -147,10 +360,7 @@ def lambda_handler(event, context):
             print(f"Created target group: {tg_arn}")
         except Exception as e:
             print(f"Error creating target group: {str(e)}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': f'Failed to create target group: {str(e)}'})
-            }
+            return {'error': f'Failed to create target group: {str(e)}'}
         
         # Register task IP with target group
         try:
@@ -163,84 +373,38 @@ def lambda_handler(event, context):
             print(f"Error registering target: {str(e)}")
             # Clean up target group
             elbv2.delete_target_group(TargetGroupArn=tg_arn)
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': f'Failed to register target: {str(e)}'})
-            }
-        
-        # Get next available priority for ALB rule
-        try:
-            rules = elbv2.describe_rules(ListenerArn=os.environ['ALB_LISTENER_ARN'])
-            priorities = [int(r['Priority']) for r in rules['Rules'] if r['Priority'] != 'default']
-            next_priority = max(priorities) + 1 if priorities else 1
-            print(f"Using priority: {next_priority}")
-        except Exception as e:
-            print(f"Error getting priorities: {str(e)}")
-            next_priority = 1000 + int(time.time() % 10000)  # Fallback
-        
-        # Create ALB listener rule
-        workspace_url = f"https://ws-{short_id}.{os.environ['DOMAIN']}"
-        try:
-            rule_response = elbv2.create_rule(
-                ListenerArn=os.environ['ALB_LISTENER_ARN'],
-                Conditions=[{
-                    'Field': 'host-header',
-                    'Values': [f'ws-{short_id}.{os.environ["DOMAIN"]}']
-                }],
-                Actions=[{
-                    'Type': 'forward',
-                    'TargetGroupArn': tg_arn
-                }],
-                Priority=next_priority,
-                Tags=[
-                    {'Key': 'StudentId', 'Value': student_id},
-                    {'Key': 'WorkspaceId', 'Value': workspace_id}
-                ]
-            )
-            rule_arn = rule_response['Rules'][0]['RuleArn']
-            print(f"Created ALB rule: {rule_arn}")
-        except Exception as e:
-            print(f"Error creating ALB rule: {str(e)}")
-            # Clean up
-            elbv2.deregister_targets(TargetGroupArn=tg_arn, Targets=[{'Id': task_ip}])
-            elbv2.delete_target_group(TargetGroupArn=tg_arn)
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': f'Failed to create ALB rule: {str(e)}'})
-            }
-        
-        # Store in DynamoDB
-        table.put_item(Item={
-            'student_id': student_id,
-            'workspace_id': workspace_id,
-            'task_arn': task_arn,
-            'task_ip': task_ip,
-            'target_group_arn': tg_arn,
-            'rule_arn': rule_arn,
-            'workspace_url': workspace_url,
-            'status': 'running',
-            'created_at': int(time.time()),
-            'ttl': int(time.time()) + 86400  # 24 hour TTL
-        })
-        
-        print(f"Workspace provisioned: {workspace_url}")
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({
-                'workspace_url': workspace_url,
-                'status': 'running',
-                'task_arn': task_arn,
-                'password': os.environ.get('CODE_SERVER_PASSWORD', 'apranova_secure_ide')
-            })
-        }
-        
+            return {'error': f'Failed to register target: {str(e)}'}
+    
+    # Create ALB listener rule at an allocated priority
+    shard = shard or shard_for(short_id)
+    listener_arn = shard['listener_arn']
+    try:
+        rule_arn, rule_priority = create_listener_rule(
+            listener_arn,
+            conditions=[{
+                'Field': 'host-header',
+                'Values': [workspace_host(short_id, shard)]
+            }],
+            actions=[{
+                'Type': 'forward',
+                'TargetGroupArn': tg_arn
+            }],
+            tags=[
+                {'Key': 'StudentId', 'Value': student_id},
+                {'Key': 'WorkspaceId', 'Value': workspace_id}
+            ]
+        )
+        print(f"Created ALB rule: {rule_arn} (priority {rule_priority})")
     except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }
+        print(f"Error creating ALB rule: {str(e)}")
+        # Clean up
+        elbv2.deregister_targets(TargetGroupArn=tg_arn, Targets=[{'Id': task_ip}])
+        elbv2.delete_target_group(TargetGroupArn=tg_arn)
+        return {'error': f'Failed to create ALB rule: {str(e)}'}
+    
+    return {
+        'target_group_arn': tg_arn,
+        'rule_arn': rule_arn,
+        'rule_priority': rule_priority,
+        'listener_arn': listener_arn
+    }
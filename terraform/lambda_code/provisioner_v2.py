@@ -1,13 +1,22 @@
 ﻿import json
-import boto3
 import os
 import time
 import uuid
+from aws_clients import client
+from metrics import flush_metrics, timer
+from routing import router_mode, workspace_host, workspace_shard
+from rule_priorities import create_listener_rule
+from tracing import annotate, trace_handler, traced
+from workspace_state import (
+    TERMINATED, acquire_lease, create_workspace, get_workspace, record_fields, release_lease, transition
+)
+from workspace_status import cached_status, status_fields, touch_status
 
-ecs = boto3.client('ecs')
-elbv2 = boto3.client('elbv2')
-dynamodb = boto3.resource('dynamodb')
+ecs = client('ecs')
+elbv2 = client('elbv2')
 
+@flush_metrics
+@trace_handler
 def lambda_handler(event, context):
     try:
         body = json.loads(event.get('body', '{}'))
@@ -15,111 +24,190 @@ def lambda_handler(event, context):
         
         if not student_id:
             return {'statusCode': 400, 'body': json.dumps({'error': 'student_id required'})}
+        annotate(student_id=student_id)
         
-        table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
         short_id = student_id[:8]
         service_name = f"ws-{short_id}"
         
-        # Check if service already exists
-        try:
-            existing = ecs.describe_services(
-                cluster=os.environ['ECS_CLUSTER'],
-                services=[service_name]
-            )
-            if existing['services'] and existing['services'][0]['status'] == 'ACTIVE':
-                # Service exists, return URL
-                workspace_url = f"https://{service_name}.{os.environ['DOMAIN']}"
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({'workspace_url': workspace_url, 'status': 'running'})
-                }
-        except:
-            pass
-        
-        # Create target group
-        tg_name = f"ws-{short_id}"[:32]
-        try:
-            tg_response = elbv2.create_target_group(
-                Name=tg_name,
-                Protocol='HTTP',
-                Port=8080,
-                VpcId=os.environ['VPC_ID'],
-                TargetType='ip',
-                HealthCheckPath='/',
-                HealthCheckIntervalSeconds=30,
-                HealthCheckTimeoutSeconds=10,
-                HealthyThresholdCount=2,
-                UnhealthyThresholdCount=3,
-                Matcher={'HttpCode': '200-399'}
-            )
-            tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
-        except elbv2.exceptions.DuplicateTargetGroupNameException:
-            tg_response = elbv2.describe_target_groups(Names=[tg_name])
-            tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
-        
-        # Create ALB rule
-        rules = elbv2.describe_rules(ListenerArn=os.environ['ALB_LISTENER_ARN'])
-        priorities = [int(r['Priority']) for r in rules['Rules'] if r['Priority'] != 'default']
-        priority = max(priorities) + 1 if priorities else 100
+        # Answer from the row while it is fresh; ECS is only asked once it goes stale
+        workspace = get_workspace(student_id)
+        status = cached_status(workspace)
+        if status in ('running', 'starting', 'provisioning'):
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'workspace_url': workspace['workspace_url'], 'status': status})
+            }
         
+        # One request per student gets past here at a time; the rest get its in-flight status
+        lease_owner, workspace = acquire_lease(student_id, context)
+        if not lease_owner:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'workspace_url': f"https://{workspace_host(short_id, workspace_shard(workspace, short_id))}",
+                    'status': 'provisioning'
+                })
+            }
         try:
-            elbv2.create_rule(
-                ListenerArn=os.environ['ALB_LISTENER_ARN'],
-                Conditions=[{'Field': 'host-header', 'Values': [f"{service_name}.{os.environ['DOMAIN']}"]}],
-                Actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}],
-                Priority=priority
-            )
-        except:
-            pass
+            with timer('ProvisionRequestDuration', Handler='service_v2'):
+                return provision_workspace(student_id, workspace)
+        finally:
+            release_lease(student_id, lease_owner)
         
-        # Create ECS Service (this auto-manages target registration!)
-        ecs.create_service(
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+@traced()
+def provision_workspace(student_id, workspace):
+    """
+    Create the student's service, target group and rule. Runs under the
+    student's lease; workspace is their row as of taking it.
+    """
+    short_id = student_id[:8]
+    service_name = f"ws-{short_id}"
+    shard = workspace_shard(workspace, short_id)
+    workspace_url = f"https://{workspace_host(short_id, shard)}"
+    
+    # A request that held the lease before us may have just provisioned it
+    status = cached_status(workspace)
+    if status in ('running', 'starting', 'provisioning'):
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'workspace_url': workspace['workspace_url'], 'status': status})
+        }
+    
+    # Check if service already exists
+    try:
+        existing = ecs.describe_services(
             cluster=os.environ['ECS_CLUSTER'],
-            serviceName=service_name,
-            taskDefinition=os.environ['TASK_DEFINITION'],
-            desiredCount=1,
-            launchType='FARGATE',
-            networkConfiguration={
-                'awsvpcConfiguration': {
-                    'subnets': os.environ['SUBNETS'].split(','),
-                    'securityGroups': [os.environ['SECURITY_GROUP']],
-                    'assignPublicIp': 'DISABLED'
-                }
-            },
-            loadBalancers=[{
-                'targetGroupArn': tg_arn,
-                'containerName': 'codeserver',
-                'containerPort': 8080
-            }],
-            healthCheckGracePeriodSeconds=120,
-            deploymentConfiguration={
-                'maximumPercent': 200,
-                'minimumHealthyPercent': 100
-            },
-            tags=[
-                {'key': 'StudentId', 'value': student_id}
-            ],
-            propagateTags='SERVICE'
+            services=[service_name]
         )
-        
-        workspace_url = f"https://{service_name}.{os.environ['DOMAIN']}"
-        
-        table.put_item(Item={
-            'student_id': student_id,
-            'service_name': service_name,
-            'target_group_arn': tg_arn,
-            'workspace_url': workspace_url,
-            'status': 'running',
-            'created_at': int(time.time())
-        })
-        
+        if existing['services'] and existing['services'][0]['status'] == 'ACTIVE':
+            # Service exists, return URL
+            if workspace.get('status'):
+                touch_status(student_id, 'RUNNING' if existing['services'][0]['runningCount'] else 'PENDING')
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'workspace_url': workspace_url, 'status': 'running'})
+            }
+    except:
+        pass
+    
+    # Claim the row first; a request that loses the race reports provisioning
+    # instead of creating a second target group and service
+    version = create_workspace({
+        'student_id': student_id,
+        'service_name': service_name,
+        'workspace_url': workspace_url,
+        'task_port': 8080,
+        'last_activity': int(time.time()),
+        **status_fields('PROVISIONING')
+    }, replace_version=workspace.get('version', 0) if workspace.get('status') else None)
+    if not version:
         return {
             'statusCode': 200,
             'body': json.dumps({'workspace_url': workspace_url, 'status': 'provisioning'})
         }
+    
+    listener_arn = shard['listener_arn']
+    tg_arn, rule_arn, rule_priority = None, None, None
+    try:
+        # Create target group and ALB rule (the workspace router needs neither)
+        if not router_mode():
+            tg_arn = create_workspace_target_group(short_id)
+            rule_arn, rule_priority = create_workspace_rule(listener_arn, workspace_host(short_id, shard), tg_arn)
         
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+        # Create ECS Service (this auto-manages target registration!)
+        create_workspace_service(service_name, student_id, tg_arn)
+    except Exception:
+        # Release the claim so the next request can retry
+        transition(student_id, TERMINATED, version=version)
+        raise
+    
+    # workspace-status-sync moves the row to running when the task starts
+    record_fields(student_id, {
+        'target_group_arn': tg_arn,
+        'rule_arn': rule_arn,
+        'rule_priority': rule_priority,
+        'listener_arn': listener_arn
+    })
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'workspace_url': workspace_url, 'status': 'provisioning'})
+    }
+
+@traced()
+def create_workspace_target_group(short_id):
+    """Create the workspace target group, reusing an existing one"""
+    tg_name = f"ws-{short_id}"[:32]
+    try:
+        tg_response = elbv2.create_target_group(
+            Name=tg_name,
+            Protocol='HTTP',
+            Port=8080,
+            VpcId=os.environ['VPC_ID'],
+            TargetType='ip',
+            HealthCheckPath='/',
+            HealthCheckIntervalSeconds=30,
+            HealthCheckTimeoutSeconds=10,
+            HealthyThresholdCount=2,
+            UnhealthyThresholdCount=3,
+            Matcher={'HttpCode': '200-399'}
+        )
+        return tg_response['TargetGroups'][0]['TargetGroupArn']
+    except elbv2.exceptions.DuplicateTargetGroupNameException:
+        tg_response = elbv2.describe_target_groups(Names=[tg_name])
+        return tg_response['TargetGroups'][0]['TargetGroupArn']
+
+@traced()
+def create_workspace_rule(listener_arn, host, tg_arn):
+    """Create the host-header rule; returns (rule_arn, priority), or (None, None) if it failed"""
+    try:
+        return create_listener_rule(
+            listener_arn,
+            conditions=[{'Field': 'host-header', 'Values': [host]}],
+            actions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}]
+        )
+    except:
+        return None, None
+
+@traced()
+def create_workspace_service(service_name, student_id, tg_arn):
+    """Create the workspace service, attached to its target group unless routed by the router"""
+    load_balancing = {}
+    if tg_arn:
+        load_balancing = {
+            'loadBalancers': [{
+                'targetGroupArn': tg_arn,
+                'containerName': 'codeserver',
+                'containerPort': 8080
+            }],
+            'healthCheckGracePeriodSeconds': 120
+        }
+    ecs.create_service(
+        cluster=os.environ['ECS_CLUSTER'],
+        serviceName=service_name,
+        taskDefinition=os.environ['TASK_DEFINITION'],
+        desiredCount=1,
+        launchType='FARGATE',
+        networkConfiguration={
+            'awsvpcConfiguration': {
+                'subnets': os.environ['SUBNETS'].split(','),
+                'securityGroups': [os.environ['SECURITY_GROUP']],
+                'assignPublicIp': 'DISABLED'
+            }
+        },
+        deploymentConfiguration={
+            'maximumPercent': 200,
+            'minimumHealthyPercent': 100
+        },
+        tags=[
+            {'key': 'StudentId', 'value': student_id}
+        ],
+        propagateTags='SERVICE',
+        **load_balancing
+    )
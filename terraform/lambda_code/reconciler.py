@@ -0,0 +1,357 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_clients import client
+from ecs_tasks import get_task_environment
+from ecs_waiter import describe_tasks
+from metrics import flush_metrics, put_metric
+from routing import all_shards, shard_by_listener, shard_for
+from rule_priorities import forget_rule, list_listener_rules, release_priority
+from tracing import carry_context, trace_handler, traced
+from workspace_state import TERMINATED, deserialize_item
+
+ecs = client('ecs')
+elbv2 = client('elbv2')
+dynamodb = client('dynamodb')
+
+# Seconds a resource must stay unreferenced before it is deleted. Covers the gap
+# between a provisioner creating a target group/rule and recording it on the row.
+ORPHAN_GRACE = int(os.environ.get('ORPHAN_GRACE', 900))
+# Parallel delete calls, and the ELB call rate they share (calls per second)
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', 4))
+RECONCILE_RATE = float(os.environ.get('RECONCILE_RATE', 5))
+# Most deletions per run, so one bad snapshot can't empty the listener
+RECONCILE_MAX_DELETES = int(os.environ.get('RECONCILE_MAX_DELETES', 200))
+# Stop deleting when the invocation has less than this left (milliseconds)
+TIME_BUDGET_MARGIN_MS = int(os.environ.get('TIME_BUDGET_MARGIN_MS', 15000))
+
+# Tag holding when a resource was first found unreferenced
+ORPHAN_TAG = 'OrphanSince'
+# describe_tags/add_tags/remove_tags take at most 20 ARNs per call
+TAG_BATCH = 20
+WORKSPACE_PREFIX = 'ws-'
+
+@flush_metrics
+@trace_handler
+def lambda_handler(event, context):
+    """
+    Scheduled. Garbage-collects ws-* target groups and listener rules that no
+    workspace row, warm pool task, ECS service or running task refers to,
+    e.g. those left by a provisioner that failed between creating them and
+    recording them, on every routing shard's listener. Also reports how
+    workspaces spread over the shards. Pass {"dry_run": true} to only report.
+    """
+    try:
+        result = reconcile(
+            [shard['listener_arn'] for shard in all_shards()],
+            dry_run=bool((event or {}).get('dry_run')),
+            context=context
+        )
+        print(f"Reconciled: {json.dumps(result)}")
+        return {'statusCode': 200, 'body': json.dumps(result)}
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+@traced()
+def reconcile(listener_arns, dry_run=False, context=None):
+    """
+    Diff the listeners' workspace rules and the account's workspace target
+    groups against everything that references them. An unreferenced resource
+    is tagged OrphanSince the first time it is seen and deleted once it has
+    stayed unreferenced for ORPHAN_GRACE; the tag is dropped if it is
+    referenced again. Rules go first, since ELB won't delete a target group
+    a rule still forwards to.
+    """
+    now = int(time.time())
+    # List resources before reading references: one recorded in between is then still seen as referenced
+    rules = [rule for listener_arn in listener_arns for rule in workspace_rules(listener_arn)]
+    target_groups = workspace_target_groups()
+    tg_refs, rule_refs, workspace_ids, placements = referenced_resources()
+    tags = get_tags([rule['RuleArn'] for rule in rules] + list(target_groups))
+    
+    def is_referenced(arn, refs):
+        return arn in refs or tags.get(arn, {}).get('WorkspaceId') in workspace_ids
+    
+    kept_rules = [
+        rule for rule in rules
+        if is_referenced(rule['RuleArn'], rule_refs) or any(tg in tg_refs for tg in forwarded_target_groups(rule))
+    ]
+    kept_rule_arns = {rule['RuleArn'] for rule in kept_rules}
+    orphan_rules = [rule for rule in rules if rule['RuleArn'] not in kept_rule_arns]
+    # Target groups a kept rule forwards to stay too
+    tg_refs = tg_refs | {tg for rule in kept_rules for tg in forwarded_target_groups(rule)}
+    orphan_tgs = [arn for arn in target_groups if not is_referenced(arn, tg_refs)]
+    
+    orphans = {rule['RuleArn'] for rule in orphan_rules} | set(orphan_tgs)
+    unmark = [arn for arn, resource_tags in tags.items() if ORPHAN_TAG in resource_tags and arn not in orphans]
+    mark = [arn for arn in orphans if ORPHAN_TAG not in tags.get(arn, {})]
+    expired = {arn for arn in orphans if now - int(tags.get(arn, {}).get(ORPHAN_TAG, now)) >= ORPHAN_GRACE}
+    
+    result = {
+        'listeners': len(listener_arns),
+        'shards': placements,
+        'rules': len(rules),
+        'target_groups': len(target_groups),
+        'orphan_rules': len(orphan_rules),
+        'orphan_target_groups': len(orphan_tgs),
+        'marked': len(mark),
+        'unmarked': len(unmark),
+        'expired': len(expired),
+        'deleted': 0,
+        'failed': 0,
+        'dry_run': dry_run
+    }
+    put_metric('OrphanedResources', len(orphan_rules), Resource='rule')
+    put_metric('OrphanedResources', len(orphan_tgs), Resource='target_group')
+    for shard_name, counts in placements.items():
+        put_metric('ShardWorkspaces', counts['workspaces'], Shard=shard_name)
+        put_metric('MisplacedWorkspaces', counts['misplaced'], Shard=shard_name)
+    if dry_run:
+        return result
+    
+    tag_resources(mark, {ORPHAN_TAG: str(now)})
+    untag_resources(unmark, [ORPHAN_TAG])
+    
+    budget = RECONCILE_MAX_DELETES
+    rule_deletes = [rule for rule in orphan_rules if rule['RuleArn'] in expired][:budget]
+    # A rule left in place this run still holds its target group
+    deleting = {rule['RuleArn'] for rule in rule_deletes}
+    held = {tg for rule in rules if rule['RuleArn'] not in deleting for tg in forwarded_target_groups(rule)}
+    tg_deletes = [arn for arn in orphan_tgs if arn in expired and arn not in held][:budget - len(rule_deletes)]
+    
+    def out_of_time():
+        return context is not None and context.get_remaining_time_in_millis() < TIME_BUDGET_MARGIN_MS
+    
+    def delete_rule(rule):
+        if out_of_time():
+            return None
+        throttle()
+        elbv2.delete_rule(RuleArn=rule['RuleArn'])
+        forget_rule(rule['ListenerArn'], rule['RuleArn'])
+        release_priority(rule['ListenerArn'], rule.get('Priority'))
+        return rule['RuleArn']
+    
+    def delete_target_group(arn):
+        if out_of_time():
+            return None
+        throttle()
+        elbv2.delete_target_group(TargetGroupArn=arn)
+        return arn
+    
+    # Rules must be gone before their target groups can be deleted
+    for resource, delete, items in (('rule', delete_rule, rule_deletes), ('target_group', delete_target_group, tg_deletes)):
+        deleted, failed = run_bounded(carry_context(delete), items)
+        print(f"Deleted {deleted} orphaned {resource}(s), {failed} failed")
+        put_metric('OrphansDeleted', deleted, Resource=resource)
+        put_metric('OrphanDeleteFailures', failed, Resource=resource)
+        result['deleted'] += deleted
+        result['failed'] += failed
+    
+    return result
+
+def run_bounded(fn, items):
+    """Run fn over items on the delete pool; returns (succeeded, failed) counts"""
+    if not items:
+        return 0, 0
+    deleted = failed = 0
+    with ThreadPoolExecutor(max_workers=RECONCILE_CONCURRENCY) as pool:
+        for future in [pool.submit(fn, item) for item in items]:
+            try:
+                if future.result():
+                    deleted += 1
+            except Exception as e:
+                print(f"Error deleting orphan: {str(e)}")
+                failed += 1
+    return deleted, failed
+
+def rate_limiter(per_second):
+    """A function that blocks its callers, across threads, to at most per_second calls a second"""
+    lock = threading.Lock()
+    next_slot = [0.0]
+    
+    def wait():
+        with lock:
+            now = time.monotonic()
+            delay = next_slot[0] - now
+            next_slot[0] = max(next_slot[0], now) + 1 / per_second
+        if delay > 0:
+            time.sleep(delay)
+    return wait
+
+# Delete workers share one call rate so they stay clear of ELB throttling
+throttle = rate_limiter(RECONCILE_RATE)
+
+@traced()
+def workspace_rules(listener_arn):
+    """Listener rules whose host conditions all name ws-* hosts, tagged with their ListenerArn"""
+    rules = []
+    for rule in list_listener_rules(listener_arn):
+        hosts = [
+            host
+            for cond in rule.get('Conditions', [])
+            for host in cond.get('HostHeaderConfig', {}).get('Values', [])
+        ]
+        if hosts and all(host.startswith(WORKSPACE_PREFIX) for host in hosts):
+            rules.append({**rule, 'ListenerArn': listener_arn})
+    return rules
+
+def forwarded_target_groups(rule):
+    """Target group ARNs a rule's forward actions send traffic to"""
+    arns = set()
+    for action in rule.get('Actions', []):
+        if action.get('TargetGroupArn'):
+            arns.add(action['TargetGroupArn'])
+        for target in action.get('ForwardConfig', {}).get('TargetGroups', []):
+            arns.add(target['TargetGroupArn'])
+    return arns
+
+@traced()
+def workspace_target_groups():
+    """ARNs of every ws-* target group in the account, 400 per page"""
+    arns = []
+    kwargs = {'PageSize': 400}
+    while True:
+        page = elbv2.describe_target_groups(**kwargs)
+        arns.extend(
+            tg['TargetGroupArn'] for tg in page['TargetGroups']
+            if tg['TargetGroupName'].startswith(WORKSPACE_PREFIX)
+        )
+        if not page.get('NextMarker'):
+            return arns
+        kwargs['Marker'] = page['NextMarker']
+
+@traced()
+def get_tags(arns):
+    """ARN -> {tag key: value}, 20 ARNs per describe_tags call"""
+    tags = {}
+    for i in range(0, len(arns), TAG_BATCH):
+        batch = arns[i:i + TAG_BATCH]
+        try:
+            descriptions = elbv2.describe_tags(ResourceArns=batch)['TagDescriptions']
+        except ClientError:
+            # A resource in the batch was deleted since it was listed - ask one by one
+            descriptions = []
+            for arn in batch:
+                try:
+                    descriptions.extend(elbv2.describe_tags(ResourceArns=[arn])['TagDescriptions'])
+                except ClientError as e:
+                    print(f"Skipping {arn}: {str(e)}")
+        for description in descriptions:
+            tags[description['ResourceArn']] = {tag['Key']: tag['Value'] for tag in description.get('Tags', [])}
+    return tags
+
+def tag_resources(arns, tags):
+    for i in range(0, len(arns), TAG_BATCH):
+        elbv2.add_tags(
+            ResourceArns=arns[i:i + TAG_BATCH],
+            Tags=[{'Key': key, 'Value': value} for key, value in tags.items()]
+        )
+
+def untag_resources(arns, keys):
+    for i in range(0, len(arns), TAG_BATCH):
+        elbv2.remove_tags(ResourceArns=arns[i:i + TAG_BATCH], TagKeys=keys)
+
+@traced()
+def referenced_resources():
+    """
+    What still points at workspace routing: target group and rule ARNs on
+    live workspace rows and warm pool tasks, target groups attached to ECS
+    services, and the workspace IDs of running tasks. Also counts the live
+    rows routed through each shard, and those the hash now places elsewhere.
+    Returns (target_group_arns, rule_arns, workspace_ids, {shard: counts}).
+    """
+    tg_refs, rule_refs, workspace_ids = set(), set(), set()
+    placements = {shard['name']: {'workspaces': 0, 'misplaced': 0} for shard in all_shards()}
+    
+    attributes = ['student_id', 'target_group_arn', 'rule_arn', 'listener_arn', 'workspace_id', 'status']
+    for row in scan_table(os.environ['DYNAMODB_TABLE'], attributes):
+        if row.get('status') == TERMINATED:
+            continue
+        tg_refs.add(row.get('target_group_arn'))
+        rule_refs.add(row.get('rule_arn'))
+        workspace_ids.add(row.get('workspace_id'))
+        count_placement(placements, row)
+    
+    if os.environ.get('WARM_POOL_TABLE'):
+        for row in scan_table(os.environ['WARM_POOL_TABLE'], ['target_group_arn', 'workspace_id']):
+            tg_refs.add(row.get('target_group_arn'))
+            workspace_ids.add(row.get('workspace_id'))
+    
+    tg_refs |= service_target_groups()
+    workspace_ids |= running_workspace_ids()
+    for refs in (tg_refs, rule_refs, workspace_ids):
+        refs.discard(None)
+    return tg_refs, rule_refs, workspace_ids, placements
+
+def count_placement(placements, row):
+    """
+    Count a live row against the shard it is routed through. Misplaced rows
+    (after shards were added or set draining) stay put while they live and
+    land on their hashed shard when next provisioned.
+    """
+    shard = shard_by_listener(row.get('listener_arn'))
+    if not shard or not row.get('student_id'):
+        return
+    placements[shard['name']]['workspaces'] += 1
+    if shard_for(row['student_id'][:8])['name'] != shard['name']:
+        placements[shard['name']]['misplaced'] += 1
+
+def scan_table(table_name, attributes):
+    """Every item of a table, projected to attributes"""
+    scan_kwargs = {
+        'TableName': table_name,
+        'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(attributes))),
+        'ExpressionAttributeNames': {f'#a{i}': name for i, name in enumerate(attributes)}
+    }
+    while True:
+        response = dynamodb.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            yield deserialize_item(item)
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def service_target_groups():
+    """Target groups attached to the cluster's services (suspended ones included)"""
+    cluster = os.environ['ECS_CLUSTER']
+    service_arns = []
+    kwargs = {'cluster': cluster, 'maxResults': 100}
+    while True:
+        page = ecs.list_services(**kwargs)
+        service_arns.extend(page['serviceArns'])
+        if not page.get('nextToken'):
+            break
+        kwargs['nextToken'] = page['nextToken']
+    
+    arns = set()
+    # describe_services accepts at most 10 services per call
+    for i in range(0, len(service_arns), 10):
+        response = ecs.describe_services(cluster=cluster, services=service_arns[i:i + 10])
+        for service in response['services']:
+            arns.update(lb.get('targetGroupArn') for lb in service.get('loadBalancers', []))
+    return arns
+
+def running_workspace_ids():
+    """WORKSPACE_ID of every task in the cluster that hasn't stopped"""
+    cluster = os.environ['ECS_CLUSTER']
+    task_arns = []
+    kwargs = {'cluster': cluster, 'maxResults': 100}
+    while True:
+        page = ecs.list_tasks(**kwargs)
+        task_arns.extend(page['taskArns'])
+        if not page.get('nextToken'):
+            break
+        kwargs['nextToken'] = page['nextToken']
+    
+    return {
+        get_task_environment(task).get('WORKSPACE_ID')
+        for task in describe_tasks(task_arns, cluster).values()
+    }
@@ -0,0 +1,115 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+# 'rules': one target group and listener rule per workspace (capped by the
+# listener's rule limit). 'router': the ws-* wildcard rule sends every
+# workspace to the workspace router, which proxies by task IP from the table.
+ROUTING_MODE = os.environ.get('ROUTING_MODE', 'rules')
+# Points each unit of shard weight gets on the hash ring
+SHARD_VNODES = int(os.environ.get('SHARD_VNODES', 64))
+
+# (shards, ring), built from the environment on first use
+shard_map = []
+shard_map_lock = threading.Lock()
+
+def router_mode():
+    return ROUTING_MODE == 'router'
+
+def load_shards():
+    """
+    The routing shards: ALB listeners, each serving ws-<short_id> hosts under
+    its own domain. ROUTING_SHARDS is a JSON list of
+        {"name": ..., "listener_arn": ..., "domain": ..., "weight": 1, "draining": false}
+    and defaults to one shard from ALB_LISTENER_ARN and DOMAIN.
+    """
+    raw = os.environ.get('ROUTING_SHARDS', '').strip()
+    configured = json.loads(raw) if raw else []
+    if not configured:
+        configured = [{
+            'name': 'default',
+            'listener_arn': os.environ.get('ALB_LISTENER_ARN'),
+            'domain': os.environ.get('DOMAIN')
+        }]
+    return [
+        {
+            'name': shard.get('name') or f"shard-{i}",
+            'listener_arn': shard['listener_arn'],
+            'domain': shard['domain'],
+            'weight': int(shard.get('weight', 1)),
+            'draining': bool(shard.get('draining', False))
+        }
+        for i, shard in enumerate(configured)
+    ]
+
+def ring_hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+def build_ring(shards):
+    """
+    Sorted (point, shard) pairs for the shards taking new workspaces. Points
+    depend only on shard names, so adding a shard moves just the hosts that
+    land on its points; draining shards take no new hosts.
+    """
+    ring = []
+    for shard in shards:
+        if shard['draining']:
+            continue
+        for i in range(SHARD_VNODES * max(shard['weight'], 0)):
+            ring.append((ring_hash(f"{shard['name']}#{i}"), shard['name']))
+    ring.sort()
+    return ring
+
+def routing_shards():
+    """(shards, ring), loaded once per container"""
+    with shard_map_lock:
+        if not shard_map:
+            shards = load_shards()
+            shard_map.extend([shards, build_ring(shards)])
+        return shard_map[0], shard_map[1]
+
+def all_shards():
+    """Every shard, draining ones included (cleanup and reconciliation cover them all)"""
+    return routing_shards()[0]
+
+def shard_for(short_id):
+    """The shard a new ws-<short_id> host is placed on (consistent hash)"""
+    shards, ring = routing_shards()
+    by_name = {shard['name']: shard for shard in shards}
+    if not ring:
+        return shards[0]
+    index = bisect.bisect(ring, (ring_hash(f"ws-{short_id}"),)) % len(ring)
+    return by_name[ring[index][1]]
+
+def shard_by_listener(listener_arn):
+    """The shard serving a listener, or None if it is not in the map"""
+    for shard in all_shards():
+        if listener_arn and shard['listener_arn'] == listener_arn:
+            return shard
+    return None
+
+def workspace_shard(workspace, short_id):
+    """
+    The shard a workspace is routed through. Placement is sticky: a live row
+    keeps the listener recorded on it even after shards are added, and moves
+    to its hashed shard only when it is provisioned afresh.
+    """
+    workspace = workspace or {}
+    if workspace.get('status') != 'terminated':
+        recorded = shard_by_listener(workspace.get('listener_arn'))
+        if recorded:
+            return recorded
+    return shard_for(short_id)
+
+def workspace_host(short_id, shard):
+    return f"ws-{short_id}.{shard['domain']}"
+
+def route_name(short_id):
+    """
+    The host label the workspace router looks a task up by. Rows carry it as
+    route_host only while they carry task_ip, which keeps route_host-index
+    down to the workspaces that can be routed.
+    """
+    return f"ws-{short_id}".lower()
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from aws_clients import client
+from dynamodb_items import batch_write
+from tracing import traced
+
+elbv2 = client('elbv2')
+# Low-level client: allocation runs on every rule the provisioners create
+dynamodb = client('dynamodb')
+
+# ALB listener rule priorities are 1..50000
+MAX_PRIORITY = 50000
+# Sort key of the per-listener counter item; freed priorities use their own value
+COUNTER_SORT_KEY = 0
+# Seconds a cached host -> rule index is trusted before a full refresh
+RULE_INDEX_TTL = int(os.environ.get('RULE_INDEX_TTL', 300))
+# Minimum age before a lookup miss forces a refresh (stops misses hammering describe_rules)
+RULE_INDEX_MISS_REFRESH = int(os.environ.get('RULE_INDEX_MISS_REFRESH', 10))
+
+# listener_arn -> {'hosts': {host: rule_arn}, 'loaded_at': time}, kept across warm invocations
+rule_indexes = {}
+rule_index_lock = threading.Lock()
+
+def list_listener_rules(listener_arn):
+    """Return every rule on a listener, following describe_rules pagination"""
+    rules = []
+    kwargs = {'ListenerArn': listener_arn, 'PageSize': 400}
+    while True:
+        page = elbv2.describe_rules(**kwargs)
+        rules.extend(page['Rules'])
+        if not page.get('NextMarker'):
+            return rules
+        kwargs['Marker'] = page['NextMarker']
+
+def index_rules(rules):
+    """Map every host-header value on a listener to the rule that routes it"""
+    hosts = {}
+    for rule in rules:
+        for cond in rule.get('Conditions', []):
+            for host in cond.get('HostHeaderConfig', {}).get('Values', []):
+                hosts[host] = rule['RuleArn']
+    return hosts
+
+@traced()
+def refresh_rule_index(listener_arn):
+    hosts = index_rules(list_listener_rules(listener_arn))
+    with rule_index_lock:
+        rule_indexes[listener_arn] = {'hosts': hosts, 'loaded_at': time.time()}
+    return hosts
+
+def rule_index(listener_arn, max_age=None):
+    """
+    Host -> rule ARN for a listener, served from the warm-invocation cache
+    and rebuilt with a full paginated listing once older than max_age.
+    """
+    max_age = RULE_INDEX_TTL if max_age is None else max_age
+    cached = rule_indexes.get(listener_arn)
+    if cached and time.time() - cached['loaded_at'] < max_age:
+        return cached['hosts']
+    return refresh_rule_index(listener_arn)
+
+def find_rule(listener_arn, host):
+    """Return the ARN of the rule routing host, or None"""
+    rule_arn = rule_index(listener_arn).get(host)
+    if rule_arn is None:
+        # Might be a rule created elsewhere since the last refresh
+        rule_arn = rule_index(listener_arn, RULE_INDEX_MISS_REFRESH).get(host)
+    return rule_arn
+
+def remember_rule(listener_arn, conditions, rule_arn):
+    """Add a just-created rule's hosts to the cached index"""
+    with rule_index_lock:
+        cached = rule_indexes.get(listener_arn)
+        if not cached:
+            return
+        for cond in conditions:
+            if cond.get('Field') == 'host-header':
+                for host in cond.get('Values', cond.get('HostHeaderConfig', {}).get('Values', [])):
+                    cached['hosts'][host] = rule_arn
+
+def forget_rule(listener_arn, rule_arn):
+    """Drop a deleted rule from the cached index"""
+    with rule_index_lock:
+        cached = rule_indexes.get(listener_arn)
+        if not cached:
+            return
+        cached['hosts'] = {h: arn for h, arn in cached['hosts'].items() if arn != rule_arn}
+
+def highest_priority(rules):
+    priorities = [int(r['Priority']) for r in rules if r['Priority'] != 'default']
+    return max(priorities) if priorities else 0
+
+def priority_key(listener_arn, priority):
+    return {'listener_arn': {'S': listener_arn}, 'priority': {'N': str(priority)}}
+
+def seed_counter(table_name, listener_arn):
+    """Start the counter above whatever the listener already holds"""
+    start = highest_priority(list_listener_rules(listener_arn))
+    try:
+        dynamodb.put_item(
+            TableName=table_name,
+            Item={
+                **priority_key(listener_arn, COUNTER_SORT_KEY),
+                'next_priority': {'N': str(start)}
+            },
+            ConditionExpression='attribute_not_exists(listener_arn)'
+        )
+        print(f"Seeded priority counter for {listener_arn} at {start}")
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass  # Another provisioner seeded it first
+
+def claim_free_priority(table_name, listener_arn):
+    """Pop a released priority off the free list, or None if it is empty"""
+    response = dynamodb.query(
+        TableName=table_name,
+        KeyConditionExpression='listener_arn = :listener AND #priority > :counter',
+        ExpressionAttributeNames={'#priority': 'priority'},
+        ExpressionAttributeValues={
+            ':listener': {'S': listener_arn},
+            ':counter': {'N': str(COUNTER_SORT_KEY)}
+        },
+        Limit=5
+    )
+    for item in response.get('Items', []):
+        priority = int(item['priority']['N'])
+        try:
+            dynamodb.delete_item(
+                TableName=table_name,
+                Key=priority_key(listener_arn, priority),
+                ConditionExpression='attribute_exists(#priority)',
+                ExpressionAttributeNames={'#priority': 'priority'}
+            )
+            return priority
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            continue  # Claimed by a concurrent provisioner
+    return None
+
+@traced()
+def allocate_priority(listener_arn):
+    """
+    Allocate a unique rule priority for a listener.
+    Reuses released priorities first, then bumps an atomic counter.
+    Falls back to max()+1 over the listener when no PRIORITY_TABLE is set.
+    """
+    if not os.environ.get('PRIORITY_TABLE'):
+        return highest_priority(list_listener_rules(listener_arn)) + 1
+
+    table_name = os.environ['PRIORITY_TABLE']
+
+    priority = claim_free_priority(table_name, listener_arn)
+    if priority is not None:
+        return priority
+
+    for attempt in range(2):
+        try:
+            response = dynamodb.update_item(
+                TableName=table_name,
+                Key=priority_key(listener_arn, COUNTER_SORT_KEY),
+                UpdateExpression='ADD next_priority :one',
+                ConditionExpression='attribute_exists(next_priority) AND next_priority < :max',
+                ExpressionAttributeValues={':one': {'N': '1'}, ':max': {'N': str(MAX_PRIORITY)}},
+                ReturnValues='UPDATED_NEW'
+            )
+            return int(response['Attributes']['next_priority']['N'])
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            counter = dynamodb.get_item(
+                TableName=table_name,
+                Key=priority_key(listener_arn, COUNTER_SORT_KEY)
+            ).get('Item')
+            if counter is None:
+                seed_counter(table_name, listener_arn)
+            elif int(counter['next_priority']['N']) >= MAX_PRIORITY:
+                break
+            # else a concurrent provisioner seeded it after our update; try again
+
+    raise RuntimeError(f"No ALB rule priorities left on {listener_arn}")
+
+def release_priority(listener_arn, priority):
+    """Return a priority to the free list after its rule was deleted"""
+    if not os.environ.get('PRIORITY_TABLE') or not listener_arn or not priority:
+        return
+    try:
+        dynamodb.put_item(TableName=os.environ['PRIORITY_TABLE'], Item=priority_key(listener_arn, int(priority)))
+        print(f"Released priority {priority} on {listener_arn}")
+    except Exception as e:
+        print(f"Error releasing priority {priority}: {str(e)}")
+
+@traced()
+def release_priorities(released):
+    """Return several (listener_arn, priority) pairs to the free list with BatchWriteItem"""
+    released = {(listener_arn, int(priority)) for listener_arn, priority in released if listener_arn and priority}
+    if not os.environ.get('PRIORITY_TABLE') or not released:
+        return
+    try:
+        batch_write(os.environ['PRIORITY_TABLE'], [
+            {'PutRequest': {'Item': priority_key(listener_arn, priority)}}
+            for listener_arn, priority in released
+        ])
+        print(f"Released {len(released)} priorities")
+    except Exception as e:
+        print(f"Error releasing priorities: {str(e)}")
+
+@traced()
+def create_listener_rule(listener_arn, conditions, actions, tags=None, max_attempts=3):
+    """
+    Create a listener rule at a freshly allocated priority.
+    Returns (rule_arn, priority). Priorities taken by rules created outside
+    the allocator are skipped; on any other failure the priority is released.
+    """
+    for attempt in range(max_attempts):
+        priority = allocate_priority(listener_arn)
+        kwargs = {
+            'ListenerArn': listener_arn,
+            'Conditions': conditions,
+            'Actions': actions,
+            'Priority': priority
+        }
+        if tags:
+            kwargs['Tags'] = tags
+        try:
+            response = elbv2.create_rule(**kwargs)
+            rule_arn = response['Rules'][0]['RuleArn']
+            remember_rule(listener_arn, conditions, rule_arn)
+            return rule_arn, priority
+        except elbv2.exceptions.PriorityInUseException:
+            print(f"Priority {priority} already in use on {listener_arn}, retrying")
+        except Exception:
+            release_priority(listener_arn, priority)
+            raise
+
+    raise RuntimeError(f"Could not allocate a free ALB rule priority after {max_attempts} attempts")
@@ -0,0 +1,62 @@
+import json
+import os
+import urllib3
+from urllib.parse import urlencode
+
+# Supabase configuration (point SUPABASE_URL at a local stub for testing)
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', '')
+
+# Connections kept per host; match the handlers' worker pools so threads don't queue
+SUPABASE_POOL_SIZE = int(os.environ.get('SUPABASE_POOL_SIZE', 10))
+# Ids per id=in.(...) request, keeps the URL well under PostgREST's limits
+ID_CHUNK = 100
+
+# PATCHes here set fixed values on an id filter, so they are safe to retry too
+http = urllib3.PoolManager(
+    maxsize=SUPABASE_POOL_SIZE,
+    timeout=urllib3.Timeout(connect=2.0, read=5.0),
+    retries=urllib3.Retry(
+        total=2, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'PATCH']), respect_retry_after_header=True
+    )
+)
+
+def is_configured():
+    return bool(SUPABASE_URL and SUPABASE_SERVICE_KEY)
+
+def headers():
+    return {
+        'apikey': SUPABASE_SERVICE_KEY,
+        'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+def select(table, params):
+    """
+    GET rows from a PostgREST table.
+    params are PostgREST query parameters, e.g. {'select': 'id', 'batch_id': 'eq.<id>'}.
+    """
+    response = http.request(
+        'GET',
+        f"{SUPABASE_URL}/rest/v1/{table}?{urlencode(params)}",
+        headers=headers()
+    )
+    if response.status >= 300:
+        raise RuntimeError(f"Supabase GET {table} failed: {response.status} {response.data[:200]}")
+    return json.loads(response.data.decode('utf-8'))
+
+def update(table, ids, fields):
+    """
+    PATCH the same fields onto every row whose id is in ids, in one request
+    (id=in.(...)). Callers keep ids to ID_CHUNK.
+    """
+    id_filter = 'in.(' + ','.join(ids) + ')'
+    response = http.request(
+        'PATCH',
+        f"{SUPABASE_URL}/rest/v1/{table}?{urlencode({'id': id_filter})}",
+        body=json.dumps(fields).encode('utf-8'),
+        headers={**headers(), 'Prefer': 'return=minimal'}
+    )
+    if response.status >= 300:
+        raise RuntimeError(f"Supabase PATCH {table} failed: {response.status} {response.data[:200]}")
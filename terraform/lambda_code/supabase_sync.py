@@ -0,0 +1,216 @@
+import json
+import os
+import time
+from aws_clients import client
+from dynamodb_items import batch_get, deserialize_item, serialize_item
+from metrics import flush_metrics, put_metric
+from supabase_rest import ID_CHUNK, is_configured, update
+from tracing import trace_handler, traced
+
+dynamodb = client('dynamodb')
+
+# Failed student writes are parked here until the sweeper gets them through
+RETRY_TABLE = os.environ.get('SUPABASE_RETRY_TABLE', '')
+# Backoff between sweeper attempts for one parked write (seconds)
+SYNC_RETRY_BASE = int(os.environ.get('SYNC_RETRY_BASE', 60))
+SYNC_RETRY_MAX = int(os.environ.get('SYNC_RETRY_MAX', 3600))
+# Parked writes older than this expire through the table TTL (seconds)
+SYNC_RETRY_TTL = int(os.environ.get('SYNC_RETRY_TTL', 7 * 24 * 3600))
+
+# students fields for the workspace statuses handlers report (the backend's WorkspaceStatus);
+# terminated workspaces are cleared by workspace_cleanup once their task stops
+DASHBOARD_FIELDS = {
+    'provisioning': {'workspace_status': 'provisioning'},
+    'starting': {'workspace_status': 'provisioning'},
+    'running': {'workspace_status': 'running'},
+    'suspended': {'workspace_status': 'stopped'}
+}
+
+def group_by_fields(updates):
+    """{student_id: fields} -> [(fields, [student_id, ...])], one entry per distinct fields"""
+    groups = {}
+    for student_id, fields in updates.items():
+        key = json.dumps(fields, sort_keys=True)
+        groups.setdefault(key, (fields, []))[1].append(student_id)
+    return list(groups.values())
+
+@traced()
+def sync_students(updates):
+    """
+    Write {student_id: fields} to the Supabase students table. Students
+    sharing the same fields go out together as id=in.(...) PATCHes; the
+    writes that fail are parked in the retry table for sweep_handler.
+    Returns the number of students written now.
+    """
+    if not updates:
+        return 0
+    if not is_configured():
+        print("Supabase not configured, skipping update")
+        return 0
+    
+    queued_at = int(time.time() * 1000)
+    written, failed = [], {}
+    for fields, student_ids in group_by_fields(updates):
+        for start in range(0, len(student_ids), ID_CHUNK):
+            chunk = student_ids[start:start + ID_CHUNK]
+            try:
+                update('students', chunk, fields)
+                written.extend(chunk)
+            except Exception as e:
+                print(f"Error updating Supabase for {len(chunk)} student(s): {str(e)}")
+                failed.update((student_id, fields) for student_id in chunk)
+    
+    print(f"Supabase sync: {len(written)} written, {len(failed)} parked")
+    put_metric('SupabaseSyncs', len(written), Outcome='written')
+    put_metric('SupabaseSyncs', len(failed), Outcome='parked')
+    if written:
+        discard_parked(written, queued_at)
+    if failed:
+        park(failed, queued_at)
+    return len(written)
+
+def sync_statuses(statuses):
+    """
+    sync_students for {student_id: workspace status}. Only workspace_status
+    is written, so a whole sweep or batch goes out as one PATCH per status;
+    statuses the dashboard doesn't show are skipped.
+    """
+    return sync_students({
+        student_id: DASHBOARD_FIELDS[status]
+        for student_id, status in statuses.items() if status in DASHBOARD_FIELDS
+    })
+
+@traced()
+def park(updates, queued_at):
+    """Queue failed writes (queued_at in ms); a newer parked write for the same student wins"""
+    if not RETRY_TABLE:
+        print(f"No retry table, dropping {len(updates)} Supabase update(s)")
+        return
+    for student_id, fields in updates.items():
+        try:
+            dynamodb.put_item(
+                TableName=RETRY_TABLE,
+                Item=serialize_item({
+                    'student_id': student_id,
+                    'fields': json.dumps(fields),
+                    'queued_at': queued_at,
+                    'attempts': 0,
+                    'next_attempt_at': queued_at // 1000,
+                    'ttl': queued_at // 1000 + SYNC_RETRY_TTL
+                }),
+                ConditionExpression='attribute_not_exists(student_id) OR queued_at <= :queued',
+                ExpressionAttributeValues={':queued': {'N': str(queued_at)}}
+            )
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            pass
+        except Exception as e:
+            print(f"Error parking Supabase update for {student_id}: {str(e)}")
+
+@traced()
+def discard_parked(student_ids, queued_at):
+    """
+    A direct write supersedes what was parked for the student before it.
+    Parked writes are rare, so they are found with batched reads and only
+    those are deleted, each unless a newer write was parked meanwhile.
+    """
+    if not RETRY_TABLE:
+        return
+    try:
+        parked = batch_get(
+            RETRY_TABLE, [{'student_id': {'S': student_id}} for student_id in student_ids],
+            ProjectionExpression='student_id, queued_at'
+        )
+    except Exception as e:
+        print(f"Error reading parked Supabase updates: {str(e)}")
+        return
+    for item in parked:
+        if int(item['queued_at']) > queued_at:
+            continue
+        try:
+            dynamodb.delete_item(
+                TableName=RETRY_TABLE,
+                Key={'student_id': {'S': item['student_id']}},
+                ConditionExpression='queued_at <= :queued',
+                ExpressionAttributeValues={':queued': {'N': str(queued_at)}}
+            )
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            pass
+        except Exception as e:
+            print(f"Error discarding parked Supabase update for {item['student_id']}: {str(e)}")
+
+def due_writes(now):
+    """Parked writes whose next attempt is due, following scan pagination"""
+    kwargs = {
+        'TableName': RETRY_TABLE,
+        'FilterExpression': 'next_attempt_at <= :now',
+        'ExpressionAttributeValues': {':now': {'N': str(int(now))}}
+    }
+    while True:
+        page = dynamodb.scan(**kwargs)
+        yield from (deserialize_item(item) for item in page.get('Items', []))
+        if 'LastEvaluatedKey' not in page:
+            return
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+@flush_metrics
+@trace_handler
+def sweep_handler(event, context):
+    """
+    Scheduled: replay parked Supabase writes. Delivered writes leave the
+    queue unless a newer one was parked meanwhile; failed ones back off.
+    """
+    if not is_configured() or not RETRY_TABLE:
+        print("Supabase sync not configured, skipping sweep")
+        return {'statusCode': 200, 'body': 'Skipped'}
+    
+    now = time.time()
+    parked = {item['student_id']: item for item in due_writes(now)}
+    updates = {student_id: json.loads(item['fields']) for student_id, item in parked.items()}
+    
+    replayed = failed = 0
+    for fields, student_ids in group_by_fields(updates):
+        for start in range(0, len(student_ids), ID_CHUNK):
+            chunk = student_ids[start:start + ID_CHUNK]
+            try:
+                update('students', chunk, fields)
+                delivered = True
+                replayed += len(chunk)
+            except Exception as e:
+                print(f"Error replaying Supabase update for {len(chunk)} student(s): {str(e)}")
+                delivered = False
+                failed += len(chunk)
+            for student_id in chunk:
+                settle(parked[student_id], delivered, now)
+    
+    print(f"Supabase sweep: {replayed} replayed, {failed} still parked")
+    put_metric('SupabaseSyncs', replayed, Outcome='replayed')
+    put_metric('SupabaseSyncs', failed, Outcome='retry_failed')
+    return {'statusCode': 200, 'body': json.dumps({'replayed': replayed, 'failed': failed})}
+
+def settle(item, delivered, now):
+    """Remove a delivered write, or schedule the next attempt; skip if re-parked meanwhile"""
+    key = {'student_id': {'S': item['student_id']}}
+    condition = {
+        'ConditionExpression': 'queued_at = :queued',
+        'ExpressionAttributeValues': {':queued': {'N': str(item['queued_at'])}}
+    }
+    try:
+        if delivered:
+            dynamodb.delete_item(TableName=RETRY_TABLE, Key=key, **condition)
+            return
+        attempts = int(item.get('attempts', 0)) + 1
+        delay = min(SYNC_RETRY_BASE * 2 ** (attempts - 1), SYNC_RETRY_MAX)
+        condition['ExpressionAttributeValues'].update({
+            ':attempts': {'N': str(attempts)},
+            ':next': {'N': str(int(now) + delay)}
+        })
+        dynamodb.update_item(
+            TableName=RETRY_TABLE,
+            Key=key,
+            UpdateExpression='SET attempts = :attempts, next_attempt_at = :next',
+            **condition
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception as e:
+        print(f"Error settling parked Supabase update for {item['student_id']}: {str(e)}")
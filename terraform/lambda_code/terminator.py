@@ -0,0 +1,311 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer
+from aws_clients import client
+from metrics import flush_metrics, put_metric
+from supabase_sync import sync_statuses
+from tracing import annotate, carry_context, trace_handler, traced
+from workspace_expiry import expired_buckets
+from workspace_state import RUNNING, SUSPENDED, TERMINATED, transition
+
+ecs = client('ecs')
+dynamodb = client('dynamodb')
+lambda_client = client('lambda')
+
+deserializer = TypeDeserializer()
+
+# Parallel scan segments and concurrent stop calls per sweep
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', 4))
+STOP_CONCURRENCY = int(os.environ.get('STOP_CONCURRENCY', 10))
+# Stop sweeping and checkpoint when less than this remains of the invocation
+TIME_BUDGET_MARGIN_MS = int(os.environ.get('TIME_BUDGET_MARGIN_MS', 30000))
+
+@flush_metrics
+@trace_handler
+def lambda_handler(event, context):
+    """
+    Terminates inactive Code-Server workspaces.
+    Triggers: scheduled event, user logout, browser close
+    """
+    try:
+        # Handle different trigger types
+        if 'student_id' in event:
+            # Direct termination request
+            return terminate_workspace(event['student_id'])
+        elif event.get('full_scan') or 'checkpoint' in event:
+            # Full-table sweep (rows written before the expiry index, or a resumed sweep)
+            return check_and_terminate_inactive(event.get('checkpoint'), context)
+        else:
+            # Scheduled check for inactive workspaces
+            return sweep_expired_workspaces()
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def terminate_workspace(student_id):
+    """Terminate a specific student's workspace"""
+    annotate(student_id=student_id)
+    response = dynamodb.get_item(
+        TableName=os.environ['DYNAMODB_TABLE'],
+        Key={'student_id': {'S': student_id}}
+    )
+    
+    if 'Item' not in response:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': 'Workspace not found'})
+        }
+    
+    workspace = deserialize(response['Item'])
+    status = stop_workspace(workspace, 'User logout or inactivity timeout')
+    if status:
+        sync_statuses({student_id: status})
+    
+    put_metric('WorkspaceTerminations', 1, Reason='user_action')
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'status': status or workspace.get('status'), 'student_id': student_id})
+    }
+
+@traced()
+def stop_workspace(workspace, reason, idle_before=None):
+    """
+    Stop a workspace's compute.
+    Service-based workspaces are suspended by scaling the service to zero,
+    keeping their target group, ALB rule and row for a fast resume; task-based
+    ones are marked terminated and their task stopped.
+    With idle_before set, only acts if the row is still running and idle,
+    so a workspace that saw activity since it was read is left alone.
+    Returns the new status ('suspended' or 'terminated'), or None if skipped.
+    """
+    annotate(student_id=workspace['student_id'], workspace_id=workspace.get('workspace_id'))
+    suspend = bool(workspace.get('service_name')) and not workspace.get('task_arn')
+    new_status = SUSPENDED if suspend else TERMINATED
+    condition = None
+    values = None
+    if idle_before is not None:
+        condition = '#status = :running AND (attribute_not_exists(last_activity) OR last_activity < :cutoff)'
+        values = {':running': RUNNING, ':cutoff': idle_before}
+    
+    # Dropping the expiry attributes takes the row off the sparse expiry-index
+    updated = transition(
+        workspace['student_id'], new_status,
+        fields={f'{new_status}_at': int(time.time())},
+        remove=('expires_at', 'expires_bucket') if suspend else ('expires_at', 'expires_bucket', 'task_ip', 'route_host'),
+        condition=condition, values=values
+    )
+    if not updated:
+        print(f"Workspace {workspace['student_id']} became active or already stopped, skipping")
+        put_metric('WorkspaceStops', 1, Outcome='skipped')
+        return None
+    put_metric('WorkspaceStops', 1, Outcome=new_status)
+    
+    task_arn = workspace.get('task_arn')
+    if suspend:
+        # Scale to zero; the service deregisters its task from the target group
+        try:
+            ecs.update_service(
+                cluster=os.environ['ECS_CLUSTER'],
+                service=workspace['service_name'],
+                desiredCount=0
+            )
+        except Exception as e:
+            print(f"Error suspending service: {e}")
+    elif task_arn:
+        # Stop ECS task
+        try:
+            ecs.stop_task(
+                cluster=os.environ['ECS_CLUSTER'],
+                task=task_arn,
+                reason=reason
+            )
+        except Exception as e:
+            print(f"Error stopping task: {e}")
+    
+    return new_status
+
+@traced()
+def check_and_terminate_inactive(checkpoint=None, context=None):
+    """
+    Check every running workspace and terminate inactive ones.
+    Catches rows that predate the expiry index. Scans the table in parallel segments, feeding idle workspaces to a
+    bounded pool of stop calls. If the invocation runs low on time the
+    unfinished segments are handed to a fresh async invocation.
+    """
+    inactivity_threshold = int(os.environ.get('INACTIVITY_TIMEOUT', 900))  # 15 min default
+    started = time.monotonic()
+    current_time = int(time.time())
+    idle_before = current_time - inactivity_threshold
+    
+    # segment number -> ExclusiveStartKey (None for a fresh segment)
+    if checkpoint:
+        total_segments = checkpoint['total_segments']
+        segments = {int(k): v for k, v in checkpoint['segments'].items()}
+    else:
+        total_segments = SCAN_SEGMENTS
+        segments = {segment: None for segment in range(total_segments)}
+    
+    def out_of_time():
+        return context is not None and context.get_remaining_time_in_millis() < TIME_BUDGET_MARGIN_MS
+    
+    # Worker threads start without this invocation's trace fields
+    stop_traced = carry_context(stop_workspace)
+    with ThreadPoolExecutor(max_workers=STOP_CONCURRENCY) as stop_pool:
+        
+        def sweep_segment(segment, start_key):
+            """Scan one segment; returns (resume key or None, stop futures, rows checked)"""
+            stops = []
+            checked = 0
+            scan_kwargs = {
+                'TableName': os.environ['DYNAMODB_TABLE'],
+                'Segment': segment,
+                'TotalSegments': total_segments,
+                'FilterExpression': '#status = :status',
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ExpressionAttributeValues': {':status': {'S': 'running'}}
+            }
+            if start_key:
+                scan_kwargs['ExclusiveStartKey'] = start_key
+            
+            while True:
+                response = dynamodb.scan(**scan_kwargs)
+                for raw in response.get('Items', []):
+                    checked += 1
+                    workspace = deserialize(raw)
+                    last_activity = int(workspace.get('last_activity', workspace.get('created_at', 0)))
+                    if last_activity < idle_before:
+                        stops.append((workspace['student_id'], stop_pool.submit(
+                            stop_traced, workspace, 'Inactivity timeout', idle_before
+                        )))
+                
+                if 'LastEvaluatedKey' not in response:
+                    return None, stops, checked
+                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+                if out_of_time():
+                    return response['LastEvaluatedKey'], stops, checked
+        
+        with ThreadPoolExecutor(max_workers=len(segments)) as scan_pool:
+            results = {
+                segment: scan_pool.submit(carry_context(sweep_segment), segment, start_key)
+                for segment, start_key in segments.items()
+            }
+            results = {segment: future.result() for segment, future in results.items()}
+        
+        remaining = {}
+        checked_count = 0
+        stopped = {}
+        for segment, (resume_key, stops, checked) in results.items():
+            if resume_key:
+                remaining[str(segment)] = resume_key
+            checked_count += checked
+            stopped.update(stop_results(stops))
+    
+    terminated_count = len(stopped)
+    sync_statuses(stopped)
+    
+    if remaining:
+        # Out of time - resume the unfinished segments in a new invocation
+        print(f"Checkpointing sweep, {len(remaining)} segment(s) left")
+        lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({
+                'checkpoint': {'total_segments': total_segments, 'segments': remaining}
+            })
+        )
+    
+    record_sweep_metrics('full_scan', started, checked_count, terminated_count)
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'terminated_count': terminated_count,
+            'checked_count': checked_count,
+            'checked_at': current_time,
+            'checkpointed': bool(remaining)
+        })
+    }
+
+@traced()
+def sweep_expired_workspaces():
+    """
+    Terminate workspaces whose expiry has passed.
+    Queries only the expiry-index buckets that are already due, so read
+    cost follows the number of idle workspaces rather than fleet size.
+    """
+    inactivity_threshold = int(os.environ.get('INACTIVITY_TIMEOUT', 900))
+    started = time.monotonic()
+    current_time = int(time.time())
+    idle_before = current_time - inactivity_threshold
+    
+    checked_count = 0
+    stops = []
+    # Worker threads start without this invocation's trace fields
+    stop_traced = carry_context(stop_workspace)
+    with ThreadPoolExecutor(max_workers=STOP_CONCURRENCY) as stop_pool:
+        for bucket in expired_buckets(current_time):
+            query_kwargs = {
+                'TableName': os.environ['DYNAMODB_TABLE'],
+                'IndexName': 'expiry-index',
+                'KeyConditionExpression': 'expires_bucket = :bucket AND expires_at <= :now',
+                'ExpressionAttributeValues': {
+                    ':bucket': {'N': str(bucket)},
+                    ':now': {'N': str(current_time)}
+                }
+            }
+            while True:
+                response = dynamodb.query(**query_kwargs)
+                for raw in response.get('Items', []):
+                    checked_count += 1
+                    workspace = deserialize(raw)
+                    stops.append((workspace['student_id'], stop_pool.submit(
+                        stop_traced, workspace, 'Inactivity timeout', idle_before
+                    )))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    stopped = stop_results(stops)
+    terminated_count = len(stopped)
+    # Suspensions reach the dashboard here; terminations once workspace_cleanup sees the task stop
+    sync_statuses(stopped)
+    
+    record_sweep_metrics('expiry', started, checked_count, terminated_count)
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'terminated_count': terminated_count,
+            'checked_count': checked_count,
+            'checked_at': current_time
+        })
+    }
+
+def stop_results(stops):
+    """[(student_id, stop future)] -> {student_id: new status} for the workspaces actually stopped"""
+    stopped = {}
+    for student_id, stop in stops:
+        try:
+            status = stop.result()
+            if status:
+                stopped[student_id] = status
+        except Exception as e:
+            print(f"Error terminating workspace: {str(e)}")
+    return stopped
+
+def record_sweep_metrics(sweep, started, checked_count, terminated_count):
+    put_metric('InactiveWorkspacesTerminated', terminated_count)
+    put_metric('WorkspaceTerminations', terminated_count, Reason='inactivity')
+    put_metric('SweepDuration', (time.monotonic() - started) * 1000, 'Milliseconds', Sweep=sweep)
+    put_metric('SweepRowsChecked', checked_count, Sweep=sweep)
+
+def deserialize(item):
+    """Convert a low-level DynamoDB item into plain Python values"""
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
@@ -0,0 +1,135 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Log every finished span as a JSON line
+TRACE_LOG = os.environ.get('TRACE_LOG', 'true').lower() == 'true'
+
+# Fields (student_id, workspace_id, request_id...) attached to every span in the current context
+trace_fields = contextvars.ContextVar('trace_fields', default=None)
+
+# Span name -> durations (ms) when collecting; None when not collecting
+collected = {} if os.environ.get('TRACE_COLLECT', '').lower() == 'true' else None
+collected_lock = threading.Lock()
+
+@contextmanager
+def span(name, **fields):
+    """
+    Time a phase. Fields given here, plus those of enclosing spans, are
+    logged with it and inherited by spans opened inside it. Yields the
+    field dict so the phase can add what it learns (e.g. workspace_id).
+    """
+    merged = {**(trace_fields.get() or {}), **fields}
+    token = trace_fields.set(merged)
+    start = time.monotonic()
+    error = None
+    try:
+        yield merged
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        trace_fields.reset(token)
+        record_span(name, (time.monotonic() - start) * 1000, merged, error)
+
+def traced(name=None):
+    """Decorator: run the function inside a span (named after it by default)"""
+    def decorate(fn):
+        span_name = name or fn.__name__
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def trace_handler(handler):
+    """Decorator for Lambda handlers: one root span per invocation, tagged with the request id"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        request_id = getattr(context, 'aws_request_id', None)
+        with span(f"handler.{handler.__name__}", request_id=request_id):
+            return handler(event, context)
+    return wrapper
+
+def annotate(**fields):
+    """Add fields to the current span and everything opened inside it from now on"""
+    current = trace_fields.get()
+    if current is not None:
+        current.update(fields)
+
+def carry_context(fn):
+    """Wrap fn so worker threads run it with the submitting thread's trace fields"""
+    context = contextvars.copy_context()
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+def trace_client(client):
+    """Time every API call a boto3 client (or resource) makes as a span"""
+    low_level = getattr(client.meta, 'client', client)
+    service = low_level.meta.service_model.service_name
+    
+    def before(model, context, **kwargs):
+        context['trace_start'] = time.monotonic()
+        context['trace_operation'] = model.name
+    
+    # after-call-error carries the exception but not the operation model
+    def after(context, **kwargs):
+        start = context.pop('trace_start', None)
+        if start is None:
+            return
+        error = kwargs.get('exception')
+        if error is None:
+            error_code = (kwargs.get('parsed') or {}).get('Error', {}).get('Code')
+            error = error_code and RuntimeError(error_code)
+        record_span(f"{service}.{context['trace_operation']}", (time.monotonic() - start) * 1000, trace_fields.get() or {}, error)
+    
+    low_level.meta.events.register('before-call', before)
+    low_level.meta.events.register('after-call', after)
+    low_level.meta.events.register('after-call-error', after)
+    return client
+
+def record_span(name, duration_ms, fields, error=None):
+    if collected is not None:
+        with collected_lock:
+            collected.setdefault(name, []).append(duration_ms)
+    if TRACE_LOG:
+        entry = {'span': name, 'duration_ms': round(duration_ms, 2), 'status': 'error' if error else 'ok'}
+        if error:
+            entry['error'] = str(error)
+        print(json.dumps({**entry, **{k: v for k, v in fields.items() if v is not None}}, default=str))
+
+def collect():
+    """Start (or restart) keeping span durations in this process for summary()"""
+    global collected
+    with collected_lock:
+        collected = {}
+
+def summary():
+    """Span name -> {count, p50, p95, p99} in ms over everything collected so far"""
+    with collected_lock:
+        snapshot = {name: sorted(durations) for name, durations in (collected or {}).items()}
+    return {
+        name: {
+            'count': len(durations),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99)
+        }
+        for name, durations in snapshot.items()
+    }
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return round(ordered[int(rank) - 1], 2)
@@ -0,0 +1,242 @@
+import json
+import os
+import time
+import uuid
+from aws_clients import client
+from capacity import run_task_placed
+from dynamodb_items import batch_write, deserialize_item, serialize_item, serializer
+from ecs_tasks import get_task_ip, get_task_wait
+from metrics import flush_metrics, put_metric
+from routing import router_mode
+from tracing import traced
+
+elbv2 = client('elbv2')
+dynamodb = client('dynamodb')
+lambda_client = client('lambda')
+
+# Number of idle, healthy workspace tasks to keep ready (0 disables the pool)
+WARM_POOL_SIZE = int(os.environ.get('WARM_POOL_SIZE', 0))
+# startedBy marker that identifies pool tasks in ECS events
+POOL_STARTED_BY = 'warm-pool'
+
+@flush_metrics
+def lambda_handler(event, context):
+    """
+    Maintains the warm pool.
+    ECS task state change events for pool tasks mark them idle or remove
+    them; scheduled and async invocations top the pool back up.
+    """
+    try:
+        if event.get('detail-type') == 'ECS Task State Change':
+            return handle_task_event(event.get('detail', {}))
+        
+        started = replenish_pool()
+        return {'statusCode': 200, 'body': json.dumps({'started': started})}
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_task_event(detail):
+    """Track a pool task through RUNNING (registered, idle) and STOPPED (gone)"""
+    if detail.get('startedBy') != POOL_STARTED_BY:
+        return {'statusCode': 200, 'body': 'Ignored'}
+    
+    table_name = os.environ['WARM_POOL_TABLE']
+    task_arn = detail.get('taskArn', '')
+    key = {'task_arn': {'S': task_arn}}
+    last_status = detail.get('lastStatus')
+    
+    if last_status == 'STOPPED':
+        removed = dynamodb.delete_item(TableName=table_name, Key=key, ReturnValues='ALL_OLD')
+        pooled = deserialize_item(removed.get('Attributes', {}))
+        # Claimed tasks belong to a workspace now; workspace_cleanup owns their target group
+        if pooled.get('target_group_arn') and pooled.get('pool_status') != 'claimed':
+            try:
+                elbv2.delete_target_group(TargetGroupArn=pooled['target_group_arn'])
+            except Exception as e:
+                print(f"Error deleting target group: {str(e)}")
+        print(f"Removed stopped pool task: {task_arn}")
+        return {'statusCode': 200, 'body': 'Removed'}
+    
+    task_ip = get_task_ip(detail)
+    if last_status != 'RUNNING' or detail.get('healthStatus') == 'UNHEALTHY' or not task_ip:
+        return {'statusCode': 200, 'body': 'Ignored'}
+    
+    item = dynamodb.get_item(TableName=table_name, Key=key).get('Item')
+    pooled = deserialize_item(item) if item else None
+    if not pooled or pooled.get('pool_status') != 'starting':
+        return {'statusCode': 200, 'body': 'Ignored'}
+    
+    # Register the task now so its health checks pass before anyone claims it;
+    # the workspace router needs only the IP
+    tg_arn = None if router_mode() else create_pool_target_group(pooled['workspace_id'], task_ip)
+    
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key=key,
+            UpdateExpression='SET pool_status = :idle, task_ip = :ip, target_group_arn = :tg, ready_at = :time',
+            ConditionExpression='pool_status = :starting',
+            ExpressionAttributeValues={
+                ':idle': {'S': 'idle'},
+                ':starting': {'S': 'starting'},
+                ':ip': {'S': task_ip},
+                # NULL in router mode, where pool tasks get no target group
+                ':tg': serializer.serialize(tg_arn),
+                ':time': {'N': str(int(time.time()))}
+            }
+        )
+        print(f"Pool task ready: {task_arn} ({task_ip})")
+        put_metric('EcsWaitTime', get_task_wait(detail), 'Seconds', Path='warm_pool')
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass  # Duplicate event already marked it idle
+    return {'statusCode': 200, 'body': 'Updated'}
+
+def create_pool_target_group(workspace_id, task_ip):
+    """Create the workspace target group for a pool task and register it"""
+    tg_response = elbv2.create_target_group(
+        Name=f'ws-{workspace_id}',
+        Protocol='HTTP',
+        Port=3000,
+        VpcId=os.environ['VPC_ID'],
+        TargetType='ip',
+        HealthCheckPath='/',
+        HealthCheckIntervalSeconds=30,
+        HealthCheckTimeoutSeconds=10,
+        HealthyThresholdCount=2,
+        UnhealthyThresholdCount=3,
+        Matcher={'HttpCode': '200-399'},
+        Tags=[
+            {'Key': 'Pool', 'Value': POOL_STARTED_BY},
+            {'Key': 'WorkspaceId', 'Value': workspace_id}
+        ]
+    )
+    tg_arn = tg_response['TargetGroups'][0]['TargetGroupArn']
+    elbv2.register_targets(
+        TargetGroupArn=tg_arn,
+        Targets=[{'Id': task_ip, 'Port': 3000}]
+    )
+    return tg_arn
+
+def count_pool(table_name, pool_status):
+    kwargs = {
+        'TableName': table_name,
+        'IndexName': 'pool_status-index',
+        'KeyConditionExpression': 'pool_status = :status',
+        'ExpressionAttributeValues': {':status': {'S': pool_status}},
+        'Select': 'COUNT'
+    }
+    total = 0
+    while True:
+        response = dynamodb.query(**kwargs)
+        total += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return total
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def replenish_pool():
+    """Start enough tasks to bring idle + starting back up to WARM_POOL_SIZE"""
+    if WARM_POOL_SIZE <= 0:
+        return 0
+    
+    table_name = os.environ['WARM_POOL_TABLE']
+    deficit = WARM_POOL_SIZE - count_pool(table_name, 'idle') - count_pool(table_name, 'starting')
+    started = 0
+    
+    while deficit > 0:
+        # run_task launches at most 10 tasks per call; Spot first per CAPACITY_POLICY
+        tasks, failures = run_task_placed(
+            cluster=os.environ['ECS_CLUSTER'],
+            taskDefinition=os.environ['TASK_DEFINITION'],
+            count=min(deficit, 10),
+            startedBy=POOL_STARTED_BY,
+            networkConfiguration={
+                'awsvpcConfiguration': {
+                    'subnets': os.environ['SUBNETS'].split(','),
+                    'securityGroups': [os.environ['SECURITY_GROUP']],
+                    'assignPublicIp': 'DISABLED'
+                }
+            },
+            tags=[
+                {'key': 'Pool', 'value': POOL_STARTED_BY}
+            ]
+        )
+        if not tasks:
+            print(f"run_task failed: {failures}")
+            break
+        
+        batch_write(table_name, [
+            {'PutRequest': {'Item': serialize_item({
+                'task_arn': task['taskArn'],
+                'workspace_id': str(uuid.uuid4())[:8],
+                'pool_status': 'starting',
+                'started_at': int(time.time())
+            })}}
+            for task in tasks
+        ])
+        started += len(tasks)
+        deficit -= len(tasks)
+    
+    if started:
+        print(f"Started {started} warm pool task(s)")
+    return started
+
+@traced()
+def claim_warm_task(student_id):
+    """
+    Atomically claim an idle pool task for a student.
+    Returns the pool item (task_arn, task_ip, workspace_id, target_group_arn) or None,
+    in which case the caller launches cold.
+    """
+    if WARM_POOL_SIZE <= 0:
+        return None
+    
+    table_name = os.environ['WARM_POOL_TABLE']
+    response = dynamodb.query(
+        TableName=table_name,
+        IndexName='pool_status-index',
+        KeyConditionExpression='pool_status = :idle',
+        ExpressionAttributeValues={':idle': {'S': 'idle'}},
+        Limit=5
+    )
+    for item in response.get('Items', []):
+        try:
+            dynamodb.update_item(
+                TableName=table_name,
+                Key={'task_arn': item['task_arn']},
+                UpdateExpression='SET pool_status = :claimed, claimed_at = :time',
+                ConditionExpression='pool_status = :idle',
+                ExpressionAttributeValues={
+                    ':claimed': {'S': 'claimed'},
+                    ':idle': {'S': 'idle'},
+                    ':time': {'N': str(int(time.time()))}
+                }
+            )
+            item = deserialize_item(item)
+            print(f"Claimed warm task for {student_id}: {item['task_arn']}")
+            return item
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            continue  # Taken by a concurrent request
+    return None
+
+def release_claimed_task(task_arn):
+    """Forget a claimed task that could not be attached (it is being stopped)"""
+    dynamodb.delete_item(TableName=os.environ['WARM_POOL_TABLE'], Key={'task_arn': {'S': task_arn}})
+
+def request_replenish():
+    """Top the pool up asynchronously after a claim"""
+    function_name = os.environ.get('WARM_POOL_FUNCTION')
+    if not function_name:
+        return
+    try:
+        lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'action': 'replenish'})
+        )
+    except Exception as e:
+        print(f"Error requesting pool replenish: {str(e)}")
@@ -1,142 +1,355 @@
 import json
-import boto3
 import os
-import urllib3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_clients import client
+from capacity import SPOT_INTERRUPTION, launch_workspace_task
+from dynamodb_items import batch_get
+from ecs_tasks import get_task_environment
+from metrics import flush_metrics, put_metric
+from routing import shard_for
+from rule_priorities import forget_rule, release_priorities
+from supabase_sync import sync_students
+from tracing import annotate, carry_context, trace_handler, traced
+from workspace_state import PROVISIONING, RUNNING, SUSPENDED, TERMINATED, deserialize_item, transition
+from workspace_status import status_fields
 
-# Initialize clients
-ecs = boto3.client('ecs')
-elbv2 = boto3.client('elbv2')
-dynamodb = boto3.resource('dynamodb')
+# Initialize clients (low-level DynamoDB: this runs for every stopped task)
+ecs = client('ecs')
+elbv2 = client('elbv2')
+dynamodb = client('dynamodb')
 
-# Supabase configuration
-SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
-SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', '')
+# Workspaces cleaned up in parallel per batch (conditional writes, ELB deletes)
+CLEANUP_CONCURRENCY = int(os.environ.get('CLEANUP_CONCURRENCY', 8))
 
-http = urllib3.PoolManager()
+# Not resolved by the batched lookup yet (None means no workspace on the task)
+MISSING = object()
 
-def update_supabase_workspace(student_id, status=None, url=None):
-    """Update workspace status in Supabase"""
-    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-        print("Supabase not configured, skipping update")
-        return False
+# Supabase students fields of a workspace that no longer exists
+CLEARED = {'workspace_status': None, 'workspace_url': None}
+
+# Response bodies for single events that didn't need a cleanup
+RESPONSES = {
+    'not_found': 'No workspace found',
+    'suspended': 'Suspended',
+    'superseded': 'Superseded',
+    'relaunched': 'Relaunched'
+}
+
+@traced()
+def cleanup_alb_resources(student_id, workspace_data, released):
+    """
+    Delete ALB rule and target group for terminated workspace. Resources that
+    are already gone count as deleted; the deleted rule's (listener, priority)
+    is appended to released. Raises if anything is left behind.
+    """
+    # Delete ALB rule; its priority is returned to the pool with the batch
+    rule_arn = workspace_data.get('rule_arn')
+    if rule_arn:
+        # Rows record their shard's listener; older rows fall back to the hashed shard
+        listener_arn = workspace_data.get('listener_arn') or shard_for(student_id[:8])['listener_arn']
+        try:
+            elbv2.delete_rule(RuleArn=rule_arn)
+            print(f"Deleted ALB rule: {rule_arn}")
+            released.append((listener_arn, workspace_data.get('rule_priority')))
+        except elbv2.exceptions.RuleNotFoundException:
+            print(f"ALB rule already deleted: {rule_arn}")
+        forget_rule(listener_arn, rule_arn)
     
+    # Delete target group
+    tg_arn = workspace_data.get('target_group_arn')
+    if tg_arn:
+        try:
+            elbv2.delete_target_group(TargetGroupArn=tg_arn)
+            print(f"Deleted target group: {tg_arn}")
+        except elbv2.exceptions.TargetGroupNotFoundException:
+            print(f"Target group already deleted: {tg_arn}")
+
+@traced()
+def find_workspace(task_arn):
+    """Look up a workspace row by task ARN via the task_arn GSI"""
+    table_name = os.environ['DYNAMODB_TABLE']
+    values = {':arn': {'S': task_arn}}
     try:
-        update_data = {
-            'workspace_status': status,
-            'workspace_url': url
-        }
-        
-        headers = {
-            'apikey': SUPABASE_SERVICE_KEY,
-            'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
-            'Content-Type': 'application/json',
-            'Prefer': 'return=minimal'
-        }
-        
-        response = http.request(
-            'PATCH',
-            f"{SUPABASE_URL}/rest/v1/students?id=eq.{student_id}",
-            body=json.dumps(update_data).encode('utf-8'),
-            headers=headers
+        response = dynamodb.query(
+            TableName=table_name,
+            IndexName='task_arn-index',
+            KeyConditionExpression='task_arn = :arn',
+            ExpressionAttributeValues=values,
+            Limit=1
         )
-        
-        print(f"Supabase update response: {response.status}")
-        return response.status in [200, 204]
+        return deserialize_item(response['Items'][0]) if response.get('Items') else None
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationException':
+            raise
+        # Index not created yet on this table - fall back to a paginated scan
+        print(f"Index lookup unavailable ({str(e)}), scanning table")
+    
+    scan_kwargs = {
+        'TableName': table_name,
+        'FilterExpression': 'task_arn = :arn',
+        'ExpressionAttributeValues': values
+    }
+    while True:
+        response = dynamodb.scan(**scan_kwargs)
+        if response.get('Items'):
+            return deserialize_item(response['Items'][0])
+        if 'LastEvaluatedKey' not in response:
+            return None
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+@traced()
+def batch_get_workspaces(student_ids):
+    """Read workspace rows by student_id with BatchGetItem; returns {student_id: row}"""
+    keys = [{'student_id': {'S': student_id}} for student_id in student_ids]
+    rows = batch_get(os.environ['DYNAMODB_TABLE'], keys, ConsistentRead=True)
+    return {row['student_id']: row for row in rows}
+
+@traced()
+def find_workspaces(stopped):
+    """
+    Map each stopped task ARN to its workspace row, or None if no row is on
+    that task. Tasks launched with a STUDENT_ID override are resolved with
+    batched reads; the rest (service tasks) are left out for find_workspace.
+    """
+    by_student = {}
+    for task_arn, detail in stopped.items():
+        student_id = get_task_environment(detail).get('STUDENT_ID')
+        if student_id:
+            by_student.setdefault(student_id, []).append(task_arn)
+    
+    rows = batch_get_workspaces(list(by_student))
+    found = {}
+    for student_id, task_arns in by_student.items():
+        row = rows.get(student_id)
+        for task_arn in task_arns:
+            # A row that moved on to a new task is not this task's workspace
+            found[task_arn] = row if row and row.get('task_arn') == task_arn else None
+    return found
+
+@traced()
+def cleanup_task(task_arn, detail, workspace, released, cleared):
+    """
+    Terminate and clean up the workspace of one stopped task; returns the
+    outcome. Cleaned students are appended to cleared for the Supabase sync.
+    """
+    annotate(task_arn=task_arn)
+    print(f"Task stopped: {task_arn}")
+    print(f"Stop code: {detail.get('stopCode', '')}, Reason: {detail.get('stoppedReason', '')}")
+    
+    if workspace is MISSING:
+        workspace = find_workspace(task_arn)
+    if not workspace:
+        print(f"No workspace found for task: {task_arn}")
+        return 'not_found'
+    
+    student_id = workspace['student_id']
+    annotate(student_id=student_id, workspace_id=workspace.get('workspace_id'))
+    print(f"Found workspace for student: {student_id}")
+    
+    # Suspended workspaces keep their target group, rule and row for resume
+    if workspace.get('status') == SUSPENDED:
+        print(f"Workspace suspended, keeping resources: {student_id}")
+        return 'suspended'
+    
+    # Spot reclaimed a live workspace: replace the task, keep its route
+    if detail.get('stopCode') == SPOT_INTERRUPTION and workspace.get('status') == RUNNING:
+        if relaunch_workspace(task_arn, workspace):
+            return 'relaunched'
+    
+    # The terminator marks rows terminated before stopping the task; anything
+    # else is terminated here, unless the row has moved on to a new task.
+    # A retried message finds the row terminated and just repeats the cleanup.
+    # This write stays per row: BatchWriteItem takes no conditions, and a
+    # TransactWriteItems batch would fail every stop for one superseded row.
+    # The unconditional writes (priorities, parked Supabase syncs) are batched.
+    if workspace.get('status') != TERMINATED:
+        terminated = transition(
+            student_id, TERMINATED,
+            fields={'terminated_at': int(time.time())},
+            remove=('expires_at', 'expires_bucket', 'task_ip', 'route_host'),
+            condition='task_arn = :arn',
+            values={':arn': task_arn}
+        )
+        if not terminated:
+            print(f"Workspace {student_id} no longer on task {task_arn}, skipping")
+            return 'superseded'
+        print(f"Marked workspace terminated: {student_id}")
+    
+    # Clean up ALB resources; Supabase is cleared for the whole batch afterwards
+    cleanup_alb_resources(student_id, workspace, released)
+    cleared.append(student_id)
+    return 'cleaned'
+
+@traced()
+def relaunch_workspace(task_arn, workspace):
+    """
+    Start a replacement for a Spot-reclaimed task on the fallback capacity
+    provider and hand the row back to provisioning on it. The target group
+    and rule stay; finalize_handler registers the new task's IP. Returns
+    False (the workspace is terminated as usual) if no task could be started.
+    """
+    student_id = workspace['student_id']
+    workspace_id = workspace.get('workspace_id')
+    if not workspace_id:
+        return False
+    try:
+        task = launch_workspace_task(student_id, workspace_id, fallback=True)
     except Exception as e:
-        print(f"Error updating Supabase: {str(e)}")
+        print(f"Error relaunching workspace {student_id}: {str(e)}")
+        return False
+    if not task:
+        return False
+    
+    now = int(time.time())
+    relaunched = transition(
+        student_id, PROVISIONING,
+        fields={
+            'task_arn': task['taskArn'],
+            'created_at': now,
+            'relaunched_at': now,
+            'relaunched_from': task_arn,
+            **status_fields('PROVISIONING', now)
+        },
+        remove=('finalize_started_at', 'task_ip', 'route_host', 'expires_at', 'expires_bucket'),
+        condition='task_arn = :arn',
+        values={':arn': task_arn}
+    )
+    if not relaunched:
+        print(f"Workspace {student_id} moved on while relaunching, stopping {task['taskArn']}")
+        try:
+            ecs.stop_task(cluster=os.environ['ECS_CLUSTER'], task=task['taskArn'], reason='Workspace relaunch superseded')
+        except Exception as e:
+            print(f"Error stopping task: {str(e)}")
         return False
+    
+    # The reclaimed task's IP would otherwise linger as an unhealthy target
+    if workspace.get('target_group_arn') and workspace.get('task_ip'):
+        try:
+            elbv2.deregister_targets(
+                TargetGroupArn=workspace['target_group_arn'],
+                Targets=[{'Id': workspace['task_ip'], 'Port': int(workspace.get('task_port', 8080))}]
+            )
+        except Exception as e:
+            print(f"Error deregistering reclaimed target: {str(e)}")
+    
+    put_metric('SpotRelaunches', 1, Path='task')
+    print(f"Relaunched Spot-reclaimed workspace {student_id} as {task['taskArn']}")
+    return True
 
-def cleanup_alb_resources(student_id, workspace_data):
-    """Delete ALB rule and target group for terminated workspace"""
-    try:
-        # Delete ALB rule
-        rule_arn = workspace_data.get('rule_arn', {}).get('S', '')
-        if rule_arn:
-            try:
-                elbv2.delete_rule(RuleArn=rule_arn)
-                print(f"Deleted ALB rule: {rule_arn}")
-            except Exception as e:
-                print(f"Error deleting rule: {str(e)}")
-        
-        # Delete target group
-        tg_arn = workspace_data.get('target_group_arn', {}).get('S', '')
-        if tg_arn:
+def is_workspace_stop(detail):
+    """Only STOPPED codeserver tasks are cleaned up"""
+    if detail.get('lastStatus') != 'STOPPED':
+        print(f"Ignoring non-STOPPED event: {detail.get('lastStatus')}")
+        return False
+    task_def_arn = detail.get('taskDefinitionArn', '')
+    if 'codeserver' not in task_def_arn.lower():
+        print(f"Ignoring non-codeserver task: {task_def_arn}")
+        return False
+    return True
+
+@traced()
+def cleanup_stopped_tasks(details):
+    """
+    Clean up after a batch of task state change details. Returns
+    {task_arn: outcome} for the workspace stops among them; 'error' marks
+    tasks whose cleanup should be retried.
+    """
+    stopped = {detail['taskArn']: detail for detail in details if is_workspace_stop(detail) and detail.get('taskArn')}
+    if not stopped:
+        return {}
+    
+    workspaces = find_workspaces(stopped)
+    released, cleared = [], []
+    outcomes = {}
+    task_cleanup = carry_context(cleanup_task)
+    with ThreadPoolExecutor(max_workers=CLEANUP_CONCURRENCY) as pool:
+        futures = {
+            task_arn: pool.submit(task_cleanup, task_arn, detail, workspaces.get(task_arn, MISSING), released, cleared)
+            for task_arn, detail in stopped.items()
+        }
+        for task_arn, future in futures.items():
             try:
-                elbv2.delete_target_group(TargetGroupArn=tg_arn)
-                print(f"Deleted target group: {tg_arn}")
+                outcomes[task_arn] = future.result()
             except Exception as e:
-                print(f"Error deleting target group: {str(e)}")
+                print(f"Error cleaning up {task_arn}: {str(e)}")
+                outcomes[task_arn] = 'error'
+    
+    release_priorities(released)
+    
+    # Clear the workspace status of every cleaned student in bulk
+    sync_students({student_id: CLEARED for student_id in cleared})
+    for outcome in outcomes.values():
+        put_metric('WorkspaceCleanups', 1, Outcome=outcome)
+    return outcomes
+
+def handle_records(records):
+    """
+    SQS batch of EventBridge events: clean them up together and report the
+    messages to retry (ReportBatchItemFailures) instead of failing the batch
+    """
+    details = {}
+    for record in records:
+        try:
+            details[record['messageId']] = json.loads(record['body']).get('detail', {})
+        except (ValueError, AttributeError) as e:
+            # Retrying can't fix a malformed message; let it go
+            print(f"Skipping unreadable message {record.get('messageId')}: {str(e)}")
+    
+    try:
+        outcomes = cleanup_stopped_tasks(list(details.values()))
     except Exception as e:
-        print(f"Error in cleanup: {str(e)}")
+        print(f"Error: {str(e)}")
+        put_metric('WorkspaceCleanups', len(details), Outcome='error')
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in details]}
+    
+    failures = [
+        {'itemIdentifier': message_id}
+        for message_id, detail in details.items()
+        if outcomes.get(detail.get('taskArn')) == 'error'
+    ]
+    print(f"Processed {len(records)} messages: {len(outcomes)} workspace stops, {len(failures)} to retry")
+    return {'batchItemFailures': failures}
 
+@flush_metrics
+@trace_handler
 def lambda_handler(event, context):
     """
-    Handles ECS task state change events.
-    When a codeserver task stops, cleans up resources and updates Supabase.
+    Handles ECS task state change events, one at a time from EventBridge or
+    in SQS batches from the cleanup queue.
+    When a codeserver task stops, marks its workspace terminated, cleans up
+    resources and updates Supabase.
     """
+    if 'Records' in event:
+        return handle_records(event['Records'])
+    
     print(f"Received event: {json.dumps(event)}")
     
     try:
         detail = event.get('detail', {})
+        outcome = cleanup_stopped_tasks([detail]).get(detail.get('taskArn'))
         
-        # Only process STOPPED tasks
-        if detail.get('lastStatus') != 'STOPPED':
-            print(f"Ignoring non-STOPPED event: {detail.get('lastStatus')}")
-            return {'statusCode': 200, 'body': 'Ignored'}
-        
-        # Only process codeserver tasks
-        task_def_arn = detail.get('taskDefinitionArn', '')
-        if 'codeserver' not in task_def_arn.lower():
-            print(f"Ignoring non-codeserver task: {task_def_arn}")
-            return {'statusCode': 200, 'body': 'Ignored'}
-        
-        task_arn = detail.get('taskArn', '')
-        stop_code = detail.get('stopCode', '')
-        stopped_reason = detail.get('stoppedReason', '')
-        
-        print(f"Task stopped: {task_arn}")
-        print(f"Stop code: {stop_code}, Reason: {stopped_reason}")
-        
-        # Find student_id from task tags or DynamoDB
-        table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-        
-        # Scan DynamoDB for the task ARN
-        response = table.scan(
-            FilterExpression='task_arn = :arn',
-            ExpressionAttributeValues={':arn': task_arn}
-        )
-        
-        if not response.get('Items'):
-            print(f"No workspace found for task: {task_arn}")
-            return {'statusCode': 200, 'body': 'No workspace found'}
-        
-        workspace = response['Items'][0]
-        student_id = workspace['student_id']
-        
-        print(f"Found workspace for student: {student_id}")
-        
-        # Clean up ALB resources
-        cleanup_alb_resources(student_id, workspace)
-        
-        # Delete from DynamoDB
-        table.delete_item(Key={'student_id': student_id})
-        print(f"Deleted DynamoDB record for: {student_id}")
-        
-        # Update Supabase - clear workspace status
-        update_supabase_workspace(student_id, status=None, url=None)
-        print(f"Cleared Supabase workspace for: {student_id}")
+        if outcome == 'error':
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'error': f"Cleanup failed for task {detail.get('taskArn')}"})
+            }
+        if outcome != 'cleaned':
+            return {'statusCode': 200, 'body': RESPONSES.get(outcome, 'Ignored')}
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Workspace cleaned up',
-                'student_id': student_id,
-                'stop_code': stop_code
+                'task_arn': detail.get('taskArn'),
+                'stop_code': detail.get('stopCode', '')
             })
         }
         
     except Exception as e:
         print(f"Error: {str(e)}")
+        put_metric('WorkspaceCleanups', 1, Outcome='error')
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
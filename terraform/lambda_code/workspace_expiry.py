@@ -0,0 +1,25 @@
+import os
+
+# Workspaces idle longer than this are terminated (seconds)
+INACTIVITY_TIMEOUT = int(os.environ.get('INACTIVITY_TIMEOUT', 900))
+# Width of an expires_bucket partition on the expiry-index GSI (seconds)
+EXPIRY_BUCKET_SECONDS = int(os.environ.get('EXPIRY_BUCKET_SECONDS', 3600))
+# How many past buckets the sweep looks back through
+EXPIRY_LOOKBACK_BUCKETS = int(os.environ.get('EXPIRY_LOOKBACK_BUCKETS', 48))
+
+def expiry_fields(last_activity):
+    """
+    Attributes that place a running workspace on the sparse expiry-index.
+    Set these wherever last_activity is bumped; remove them when the
+    workspace stops running so it drops out of the index.
+    """
+    expires_at = int(last_activity) + INACTIVITY_TIMEOUT
+    return {
+        'expires_at': expires_at,
+        'expires_bucket': expires_at // EXPIRY_BUCKET_SECONDS
+    }
+
+def expired_buckets(now):
+    """Buckets that can hold workspaces expired by now, oldest first"""
+    current = int(now) // EXPIRY_BUCKET_SECONDS
+    return range(current - EXPIRY_LOOKBACK_BUCKETS + 1, current + 1)
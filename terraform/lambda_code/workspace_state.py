@@ -0,0 +1,217 @@
+import os
+import time
+import uuid
+from aws_clients import client
+from dynamodb_items import deserialize_item, serialize_item, serializer
+from tracing import traced
+
+# Low-level client: transitions run on worker threads in the terminator
+dynamodb = client('dynamodb')
+
+# Workspace lifecycle. Every status write goes through transition()/create_workspace(),
+# which only land if the row is in a status that may move to the target.
+PROVISIONING = 'provisioning'
+RUNNING = 'running'
+SUSPENDED = 'suspended'
+TERMINATED = 'terminated'
+
+# running -> provisioning relaunches a Spot-reclaimed task in place
+TRANSITIONS = {
+    PROVISIONING: {RUNNING, TERMINATED},
+    RUNNING: {PROVISIONING, SUSPENDED, TERMINATED},
+    SUSPENDED: {RUNNING, TERMINATED},
+    TERMINATED: set()
+}
+
+# Terminated rows are kept this long (seconds) before DynamoDB TTL removes them
+TERMINATED_RETENTION = int(os.environ.get('TERMINATED_RETENTION', 86400))
+# Provisioning lease length when the holder has no Lambda context to bound it (seconds)
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 180))
+
+def sources(to_status):
+    """Statuses a workspace may move to to_status from"""
+    return sorted(status for status, targets in TRANSITIONS.items() if to_status in targets)
+
+@traced()
+def create_workspace(item, replace_version=None):
+    """
+    Write a new provisioning row for item['student_id'].
+    Only succeeds when the student has no row (or only a lease), a terminated one, or (with
+    replace_version) the exact row version the caller decided to replace
+    (0 for rows written before versioning), so two racing requests cannot
+    both provision. Returns the version written, or None if the row is taken.
+    """
+    now = int(time.time())
+    version = (replace_version or 0) + 1
+    row = {
+        **item,
+        'status': PROVISIONING,
+        'version': version,
+        'status_updated_at': now
+    }
+    row.setdefault('created_at', now)
+    condition = 'attribute_not_exists(#status) OR #status = :terminated'
+    names = {'#status': 'status'}
+    values = {':terminated': {'S': TERMINATED}}
+    if replace_version:
+        condition += ' OR #version = :version'
+        names['#version'] = 'version'
+        values[':version'] = {'N': str(replace_version)}
+    elif replace_version == 0:
+        condition += ' OR attribute_not_exists(#version)'
+        names['#version'] = 'version'
+    try:
+        dynamodb.put_item(
+            TableName=os.environ['DYNAMODB_TABLE'],
+            Item=serialize_item(row),
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        return version
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return None
+
+@traced()
+def acquire_lease(student_id, context=None):
+    """
+    Take the student's provisioning lease so concurrent requests coalesce:
+    only the holder inspects and changes the workspace, everyone else answers
+    with its in-flight status. The lease lasts for the rest of the holder's
+    invocation, so a crashed holder can't block the student for longer.
+    Returns (owner, row as of acquiring - without a status if the student has
+    no workspace), or (None, None) if another live request holds the lease.
+    A placeholder row expires through the table TTL once its lease does, in
+    case the holder dies before release_lease removes it.
+    """
+    owner = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+    seconds = LEASE_SECONDS
+    if context is not None:
+        seconds = context.get_remaining_time_in_millis() // 1000 + 1
+    now = int(time.time())
+    # Creates a status-less placeholder row when the student has none
+    row = conditional_update(
+        student_id,
+        {'lease_owner': owner, 'lease_expires': now + seconds},
+        (),
+        'attribute_not_exists(lease_expires) OR lease_expires < :now',
+        {':now': now}
+    )
+    if not row:
+        return None, None
+    if not row.get('status'):
+        # Only placeholders get the ttl: a live workspace row must not expire with a lease
+        conditional_update(
+            student_id, {'ttl': now + seconds}, (),
+            'lease_owner = :owner AND attribute_not_exists(#status)', {':owner': owner}
+        )
+    return owner, row
+
+def release_lease(student_id, owner):
+    """Give the lease back, removing the placeholder row if nothing was provisioned"""
+    if not owner:
+        return
+    released = conditional_update(
+        student_id, {}, ('lease_owner', 'lease_expires'),
+        'lease_owner = :owner AND attribute_exists(#status)', {':owner': owner}
+    )
+    if released:
+        return
+    try:
+        dynamodb.delete_item(
+            TableName=os.environ['DYNAMODB_TABLE'],
+            Key={'student_id': {'S': student_id}},
+            ConditionExpression='lease_owner = :owner AND attribute_not_exists(#status)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':owner': {'S': owner}}
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass  # Lease expired and was taken over, or create_workspace replaced the row
+
+@traced()
+def transition(student_id, to_status, fields=None, remove=(), version=None, condition=None, values=None):
+    """
+    Move a workspace to to_status with a single conditional update.
+    The write lands only if the current status may move to to_status and,
+    when given, the version still matches and the extra condition holds
+    (use #status for the status attribute). Replayed or out-of-order events
+    therefore fail the condition instead of rewinding the row.
+    Returns the updated row, or None if the transition did not apply.
+    """
+    allowed = sources(to_status)
+    if not allowed:
+        raise ValueError(f"No transition leads to {to_status}")
+    
+    now = int(time.time())
+    updates = {'status': to_status, 'status_updated_at': now, **(fields or {})}
+    if to_status == TERMINATED:
+        updates.setdefault('ttl', now + TERMINATED_RETENTION)
+    
+    conditions = ['#status IN (' + ', '.join(f':from{i}' for i in range(len(allowed))) + ')']
+    condition_values = {f':from{i}': status for i, status in enumerate(allowed)}
+    if version is not None:
+        conditions.append('#version = :version')
+        condition_values[':version'] = version
+    if condition:
+        conditions.append(f'({condition})')
+        condition_values.update(values or {})
+    
+    return conditional_update(
+        student_id, updates, remove, ' AND '.join(conditions), condition_values, bump_version=True
+    )
+
+def record_fields(student_id, fields, remove=(), condition=None, values=None):
+    """
+    Set attributes other than status (resource ARNs, task details) on an
+    existing row, optionally only if condition holds. Returns the updated
+    row, or None if the row is gone or the condition failed.
+    """
+    conditions = 'attribute_exists(student_id)'
+    if condition:
+        conditions += f' AND ({condition})'
+    return conditional_update(student_id, fields, remove, conditions, values or {})
+
+def conditional_update(student_id, updates, remove, condition, values, bump_version=False):
+    names = {'#status': 'status'} if '#status' in condition else {}
+    attr_values = {k: serializer.serialize(v) for k, v in values.items()}
+    set_parts = []
+    if bump_version:
+        names['#version'] = 'version'
+        attr_values.update({':one': {'N': '1'}, ':zero': {'N': '0'}})
+        set_parts.append('#version = if_not_exists(#version, :zero) + :one')
+    for i, (name, value) in enumerate(updates.items()):
+        names[f'#f{i}'] = name
+        attr_values[f':f{i}'] = serializer.serialize(value)
+        set_parts.append(f'#f{i} = :f{i}')
+    clauses = ['SET ' + ', '.join(set_parts)] if set_parts else []
+    if remove:
+        for i, name in enumerate(remove):
+            names[f'#r{i}'] = name
+        clauses.append('REMOVE ' + ', '.join(f'#r{i}' for i in range(len(remove))))
+    
+    kwargs = {'ExpressionAttributeNames': names}
+    if attr_values:
+        # DynamoDB rejects an empty value map (e.g. a REMOVE-only update)
+        kwargs['ExpressionAttributeValues'] = attr_values
+    try:
+        response = dynamodb.update_item(
+            TableName=os.environ['DYNAMODB_TABLE'],
+            Key={'student_id': {'S': student_id}},
+            UpdateExpression=' '.join(clauses),
+            ConditionExpression=condition,
+            ReturnValues='ALL_NEW',
+            **kwargs
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return None
+    return deserialize_item(response['Attributes'])
+
+def get_workspace(student_id, consistent=False):
+    """The student's workspace row, or None"""
+    response = dynamodb.get_item(
+        TableName=os.environ['DYNAMODB_TABLE'],
+        Key={'student_id': {'S': student_id}},
+        ConsistentRead=consistent
+    )
+    item = response.get('Item')
+    return deserialize_item(item) if item else None
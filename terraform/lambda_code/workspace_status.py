@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from aws_clients import client
+from capacity import SPOT_INTERRUPTION, fallback_strategy, on_preferred, providers
+from ecs_tasks import get_task_ip, get_task_wait
+from metrics import flush_metrics, put_metric
+from routing import route_name
+from supabase_sync import sync_statuses
+from workspace_expiry import expiry_fields
+from workspace_state import PROVISIONING, RUNNING, record_fields, transition
+
+# Low-level client: the handler runs for every workspace task state change
+dynamodb = client('dynamodb')
+ecs = client('ecs')
+
+# How long a workspace row's status is trusted without asking ECS (seconds)
+STATUS_FRESHNESS = int(os.environ.get('STATUS_FRESHNESS', 300))
+
+def status_fields(task_status, now=None):
+    """Attributes that record what ECS last said about a workspace's task"""
+    return {
+        'task_status': task_status,
+        'status_updated_at': int(now if now is not None else time.time())
+    }
+
+def cached_status(workspace, now=None):
+    """
+    The workspace status as far as the row can answer it, or None when the
+    row is missing or older than STATUS_FRESHNESS and ECS must be asked.
+    A running row whose task isn't RUNNING yet reads as 'starting'.
+    """
+    if not workspace:
+        return None
+    now = now if now is not None else time.time()
+    if now - int(workspace.get('status_updated_at', 0)) > STATUS_FRESHNESS:
+        return None
+    status = workspace.get('status')
+    if status == 'running' and workspace.get('task_status') != 'RUNNING':
+        return 'starting'
+    return status
+
+def touch_status(student_id, task_status):
+    """Re-stamp a row after ECS confirmed its task status"""
+    fields = status_fields(task_status)
+    try:
+        dynamodb.update_item(
+            TableName=os.environ['DYNAMODB_TABLE'],
+            Key={'student_id': {'S': student_id}},
+            UpdateExpression='SET task_status = :task_status, status_updated_at = :time',
+            ConditionExpression='attribute_exists(student_id)',
+            ExpressionAttributeValues={
+                ':task_status': {'S': fields['task_status']},
+                ':time': {'N': str(fields['status_updated_at'])}
+            }
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass  # Row was removed meanwhile
+
+@flush_metrics
+def lambda_handler(event, context):
+    """
+    Keeps service-based workspace rows current from ECS task state changes,
+    so provisioners can answer from the row instead of describing services.
+    RUNNING records the task IP (used by the workspace router) and promotes
+    a provisioning workspace to running; STOPPED clears the IP, and moves
+    the service to the fallback capacity provider if Spot reclaimed the task.
+    Service placement failures move the service to the fallback as well.
+    """
+    try:
+        if event.get('detail-type') == 'ECS Service Action':
+            return handle_service_action(event)
+        
+        detail = event.get('detail', {})
+        group = detail.get('group', '')
+        if not group.startswith('service:ws-'):
+            return {'statusCode': 200, 'body': 'Ignored'}
+        service_name = group[len('service:'):]
+        
+        table_name = os.environ['DYNAMODB_TABLE']
+        response = dynamodb.query(
+            TableName=table_name,
+            IndexName='service_name-index',
+            KeyConditionExpression='service_name = :service',
+            ExpressionAttributeValues={':service': {'S': service_name}},
+            Limit=1
+        )
+        if not response.get('Items'):
+            print(f"No workspace found for service: {service_name}")
+            return {'statusCode': 200, 'body': 'No workspace found'}
+        student_id = response['Items'][0]['student_id']['S']
+        
+        task_ip = get_task_ip(detail)
+        last_status = detail.get('lastStatus')
+        now = int(time.time())
+        if last_status == 'RUNNING':
+            record_running(student_id, task_ip, now)
+            put_metric('EcsWaitTime', get_task_wait(detail), 'Seconds', Path='service')
+            print(f"{service_name} running at {task_ip}")
+        elif last_status == 'STOPPED':
+            # Leave the row alone if a replacement task has already taken it over
+            try:
+                dynamodb.update_item(
+                    TableName=table_name,
+                    Key={'student_id': {'S': student_id}},
+                    UpdateExpression='SET task_status = :stopped, status_updated_at = :time REMOVE task_ip, route_host',
+                    ConditionExpression='attribute_not_exists(task_ip) OR task_ip = :ip',
+                    ExpressionAttributeValues={
+                        ':stopped': {'S': 'STOPPED'},
+                        ':time': {'N': str(now)},
+                        ':ip': {'S': task_ip or ''}
+                    }
+                )
+                print(f"{service_name} stopped ({task_ip})")
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                pass
+            if detail.get('stopCode') == SPOT_INTERRUPTION:
+                move_to_fallback(service_name)
+        
+        return {'statusCode': 200, 'body': json.dumps({'student_id': student_id, 'status': last_status})}
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_service_action(event):
+    """
+    SERVICE_TASK_PLACEMENT_FAILURE for a workspace service still on its
+    preferred provider (no Spot capacity): place it on the fallback instead
+    of letting ECS retry Spot while the student waits.
+    """
+    detail = event.get('detail', {})
+    service_name = next((arn.rsplit('/', 1)[-1] for arn in event.get('resources', [])), '')
+    if detail.get('eventName') != 'SERVICE_TASK_PLACEMENT_FAILURE' or not service_name.startswith('ws-'):
+        return {'statusCode': 200, 'body': 'Ignored'}
+    if len(providers()) < 2:
+        return {'statusCode': 200, 'body': 'No fallback'}
+    
+    services = ecs.describe_services(cluster=os.environ['ECS_CLUSTER'], services=[service_name])['services']
+    if not services or services[0]['status'] != 'ACTIVE' or not on_preferred(services[0]):
+        return {'statusCode': 200, 'body': 'Ignored'}
+    
+    print(f"{service_name} could not be placed: {detail.get('reason')}")
+    put_metric('TaskPlacementFailures', 1, Path='service')
+    move_to_fallback(service_name)
+    return {'statusCode': 200, 'body': json.dumps({'service': service_name, 'status': 'fallback'})}
+
+def move_to_fallback(service_name):
+    """
+    Redeploy a service whose Spot task was reclaimed (or couldn't be placed)
+    on the fallback provider, so the replacement doesn't wait for (or lose
+    again to) Spot capacity. The service keeps its target group.
+    """
+    try:
+        ecs.update_service(
+            cluster=os.environ['ECS_CLUSTER'],
+            service=service_name,
+            capacityProviderStrategy=fallback_strategy(),
+            forceNewDeployment=True
+        )
+        put_metric('SpotRelaunches', 1, Path='service')
+        print(f"{service_name} moved to fallback capacity")
+    except Exception as e:
+        print(f"Error moving {service_name} to fallback capacity: {str(e)}")
+
+def record_running(student_id, task_ip, now):
+    """Mark a service task running, starting the inactivity clock if it was provisioning"""
+    fields = status_fields('RUNNING', now)
+    if task_ip:
+        fields['task_ip'] = task_ip
+        fields['route_host'] = route_name(student_id[:8])
+    
+    promoted = transition(
+        student_id, RUNNING,
+        fields={**fields, 'started_at': now, 'last_activity': now, **expiry_fields(now)},
+        condition='#status = :provisioning',
+        values={':provisioning': PROVISIONING}
+    )
+    if not promoted:
+        # Already running: a resumed workspace's task coming up is news for the
+        # dashboard, a repeated event only re-records the task
+        resumed = record_fields(
+            student_id, fields,
+            condition='#status = :live AND (attribute_not_exists(task_status) OR task_status <> :running)',
+            values={':live': RUNNING, ':running': 'RUNNING'}
+        )
+        if resumed:
+            sync_statuses({student_id: RUNNING})
+        else:
+            record_fields(student_id, fields)
+        return
+    if promoted.get('created_at'):
+        put_metric('ProvisioningLatency', now - int(promoted['created_at']), 'Seconds', Path='service')
+    sync_statuses({student_id: RUNNING})
@@ -115,6 +115,12 @@ module "ecs" {
   frontend_target_group_arn = module.alb.frontend_target_group_arn
   backend_target_group_arn  = module.alb.backend_target_group_arn
   
+  # Workspace router (behind the ws-* wildcard rule)
+  workspace_routing_mode      = var.workspace_routing_mode
+  workspace_router_ecr_url    = module.ecr.workspace_router_repository_url
+  codeserver_target_group_arn = module.alb.codeserver_target_group_arn
+  workspaces_table_name       = module.lambda.workspaces_table_name
+  
   # Supabase
   supabase_url = var.supabase_url
 
@@ -146,6 +152,8 @@ module "lambda" {
   alb_listener_arn = module.alb.http_listener_arn  # HTTPS listener managed manually in AWS
 
   workspace_inactivity_timeout = var.workspace_inactivity_timeout
+  workspace_routing_mode       = var.workspace_routing_mode
+  workspace_routing_shards     = var.workspace_routing_shards
 
   tags = var.tags
 }
@@ -159,6 +159,66 @@ resource "aws_cloudwatch_dashboard" "main" {
           stat   = "Sum"
           region = var.aws_region
         }
+      },
+      # Published by the Lambdas as Embedded Metric Format log lines (lambda_code/metrics.py)
+      {
+        type   = "metric"
+        x      = 0
+        y      = 18
+        width  = 8
+        height = 6
+        properties = {
+          title = "Provisioning Latency (p95, seconds)"
+          metrics = [
+            ["Apranova/Workspaces", "ProvisioningLatency", "Path", "service"],
+            ["Apranova/Workspaces", "ProvisioningLatency", "Path", "task"],
+            ["Apranova/Workspaces", "ProvisioningLatency", "Path", "warm_pool"],
+            ["Apranova/Workspaces", "EcsWaitTime", "Path", "service"],
+            ["Apranova/Workspaces", "EcsWaitTime", "Path", "task"]
+          ]
+          period = 300
+          stat   = "p95"
+          region = var.aws_region
+        }
+      },
+      {
+        type   = "metric"
+        x      = 8
+        y      = 18
+        width  = 8
+        height = 6
+        properties = {
+          title = "ELB API Calls"
+          metrics = [
+            ["Apranova/Workspaces", "ApiCalls", "Operation", "CreateTargetGroup", "Service", "elbv2"],
+            ["Apranova/Workspaces", "ApiCalls", "Operation", "CreateRule", "Service", "elbv2"],
+            ["Apranova/Workspaces", "ApiCalls", "Operation", "DescribeRules", "Service", "elbv2"],
+            ["Apranova/Workspaces", "ApiCalls", "Operation", "DeleteRule", "Service", "elbv2"],
+            ["Apranova/Workspaces", "ApiCalls", "Operation", "DeleteTargetGroup", "Service", "elbv2"]
+          ]
+          period = 300
+          stat   = "Sum"
+          region = var.aws_region
+        }
+      },
+      {
+        type   = "metric"
+        x      = 16
+        y      = 18
+        width  = 8
+        height = 6
+        properties = {
+          title = "Cleanup Outcomes and Sweep Duration"
+          metrics = [
+            ["Apranova/Workspaces", "WorkspaceCleanups", "Outcome", "cleaned"],
+            ["Apranova/Workspaces", "WorkspaceCleanups", "Outcome", "superseded"],
+            ["Apranova/Workspaces", "WorkspaceCleanups", "Outcome", "error"],
+            ["Apranova/Workspaces", "SweepDuration", "Sweep", "expiry", { stat = "Maximum", yAxis = "right" }]
+          ]
+          period = 300
+          stat   = "Sum"
+          region = var.aws_region
+        }
       }
     ]
   })
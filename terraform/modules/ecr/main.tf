@@ -120,3 +120,42 @@ resource "aws_ecr_lifecycle_policy" "codeserver" {
   })
 }
 
+
+# Workspace Router Repository
+resource "aws_ecr_repository" "workspace_router" {
+  name                 = "${var.project_name}-workspace-router"
+  image_tag_mutability = "MUTABLE"
+
+  image_scanning_configuration {
+    scan_on_push = true
+  }
+
+  encryption_configuration {
+    encryption_type = "AES256"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.project_name}-workspace-router"
+  })
+}
+
+resource "aws_ecr_lifecycle_policy" "workspace_router" {
+  repository = aws_ecr_repository.workspace_router.name
+
+  policy = jsonencode({
+    rules = [
+      {
+        rulePriority = 1
+        description  = "Keep last 10 images"
+        selection = {
+          tagStatus   = "any"
+          countType   = "imageCountMoreThan"
+          countNumber = 10
+        }
+        action = {
+          type = "expire"
+        }
+      }
+    ]
+  })
+}
@@ -17,6 +17,11 @@ output "codeserver_repository_url" {
   value       = aws_ecr_repository.codeserver.repository_url
 }
 
+output "workspace_router_repository_url" {
+  description = "Workspace router ECR repository URL"
+  value       = aws_ecr_repository.workspace_router.repository_url
+}
+
 output "frontend_repository_arn" {
   description = "Frontend ECR repository ARN"
   value       = aws_ecr_repository.frontend.arn
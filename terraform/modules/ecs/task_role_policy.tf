@@ -52,7 +52,8 @@ resource "aws_iam_role_policy" "ecs_task" {
         ]
         Resource = [
           "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:${var.project_name}-${var.environment}-workspace-provisioner",
-          "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:${var.project_name}-${var.environment}-workspace-terminator"
+          "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:${var.project_name}-${var.environment}-workspace-terminator",
+          "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:${var.project_name}-${var.environment}-workspace-heartbeat"
         ]
       }
     ]
@@ -103,3 +103,26 @@ variable "tags" {
   type        = map(string)
 }
 
+variable "workspace_routing_mode" {
+  description = "Workspace routing: 'rules' (a listener rule per workspace) or 'router' (wildcard rule plus workspace router)"
+  type        = string
+  default     = "rules"
+}
+
+variable "workspace_router_ecr_url" {
+  description = "Workspace router ECR repository URL"
+  type        = string
+  default     = ""
+}
+
+variable "codeserver_target_group_arn" {
+  description = "Target group behind the ws-* wildcard rule; the workspace router registers here"
+  type        = string
+  default     = ""
+}
+
+variable "workspaces_table_name" {
+  description = "DynamoDB workspaces table the router reads routes from"
+  type        = string
+  default     = ""
+}
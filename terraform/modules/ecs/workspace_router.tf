@@ -0,0 +1,173 @@
+# ============================================
+# WORKSPACE ROUTER
+# Proxies ws-<short_id> hosts to workspace task IPs so all
+# workspaces share the ws-* wildcard listener rule
+# ============================================
+
+locals {
+  workspace_router_enabled = var.workspace_routing_mode == "router"
+}
+
+resource "aws_cloudwatch_log_group" "workspace_router" {
+  name              = "/ecs/${var.project_name}-${var.environment}/workspace-router"
+  retention_in_days = 7
+
+  tags = merge(var.tags, {
+    Component = "workspace-router-logs"
+  })
+}
+
+# The router only needs to read routes from the workspaces table's route_host-index
+resource "aws_iam_role" "workspace_router" {
+  name = "${var.project_name}-${var.environment}-workspace-router-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "ecs-tasks.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = var.tags
+}
+
+resource "aws_iam_role_policy" "workspace_router" {
+  name = "${var.project_name}-${var.environment}-workspace-router-policy"
+  role = aws_iam_role.workspace_router.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:Query",
+          "dynamodb:Scan"
+        ]
+        Resource = "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/${var.workspaces_table_name}/index/route_host-index"
+      }
+    ]
+  })
+}
+
+resource "aws_ecs_task_definition" "workspace_router" {
+  family                   = "${var.project_name}-${var.environment}-workspace-router"
+  network_mode             = "awsvpc"
+  requires_compatibilities = ["FARGATE"]
+  cpu                      = "256"
+  memory                   = "512"
+  execution_role_arn       = aws_iam_role.ecs_execution.arn
+  task_role_arn            = aws_iam_role.workspace_router.arn
+
+  container_definitions = jsonencode([
+    {
+      name      = "workspace-router"
+      image     = "${var.workspace_router_ecr_url}:latest"
+      essential = true
+
+      portMappings = [
+        {
+          containerPort = 8080
+          hostPort      = 8080
+          protocol      = "tcp"
+        }
+      ]
+
+      environment = [
+        {
+          name  = "DYNAMODB_TABLE"
+          value = var.workspaces_table_name
+        },
+        {
+          name  = "AWS_DEFAULT_REGION"
+          value = var.aws_region
+        }
+      ]
+
+      logConfiguration = {
+        logDriver = "awslogs"
+        options = {
+          "awslogs-group"         = aws_cloudwatch_log_group.workspace_router.name
+          "awslogs-region"        = var.aws_region
+          "awslogs-stream-prefix" = "router"
+        }
+      }
+
+      ulimits = [
+        {
+          name      = "nofile"
+          softLimit = 65536
+          hardLimit = 65536
+        }
+      ]
+    }
+  ])
+
+  tags = merge(var.tags, {
+    Component = "workspace-router"
+  })
+}
+
+# Registered in the codeserver target group that the ws-* wildcard rule forwards to
+resource "aws_ecs_service" "workspace_router" {
+  count = local.workspace_router_enabled ? 1 : 0
+
+  name            = "${var.project_name}-${var.environment}-workspace-router"
+  cluster         = aws_ecs_cluster.main.id
+  task_definition = aws_ecs_task_definition.workspace_router.arn
+  desired_count   = 2
+  launch_type     = "FARGATE"
+
+  network_configuration {
+    subnets          = var.private_subnets
+    security_groups  = [aws_security_group.ecs.id]
+    assign_public_ip = false
+  }
+
+  load_balancer {
+    target_group_arn = var.codeserver_target_group_arn
+    container_name   = "workspace-router"
+    container_port   = 8080
+  }
+
+  deployment_maximum_percent         = 200
+  deployment_minimum_healthy_percent = 100
+
+  deployment_circuit_breaker {
+    enable   = true
+    rollback = true
+  }
+
+  tags = var.tags
+}
+
+# Router tasks reach workspace tasks that share the ECS security group
+resource "aws_security_group_rule" "workspace_router_codeserver" {
+  count = local.workspace_router_enabled ? 1 : 0
+
+  type                     = "ingress"
+  from_port                = 8080
+  to_port                  = 8080
+  protocol                 = "tcp"
+  security_group_id        = aws_security_group.ecs.id
+  source_security_group_id = aws_security_group.ecs.id
+  description              = "Code-Server from workspace router"
+}
+
+resource "aws_security_group_rule" "workspace_router_openvscode" {
+  count = local.workspace_router_enabled ? 1 : 0
+
+  type                     = "ingress"
+  from_port                = 3000
+  to_port                  = 3000
+  protocol                 = "tcp"
+  security_group_id        = aws_security_group.ecs.id
+  source_security_group_id = aws_security_group.ecs.id
+  description              = "OpenVSCode from workspace router"
+}
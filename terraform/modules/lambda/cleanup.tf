@@ -0,0 +1,127 @@
+# ============================================
+# WORKSPACE CLEANUP LAMBDA
+# Stopped codeserver tasks are queued in SQS and cleaned up in batches;
+# failed messages are retried individually, then parked in the DLQ
+# ============================================
+
+data "archive_file" "cleanup" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/cleanup.zip"
+}
+
+resource "aws_lambda_function" "cleanup" {
+  filename         = data.archive_file.cleanup.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-cleanup"
+  role             = aws_iam_role.lambda.arn
+  handler          = "workspace_cleanup.lambda_handler"
+  source_code_hash = data.archive_file.cleanup.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 120
+  memory_size      = 256
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER          = var.ecs_cluster_name
+      TASK_DEFINITION      = var.codeserver_task_definition_arn
+      SUBNETS              = join(",", var.private_subnets)
+      SECURITY_GROUP       = var.codeserver_security_group_id
+      CAPACITY_POLICY      = var.capacity_policy
+      DYNAMODB_TABLE       = aws_dynamodb_table.workspaces.name
+      PRIORITY_TABLE       = aws_dynamodb_table.rule_priorities.name
+      ALB_LISTENER_ARN     = var.alb_listener_arn
+      ROUTING_SHARDS       = jsonencode(var.workspace_routing_shards)
+      SUPABASE_URL         = var.supabase_url
+      SUPABASE_SERVICE_KEY = var.supabase_service_key
+      SUPABASE_RETRY_TABLE = aws_dynamodb_table.supabase_retry.name
+      CLEANUP_CONCURRENCY  = tostring(var.cleanup_concurrency)
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.cleanup]
+}
+
+resource "aws_cloudwatch_log_group" "cleanup" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-cleanup"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+resource "aws_sqs_queue" "cleanup_dlq" {
+  name                      = "${var.project_name}-${var.environment}-workspace-cleanup-dlq"
+  message_retention_seconds = 1209600
+
+  tags = var.tags
+}
+
+resource "aws_sqs_queue" "cleanup" {
+  name = "${var.project_name}-${var.environment}-workspace-cleanup"
+  # Six times the function timeout, as Lambda recommends for event source queues
+  visibility_timeout_seconds = 720
+  message_retention_seconds  = 345600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.cleanup_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = var.tags
+}
+
+resource "aws_sqs_queue_policy" "cleanup" {
+  queue_url = aws_sqs_queue.cleanup.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "events.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.cleanup.arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = aws_cloudwatch_event_rule.codeserver_stopped.arn }
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_cloudwatch_event_rule" "codeserver_stopped" {
+  name        = "${var.project_name}-${var.environment}-codeserver-stopped"
+  description = "Stopped workspace tasks, queued for cleanup"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ecs"]
+    detail-type = ["ECS Task State Change"]
+    detail = {
+      clusterArn = [var.ecs_cluster_arn]
+      lastStatus = ["STOPPED"]
+    }
+  })
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "codeserver_stopped" {
+  rule      = aws_cloudwatch_event_rule.codeserver_stopped.name
+  target_id = "workspace-cleanup-queue"
+  arn       = aws_sqs_queue.cleanup.arn
+}
+
+resource "aws_lambda_event_source_mapping" "cleanup" {
+  event_source_arn                   = aws_sqs_queue.cleanup.arn
+  function_name                      = aws_lambda_function.cleanup.arn
+  batch_size                         = var.cleanup_batch_size
+  maximum_batching_window_in_seconds = 5
+  # Only the messages listed in batchItemFailures go back to the queue
+  function_response_types = ["ReportBatchItemFailures"]
+}
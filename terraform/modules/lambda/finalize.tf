@@ -0,0 +1,86 @@
+# ============================================
+# WORKSPACE FINALIZE LAMBDA
+# Second phase of provisioner.py: routes a submitted task once ECS reports
+# it RUNNING (target group, ALB rule) and marks the workspace running
+# ============================================
+
+data "archive_file" "finalize" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/finalize.zip"
+}
+
+resource "aws_lambda_function" "finalize" {
+  filename         = data.archive_file.finalize.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-finalize"
+  role             = aws_iam_role.lambda.arn
+  handler          = "provisioner.finalize_handler"
+  source_code_hash = data.archive_file.finalize.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 120
+  memory_size      = 256
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER        = var.ecs_cluster_name
+      DYNAMODB_TABLE     = aws_dynamodb_table.workspaces.name
+      PRIORITY_TABLE     = aws_dynamodb_table.rule_priorities.name
+      ROUTING_MODE       = var.workspace_routing_mode
+      DOMAIN             = var.domain
+      VPC_ID             = var.vpc_id
+      ALB_LISTENER_ARN   = var.alb_listener_arn
+      ROUTING_SHARDS     = jsonencode(var.workspace_routing_shards)
+      # Seconds; used to stamp expires_at/expires_bucket for the terminator
+      INACTIVITY_TIMEOUT = tostring(var.workspace_inactivity_timeout * 60)
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.finalize]
+}
+
+resource "aws_cloudwatch_log_group" "finalize" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-finalize"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+# Standalone workspace tasks (run_task, ECS group family:*) reaching RUNNING;
+# service tasks are status_sync's. Tasks with no provisioning row are skipped.
+resource "aws_cloudwatch_event_rule" "workspace_finalize" {
+  name        = "${var.project_name}-${var.environment}-workspace-finalize"
+  description = "ECS RUNNING events for submitted workspace tasks"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ecs"]
+    detail-type = ["ECS Task State Change"]
+    detail = {
+      clusterArn = [var.ecs_cluster_arn]
+      group      = [{ prefix = "family:" }]
+      lastStatus = ["RUNNING"]
+    }
+  })
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "workspace_finalize" {
+  rule      = aws_cloudwatch_event_rule.workspace_finalize.name
+  target_id = "workspace-finalize"
+  arn       = aws_lambda_function.finalize.arn
+}
+
+resource "aws_lambda_permission" "workspace_finalize" {
+  statement_id  = "AllowExecutionFromWorkspaceFinalizeEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.finalize.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.workspace_finalize.arn
+}
@@ -0,0 +1,46 @@
+# ============================================
+# WORKSPACE HEARTBEAT LAMBDA
+# Records IDE activity (last_activity) for idle detection; invoked with
+# batches the backend buffers from its POST /api/workspaces/heartbeat route
+# ============================================
+
+data "archive_file" "heartbeat" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/heartbeat.zip"
+}
+
+resource "aws_lambda_function" "heartbeat" {
+  filename         = data.archive_file.heartbeat.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-heartbeat"
+  role             = aws_iam_role.lambda.arn
+  handler          = "heartbeat.lambda_handler"
+  source_code_hash = data.archive_file.heartbeat.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 30
+  memory_size      = 128
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      DYNAMODB_TABLE        = aws_dynamodb_table.workspaces.name
+      INACTIVITY_TIMEOUT    = tostring(var.workspace_inactivity_timeout * 60)
+      HEARTBEAT_GRANULARITY = tostring(var.heartbeat_granularity)
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.heartbeat]
+}
+
+resource "aws_cloudwatch_log_group" "heartbeat" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-heartbeat"
+  retention_in_days = 14
+  tags              = var.tags
+}
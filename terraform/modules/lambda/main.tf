@@ -56,6 +56,8 @@ resource "aws_iam_role_policy" "lambda" {
           "ecs:StopTask",
           "ecs:DescribeTasks",
           "ecs:ListTasks",
+          "ecs:ListServices",
+          "ecs:DescribeServices",
           "ecs:UpdateService",
           "ecs:TagResource"
         ]
@@ -78,7 +80,13 @@ resource "aws_iam_role_policy" "lambda" {
           "elasticloadbalancing:CreateRule",
           "elasticloadbalancing:DeleteRule",
           "elasticloadbalancing:ModifyRule",
-          "elasticloadbalancing:DescribeRules"
+          "elasticloadbalancing:DescribeRules",
+          "elasticloadbalancing:CreateTargetGroup",
+          "elasticloadbalancing:DeleteTargetGroup",
+          "elasticloadbalancing:ModifyTargetGroupAttributes",
+          "elasticloadbalancing:AddTags",
+          "elasticloadbalancing:RemoveTags",
+          "elasticloadbalancing:DescribeTags"
         ]
         Resource = "*"
       },
@@ -109,11 +117,31 @@ resource "aws_iam_role_policy" "lambda" {
         ]
         Resource = "*"
       },
+      {
+        # Terminator re-invokes itself to resume a checkpointed sweep
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:${var.aws_region}:*:function:${var.project_name}-${var.environment}-workspace-*"
+      },
+      {
+        # Workspace cleanup consumes the stopped-task queue
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = "arn:aws:sqs:${var.aws_region}:*:${var.project_name}-${var.environment}-workspace-cleanup"
+      },
       {
         Effect = "Allow"
         Action = [
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem",
           "dynamodb:Query",
@@ -136,6 +164,61 @@ resource "aws_dynamodb_table" "workspaces" {
     type = "S"
   }
 
+  attribute {
+    name = "task_arn"
+    type = "S"
+  }
+
+  attribute {
+    name = "service_name"
+    type = "S"
+  }
+
+  attribute {
+    name = "expires_bucket"
+    type = "N"
+  }
+
+  attribute {
+    name = "expires_at"
+    type = "N"
+  }
+
+  attribute {
+    name = "route_host"
+    type = "S"
+  }
+
+  # ECS state change events carry the task ARN / service group, not the student
+  global_secondary_index {
+    name            = "task_arn-index"
+    hash_key        = "task_arn"
+    projection_type = "ALL"
+  }
+
+  global_secondary_index {
+    name            = "service_name-index"
+    hash_key        = "service_name"
+    projection_type = "ALL"
+  }
+
+  # Sparse: only running workspaces carry expires_bucket/expires_at
+  global_secondary_index {
+    name            = "expiry-index"
+    hash_key        = "expires_bucket"
+    range_key       = "expires_at"
+    projection_type = "ALL"
+  }
+
+  # Sparse: rows carry route_host (ws-<short_id>) only while they carry task_ip.
+  # The workspace router queries it on a miss and scans it to refresh.
+  global_secondary_index {
+    name               = "route_host-index"
+    hash_key           = "route_host"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["task_ip", "task_port"]
+  }
+
   ttl {
     attribute_name = "ttl"
     enabled        = true
@@ -146,6 +229,84 @@ resource "aws_dynamodb_table" "workspaces" {
   })
 }
 
+# DynamoDB Table for ALB Rule Priorities
+# One counter item per listener (priority = 0) plus one item per released priority
+resource "aws_dynamodb_table" "rule_priorities" {
+  name         = "${var.project_name}-${var.environment}-rule-priorities"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "listener_arn"
+  range_key    = "priority"
+
+  attribute {
+    name = "listener_arn"
+    type = "S"
+  }
+
+  attribute {
+    name = "priority"
+    type = "N"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.project_name}-${var.environment}-rule-priorities"
+  })
+}
+
+# DynamoDB Table for Supabase writes that failed, replayed by the sync sweeper
+resource "aws_dynamodb_table" "supabase_retry" {
+  name         = "${var.project_name}-${var.environment}-supabase-retry"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "student_id"
+
+  attribute {
+    name = "student_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ttl"
+    enabled        = true
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.project_name}-${var.environment}-supabase-retry"
+  })
+}
+
+# DynamoDB Table for the Warm Pool of pre-started workspace tasks
+resource "aws_dynamodb_table" "warm_pool" {
+  name         = "${var.project_name}-${var.environment}-warm-pool"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "task_arn"
+
+  attribute {
+    name = "task_arn"
+    type = "S"
+  }
+
+  attribute {
+    name = "pool_status"
+    type = "S"
+  }
+
+  attribute {
+    name = "started_at"
+    type = "N"
+  }
+
+  # starting -> idle -> claimed; claims query the idle partition
+  global_secondary_index {
+    name            = "pool_status-index"
+    hash_key        = "pool_status"
+    range_key       = "started_at"
+    projection_type = "ALL"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.project_name}-${var.environment}-warm-pool"
+  })
+}
+
 # CloudWatch Log Groups for Lambda
 resource "aws_cloudwatch_log_group" "provisioner" {
   name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-provisioner"
@@ -22,6 +22,26 @@ output "terminator_function_name" {
   value       = aws_lambda_function.terminator.function_name
 }
 
+output "heartbeat_function_arn" {
+  description = "Workspace heartbeat Lambda ARN"
+  value       = aws_lambda_function.heartbeat.arn
+}
+
+output "heartbeat_function_name" {
+  description = "Workspace heartbeat Lambda name"
+  value       = aws_lambda_function.heartbeat.function_name
+}
+
+output "warm_pool_function_name" {
+  description = "Warm pool maintenance Lambda name"
+  value       = aws_lambda_function.warm_pool.function_name
+}
+
+output "warm_pool_table_name" {
+  description = "DynamoDB table name for the warm pool"
+  value       = aws_dynamodb_table.warm_pool.name
+}
+
 output "workspaces_table_name" {
   description = "DynamoDB table name for workspaces"
   value       = aws_dynamodb_table.workspaces.name
@@ -32,8 +52,23 @@ output "workspaces_table_arn" {
   value       = aws_dynamodb_table.workspaces.arn
 }
 
+output "rule_priorities_table_name" {
+  description = "DynamoDB table name for ALB rule priority allocation"
+  value       = aws_dynamodb_table.rule_priorities.name
+}
+
 output "lambda_security_group_id" {
   description = "Lambda security group ID"
   value       = aws_security_group.lambda.id
 }
 
+
+output "cleanup_queue_url" {
+  description = "Queue of stopped workspace tasks awaiting cleanup"
+  value       = aws_sqs_queue.cleanup.url
+}
+
+output "cleanup_dlq_url" {
+  description = "Stopped-task events the cleanup Lambda gave up on"
+  value       = aws_sqs_queue.cleanup_dlq.url
+}
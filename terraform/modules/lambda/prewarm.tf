@@ -0,0 +1,82 @@
+# ============================================
+# WORKSPACE PREWARM LAMBDA
+# Starts enrolled students' workspaces ahead of scheduled sessions
+# ============================================
+
+data "archive_file" "prewarm" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/prewarm.zip"
+}
+
+resource "aws_lambda_function" "prewarm" {
+  filename         = data.archive_file.prewarm.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-prewarm"
+  role             = aws_iam_role.lambda.arn
+  handler          = "prewarm.lambda_handler"
+  source_code_hash = data.archive_file.prewarm.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 300
+  memory_size      = 256
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER          = var.ecs_cluster_name
+      TASK_DEFINITION      = var.openvscode_task_definition_arn
+      SUBNETS              = join(",", var.private_subnets)
+      SECURITY_GROUP       = var.workspace_security_group_id
+      DYNAMODB_TABLE       = aws_dynamodb_table.workspaces.name
+      PRIORITY_TABLE       = aws_dynamodb_table.rule_priorities.name
+      ROUTING_MODE         = var.workspace_routing_mode
+      DOMAIN               = var.domain
+      VPC_ID               = var.vpc_id
+      ALB_LISTENER_ARN     = var.alb_listener_arn
+      ROUTING_SHARDS       = jsonencode(var.workspace_routing_shards)
+      SUPABASE_URL         = var.supabase_url
+      SUPABASE_SERVICE_KEY = var.supabase_service_key
+      SUPABASE_RETRY_TABLE = aws_dynamodb_table.supabase_retry.name
+      PREWARM_LEAD_SECONDS = tostring(var.prewarm_lead_minutes * 60)
+      CAPACITY_POLICY      = var.capacity_policy
+      # Seconds; mark_resumed stamps expires_at/expires_bucket for the terminator
+      INACTIVITY_TIMEOUT   = tostring(var.workspace_inactivity_timeout * 60)
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.prewarm]
+}
+
+resource "aws_cloudwatch_log_group" "prewarm" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-prewarm"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+resource "aws_cloudwatch_event_rule" "prewarm" {
+  name                = "${var.project_name}-${var.environment}-workspace-prewarm"
+  description         = "Pre-warm workspaces for upcoming batch sessions"
+  schedule_expression = "rate(5 minutes)"
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "prewarm" {
+  rule      = aws_cloudwatch_event_rule.prewarm.name
+  target_id = "workspace-prewarm"
+  arn       = aws_lambda_function.prewarm.arn
+}
+
+resource "aws_lambda_permission" "prewarm" {
+  statement_id  = "AllowExecutionFromPrewarmSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.prewarm.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.prewarm.arn
+}
@@ -4,10 +4,11 @@
 # Synced with AWS - December 2024
 # ============================================
 
-# Lambda Code Archive
+# Lambda Code Archive (handlers share modules such as rule_priorities.py)
 data "archive_file" "provisioner" {
   type        = "zip"
-  source_file = "${path.root}/lambda_code/index.py"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
   output_path = "${path.module}/lambda_functions/provisioner.zip"
 }
 
@@ -34,11 +35,25 @@ resource "aws_lambda_function" "provisioner" {
       SUBNETS          = join(",", var.private_subnets)
       SECURITY_GROUP   = var.workspace_security_group_id
       DYNAMODB_TABLE   = aws_dynamodb_table.workspaces.name
+      PRIORITY_TABLE   = aws_dynamodb_table.rule_priorities.name
+      ROUTING_MODE     = var.workspace_routing_mode
       DOMAIN           = var.domain
       VPC_ID           = var.vpc_id
       ALB_ARN          = var.alb_arn
       ALB_LISTENER_ARN = var.alb_listener_arn
+      ROUTING_SHARDS   = jsonencode(var.workspace_routing_shards)
       PASSWORD         = var.workspace_password
+      CAPACITY_POLICY  = var.capacity_policy
+      # Seconds; used to stamp expires_at/expires_bucket for the terminator
+      INACTIVITY_TIMEOUT = tostring(var.workspace_inactivity_timeout * 60)
+      # Warm pool hand-over (OpenVSCode tasks, as above)
+      WARM_POOL_TABLE    = aws_dynamodb_table.warm_pool.name
+      WARM_POOL_SIZE     = tostring(var.warm_pool_size)
+      WARM_POOL_FUNCTION = aws_lambda_function.warm_pool.function_name
+      # Provisioning results are synced to the dashboard; failed writes are parked for the sweeper
+      SUPABASE_URL         = var.supabase_url
+      SUPABASE_SERVICE_KEY = var.supabase_service_key
+      SUPABASE_RETRY_TABLE = aws_dynamodb_table.supabase_retry.name
     }
   }
 
@@ -0,0 +1,72 @@
+# ============================================
+# ROUTING RECONCILER LAMBDA
+# Deletes ws-* target groups and listener rules no workspace refers to
+# ============================================
+
+data "archive_file" "reconciler" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/reconciler.zip"
+}
+
+resource "aws_lambda_function" "reconciler" {
+  filename         = data.archive_file.reconciler.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-reconciler"
+  role             = aws_iam_role.lambda.arn
+  handler          = "reconciler.lambda_handler"
+  source_code_hash = data.archive_file.reconciler.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 300
+  memory_size      = 256
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER      = var.ecs_cluster_name
+      DYNAMODB_TABLE   = aws_dynamodb_table.workspaces.name
+      WARM_POOL_TABLE  = aws_dynamodb_table.warm_pool.name
+      PRIORITY_TABLE   = aws_dynamodb_table.rule_priorities.name
+      ALB_LISTENER_ARN = var.alb_listener_arn
+      ROUTING_SHARDS   = jsonencode(var.workspace_routing_shards)
+      # Seconds a resource must stay unreferenced before it is deleted
+      ORPHAN_GRACE     = tostring(var.reconciler_orphan_grace)
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.reconciler]
+}
+
+resource "aws_cloudwatch_log_group" "reconciler" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-reconciler"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+resource "aws_cloudwatch_event_rule" "reconcile_routing" {
+  name                = "${var.project_name}-${var.environment}-reconcile-workspace-routing"
+  description         = "Garbage-collect orphaned workspace target groups and ALB rules"
+  schedule_expression = "rate(30 minutes)"
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "reconcile_routing" {
+  rule      = aws_cloudwatch_event_rule.reconcile_routing.name
+  target_id = "workspace-reconciler"
+  arn       = aws_lambda_function.reconciler.arn
+}
+
+resource "aws_lambda_permission" "reconcile_routing" {
+  statement_id  = "AllowExecutionFromReconcileSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.reconciler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.reconcile_routing.arn
+}
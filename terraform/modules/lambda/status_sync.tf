@@ -0,0 +1,114 @@
+# ============================================
+# WORKSPACE STATUS SYNC LAMBDA
+# Keeps service-based workspace rows current from ECS task state changes
+# (status, task_status, task IP for the workspace router)
+# ============================================
+
+data "archive_file" "status_sync" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/status_sync.zip"
+}
+
+resource "aws_lambda_function" "status_sync" {
+  filename         = data.archive_file.status_sync.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-status-sync"
+  role             = aws_iam_role.lambda.arn
+  handler          = "workspace_status.lambda_handler"
+  source_code_hash = data.archive_file.status_sync.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 30
+  memory_size      = 128
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER        = var.ecs_cluster_name
+      DYNAMODB_TABLE     = aws_dynamodb_table.workspaces.name
+      INACTIVITY_TIMEOUT = tostring(var.workspace_inactivity_timeout * 60)
+      CAPACITY_POLICY    = var.capacity_policy
+      # Running workspaces are synced to the dashboard; failed writes are parked for the sweeper
+      SUPABASE_URL         = var.supabase_url
+      SUPABASE_SERVICE_KEY = var.supabase_service_key
+      SUPABASE_RETRY_TABLE = aws_dynamodb_table.supabase_retry.name
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.status_sync]
+}
+
+resource "aws_cloudwatch_log_group" "status_sync" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-status-sync"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+# Service-based workspace tasks (ECS group service:ws-*) starting and stopping
+resource "aws_cloudwatch_event_rule" "workspace_status" {
+  name        = "${var.project_name}-${var.environment}-workspace-status"
+  description = "ECS state changes for workspace service tasks"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ecs"]
+    detail-type = ["ECS Task State Change"]
+    detail = {
+      clusterArn = [var.ecs_cluster_arn]
+      group      = [{ prefix = "service:ws-" }]
+      lastStatus = ["RUNNING", "STOPPED"]
+    }
+  })
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "workspace_status" {
+  rule      = aws_cloudwatch_event_rule.workspace_status.name
+  target_id = "workspace-status-sync"
+  arn       = aws_lambda_function.status_sync.arn
+}
+
+resource "aws_lambda_permission" "workspace_status" {
+  statement_id  = "AllowExecutionFromWorkspaceStatusEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.status_sync.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.workspace_status.arn
+}
+
+# Workspace services ECS could not place a task for (no Spot capacity)
+resource "aws_cloudwatch_event_rule" "workspace_placement" {
+  name        = "${var.project_name}-${var.environment}-workspace-placement"
+  description = "ECS task placement failures for workspace services"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ecs"]
+    detail-type = ["ECS Service Action"]
+    detail = {
+      clusterArn = [var.ecs_cluster_arn]
+      eventName  = ["SERVICE_TASK_PLACEMENT_FAILURE"]
+    }
+  })
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "workspace_placement" {
+  rule      = aws_cloudwatch_event_rule.workspace_placement.name
+  target_id = "workspace-status-sync"
+  arn       = aws_lambda_function.status_sync.arn
+}
+
+resource "aws_lambda_permission" "workspace_placement" {
+  statement_id  = "AllowExecutionFromWorkspacePlacementEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.status_sync.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.workspace_placement.arn
+}
@@ -0,0 +1,67 @@
+# ============================================
+# SUPABASE SYNC SWEEPER LAMBDA
+# Replays Supabase writes the handlers parked in the retry table
+# ============================================
+
+data "archive_file" "supabase_sync" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/supabase_sync.zip"
+}
+
+resource "aws_lambda_function" "supabase_sync" {
+  filename         = data.archive_file.supabase_sync.output_path
+  function_name    = "${var.project_name}-${var.environment}-supabase-sync"
+  role             = aws_iam_role.lambda.arn
+  handler          = "supabase_sync.sweep_handler"
+  source_code_hash = data.archive_file.supabase_sync.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 120
+  memory_size      = 128
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      SUPABASE_URL         = var.supabase_url
+      SUPABASE_SERVICE_KEY = var.supabase_service_key
+      SUPABASE_RETRY_TABLE = aws_dynamodb_table.supabase_retry.name
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.supabase_sync]
+}
+
+resource "aws_cloudwatch_log_group" "supabase_sync" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-supabase-sync"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+resource "aws_cloudwatch_event_rule" "supabase_sync" {
+  name                = "${var.project_name}-${var.environment}-supabase-sync"
+  description         = "Replay parked Supabase writes"
+  schedule_expression = "rate(5 minutes)"
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "supabase_sync" {
+  rule      = aws_cloudwatch_event_rule.supabase_sync.name
+  target_id = "supabase-sync"
+  arn       = aws_lambda_function.supabase_sync.arn
+}
+
+resource "aws_lambda_permission" "supabase_sync" {
+  statement_id  = "AllowExecutionFromSupabaseSyncSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.supabase_sync.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.supabase_sync.arn
+}
@@ -68,6 +68,78 @@ variable "workspace_inactivity_timeout" {
   default     = 15
 }
 
+variable "prewarm_lead_minutes" {
+  description = "Minutes before a batch session to start its students' workspaces"
+  type        = number
+  default     = 10
+}
+
+variable "supabase_url" {
+  description = "Supabase project URL used by the workspace Lambdas"
+  type        = string
+  default     = ""
+}
+
+variable "supabase_service_key" {
+  description = "Supabase service role key used by the workspace Lambdas"
+  type        = string
+  default     = ""
+  sensitive   = true
+}
+
+variable "warm_pool_size" {
+  description = "Idle pre-started workspace tasks to keep ready (0 disables the warm pool)"
+  type        = number
+  default     = 0
+}
+
+variable "heartbeat_granularity" {
+  description = "Seconds between last_activity writes for an active workspace"
+  type        = number
+  default     = 60
+}
+
+variable "terminator_scan_segments" {
+  description = "Parallel scan segments used by the inactivity sweep"
+  type        = number
+  default     = 4
+}
+
+variable "terminator_stop_concurrency" {
+  description = "Concurrent workspace stop calls during the inactivity sweep"
+  type        = number
+  default     = 10
+}
+
+variable "reconciler_orphan_grace" {
+  description = "Seconds a workspace target group or ALB rule must stay unreferenced before the reconciler deletes it"
+  type        = number
+  default     = 900
+}
+
+variable "cleanup_batch_size" {
+  description = "Stopped-task events the cleanup Lambda receives per SQS batch"
+  type        = number
+  default     = 50
+}
+
+variable "cleanup_concurrency" {
+  description = "Workspaces the cleanup Lambda tears down in parallel per batch"
+  type        = number
+  default     = 8
+}
+
+variable "capacity_policy" {
+  description = "Fargate placement for workspace tasks and services: spot-first (Spot, on-demand fallback), spot or on-demand"
+  type        = string
+  default     = "spot-first"
+
+  validation {
+    condition     = contains(["spot-first", "spot", "on-demand"], var.capacity_policy)
+    error_message = "capacity_policy must be \"spot-first\", \"spot\" or \"on-demand\"."
+  }
+}
+
 variable "alb_arn" {
   description = "ALB ARN for workspace routing"
   type        = string
@@ -78,6 +150,29 @@ variable "alb_listener_arn" {
   type        = string
 }
 
+variable "workspace_routing_mode" {
+  description = "Workspace routing: 'rules' (a listener rule per workspace) or 'router' (wildcard rule plus workspace router)"
+  type        = string
+  default     = "rules"
+
+  validation {
+    condition     = contains(["rules", "router"], var.workspace_routing_mode)
+    error_message = "workspace_routing_mode must be \"rules\" or \"router\"."
+  }
+}
+
+variable "workspace_routing_shards" {
+  description = "Listeners workspace hosts are consistent-hashed over (name, listener_arn, domain, weight, draining); empty uses alb_listener_arn and domain"
+  type = list(object({
+    name         = string
+    listener_arn = string
+    domain       = string
+    weight       = optional(number, 1)
+    draining     = optional(bool, false)
+  }))
+  default = []
+}
+
 variable "domain" {
   description = "Domain for workspace URLs"
   type        = string
@@ -0,0 +1,106 @@
+# ============================================
+# WARM POOL LAMBDA
+# Keeps pre-started OpenVSCode tasks (the provisioner's task definition)
+# ready for instant attach
+# ============================================
+
+data "archive_file" "warm_pool" {
+  type        = "zip"
+  source_dir  = "${path.root}/lambda_code"
+  excludes    = ["__pycache__"]
+  output_path = "${path.module}/lambda_functions/warm_pool.zip"
+}
+
+resource "aws_lambda_function" "warm_pool" {
+  filename         = data.archive_file.warm_pool.output_path
+  function_name    = "${var.project_name}-${var.environment}-workspace-warm-pool"
+  role             = aws_iam_role.lambda.arn
+  handler          = "warm_pool.lambda_handler"
+  source_code_hash = data.archive_file.warm_pool.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 60
+  memory_size      = 128
+
+  vpc_config {
+    subnet_ids         = var.private_subnets
+    security_group_ids = [aws_security_group.lambda.id]
+  }
+
+  environment {
+    variables = {
+      ECS_CLUSTER     = var.ecs_cluster_name
+      TASK_DEFINITION = var.openvscode_task_definition_arn
+      SUBNETS         = join(",", var.private_subnets)
+      SECURITY_GROUP  = var.workspace_security_group_id
+      VPC_ID          = var.vpc_id
+      WARM_POOL_TABLE = aws_dynamodb_table.warm_pool.name
+      WARM_POOL_SIZE  = tostring(var.warm_pool_size)
+      ROUTING_MODE    = var.workspace_routing_mode
+      CAPACITY_POLICY = var.capacity_policy
+    }
+  }
+
+  tags = var.tags
+
+  depends_on = [aws_cloudwatch_log_group.warm_pool]
+}
+
+resource "aws_cloudwatch_log_group" "warm_pool" {
+  name              = "/aws/lambda/${var.project_name}-${var.environment}-workspace-warm-pool"
+  retention_in_days = 14
+  tags              = var.tags
+}
+
+# Top the pool up every minute (claims also trigger an async replenish)
+resource "aws_cloudwatch_event_rule" "warm_pool_replenish" {
+  name                = "${var.project_name}-${var.environment}-warm-pool-replenish"
+  description         = "Keep the workspace warm pool at its target size"
+  schedule_expression = "rate(1 minute)"
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "warm_pool_replenish" {
+  rule      = aws_cloudwatch_event_rule.warm_pool_replenish.name
+  target_id = "warm-pool-replenish"
+  arn       = aws_lambda_function.warm_pool.arn
+}
+
+resource "aws_lambda_permission" "warm_pool_replenish" {
+  statement_id  = "AllowExecutionFromWarmPoolSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.warm_pool.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.warm_pool_replenish.arn
+}
+
+# Pool task lifecycle: RUNNING marks a task idle, STOPPED drops it
+resource "aws_cloudwatch_event_rule" "warm_pool_tasks" {
+  name        = "${var.project_name}-${var.environment}-warm-pool-tasks"
+  description = "ECS state changes for warm pool tasks"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ecs"]
+    detail-type = ["ECS Task State Change"]
+    detail = {
+      clusterArn = [var.ecs_cluster_arn]
+      startedBy  = ["warm-pool"]
+    }
+  })
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "warm_pool_tasks" {
+  rule      = aws_cloudwatch_event_rule.warm_pool_tasks.name
+  target_id = "warm-pool-tasks"
+  arn       = aws_lambda_function.warm_pool.arn
+}
+
+resource "aws_lambda_permission" "warm_pool_tasks" {
+  statement_id  = "AllowExecutionFromWarmPoolTaskEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.warm_pool.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.warm_pool_tasks.arn
+}
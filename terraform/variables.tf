@@ -109,6 +109,24 @@ variable "workspace_inactivity_timeout" {
   default     = 15
 }
 
+variable "workspace_routing_mode" {
+  description = "Workspace routing: 'rules' (a listener rule per workspace, at most ~100) or 'router' (ws-* wildcard rule plus workspace router)"
+  type        = string
+  default     = "rules"
+}
+
+variable "workspace_routing_shards" {
+  description = "ALB listeners to spread workspace hosts over by consistent hash, each with its own domain; empty means the one listener and domain. Keep the current listener in the list and set draining = true to stop new placements on a shard."
+  type = list(object({
+    name         = string
+    listener_arn = string
+    domain       = string
+    weight       = optional(number, 1)
+    draining     = optional(bool, false)
+  }))
+  default = []
+}
+
 # Supabase Configuration
 variable "supabase_url" {
   description = "Supabase project URL"